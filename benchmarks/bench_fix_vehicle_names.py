@@ -0,0 +1,88 @@
+"""Benchmark normalize_vehicle_names() against the original replace loop.
+
+Run from the top of the repo:
+
+    python -m benchmarks.bench_fix_vehicle_names --rows 5000000
+
+"""
+
+
+def normalize_vehicle_names_replace_loop(df):
+
+    """The original implementation: a Series.replace call for every
+    vehicle column and every entry of vehicle_name_map()."""
+
+    from crash_utils.fix_vehicle_names import vehicle_name_map
+
+
+    col_ind = df.columns.str.match("vehicle type")
+    cols = df.columns[col_ind].tolist()
+
+    for col in cols:
+        df[col] = df[col].str.lower()
+        df[col] = df[col].str.strip()
+
+    vehicle_map = vehicle_name_map()
+
+    for col in cols:
+        for old, new in vehicle_map.items():
+            df[col] = df[col].replace(old,new, regex = False)
+
+    return df
+
+
+
+def synthetic_vehicle_frame(n_rows, seed=0):
+
+    """Frame of five vehicle type columns drawn from the raw spellings
+    in vehicle_name_map(), in mixed case and with stray white space,
+    plus a few hundred unmapped names and missing values."""
+
+    import numpy as np
+    import pandas as pd
+    from crash_utils.fix_vehicle_names import vehicle_name_map
+
+
+    rng = np.random.default_rng(seed)
+
+    raw = list(vehicle_name_map().keys()) + ["taxi", "bus", "van", "tractor"]
+    raw += [f"vehicle {k}" for k in range(300)]
+    raw = raw + [name.upper() for name in raw] + [f" {name.title()} " for name in raw]
+    raw = np.array(raw + [None] * 200, dtype=object)
+
+    data = {}
+    for k in range(1, 6):
+        data[f"vehicle type code {k}"] = raw[rng.integers(0, len(raw), n_rows)]
+
+    return pd.DataFrame(data)
+
+
+
+if __name__ == "__main__":
+
+    import time
+    import argparse
+    import pandas as pd
+    from crash_utils.fix_vehicle_names import normalize_vehicle_names
+
+
+    my_parser = argparse.ArgumentParser(description="Benchmark the vehicle name normalization")
+    my_parser.add_argument("--rows", type=int, default=5000000, help="Number of rows")
+    args = my_parser.parse_args()
+
+
+    df = synthetic_vehicle_frame(args.rows)
+    print(f"{args.rows} rows, {pd.unique(df.to_numpy().ravel()).size} distinct raw names")
+
+    t_start = time.perf_counter()
+    old = normalize_vehicle_names_replace_loop(df.copy())
+    t_old = time.perf_counter() - t_start
+    print(f"replace loop:   {t_old:8.2f} s")
+
+    t_start = time.perf_counter()
+    new = normalize_vehicle_names(df.copy())
+    t_new = time.perf_counter() - t_start
+    print(f"factorize + map: {t_new:7.2f} s  ({t_old / t_new:.0f}x faster)")
+
+    same = (old.fillna("nan").to_numpy() == new.fillna("nan").to_numpy()).all()
+    print(f"identical output: {same}")
@@ -0,0 +1,59 @@
+"""Benchmark parse_crash_datetime() against the original
+pd.to_datetime(crash date + " " + crash time) of basic_cleaning().
+
+Run from the top of the repo:
+
+    python -m benchmarks.bench_parse_crash_datetime --rows 5000000
+
+The original parses every combined string on its own (pandas can't
+infer a format for it), so it is only timed on --original-rows rows
+and its time scaled up to --rows.
+
+"""
+
+
+if __name__ == "__main__":
+
+    import time
+    import argparse
+    import warnings
+    import pandas as pd
+    from crash_utils.synthetic_crashes import synthetic_crashes
+    from crash_utils.parse_crash_datetime import parse_crash_datetime
+
+
+    my_parser = argparse.ArgumentParser(description="Benchmark the crash datetime parsing")
+    my_parser.add_argument("--rows", type=int, default=5000000, help="Number of rows")
+    my_parser.add_argument("--original-rows", type=int, default=200000,
+                           help="Number of rows to time the original on")
+    args = my_parser.parse_args()
+
+
+    df = synthetic_crashes(args.rows)[["crash date", "crash time"]]
+    n_original = min(args.original_rows, args.rows)
+
+    print(f"{args.rows} rows, {df['crash date'].nunique()} distinct dates, "
+          f"{df['crash time'].nunique()} distinct times")
+
+
+    # pandas warns that it falls back to parsing element by element
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+
+        sample = df.iloc[:n_original]
+
+        t_start = time.perf_counter()
+        old = pd.to_datetime(sample["crash date"] + " " + sample["crash time"])
+        t_old = (time.perf_counter() - t_start) * args.rows / n_original
+
+    print(f"concatenate + to_datetime: {t_old:8.2f} s  (timed on {n_original} rows)")
+
+
+    t_start = time.perf_counter()
+    new = parse_crash_datetime(df["crash date"], df["crash time"])
+    t_new = time.perf_counter() - t_start
+
+    print(f"parse_crash_datetime:      {t_new:8.2f} s  ({t_old / t_new:.0f}x faster)")
+
+    same = old.astype("datetime64[ns]").equals(new.iloc[:n_original])
+    print(f"identical output: {same}")
@@ -0,0 +1,142 @@
+"""Benchmark the SparseReducer methods against the PCA path of the
+notebooks (densify, PCA(n_components=20), random forest).
+
+Run from the top of the repo:
+
+    python -m benchmarks.bench_sparse_reduction --rows 500000
+
+For each method it prints the time and peak memory of fitting the
+reduction and transforming the training and test rows, and the test
+accuracy of a random forest fit on the reduced training rows.
+
+"""
+
+
+def synthetic_design_matrix(n_rows, seed=0):
+
+    """CSR matrix laid out like the output of
+    prepare_data_for_modelling(sparse = True): 6 numeric columns
+    (is_intersection, month, day of week, hour, n_vehicle, n_factor),
+    one-hot borough and zip code columns, and vehicle and contributing
+    factor counts, with a binary outcome that depends on a few of
+    them."""
+
+    import numpy as np
+    import scipy.sparse as sp
+
+
+    rng = np.random.default_rng(seed)
+
+    n_vehicle = rng.integers(1, 4, n_rows)
+    n_factor = rng.integers(1, 4, n_rows)
+
+    numeric = np.column_stack((rng.integers(0, 2, n_rows),
+                               rng.integers(1, 13, n_rows),
+                               rng.integers(0, 7, n_rows),
+                               rng.integers(0, 24, n_rows),
+                               n_vehicle,
+                               n_factor)).astype(float)
+
+    borough = rng.integers(0, 5, n_rows)
+    zip_code = rng.integers(0, 180, n_rows)
+
+
+    # vehicle and factor words, a few much more common than the rest
+    def counts(n_words, n_per_row):
+        p = 1 / np.arange(1, n_words + 1)
+        p /= p.sum()
+        rows = np.repeat(np.arange(n_rows), n_per_row)
+        words = rng.choice(n_words, size=len(rows), p=p)
+        return sp.csr_matrix((np.ones(len(rows)), (rows, words)), shape=(n_rows, n_words))
+
+    vehicles = counts(40, n_vehicle)
+    factors = counts(50, n_factor)
+
+    one_hot = sp.csr_matrix((np.ones(2 * n_rows),
+                             (np.repeat(np.arange(n_rows), 2),
+                              np.column_stack((borough, 5 + zip_code)).ravel())),
+                            shape=(n_rows, 185))
+
+    X = sp.hstack((sp.csr_matrix(numeric), one_hot, vehicles, factors), format="csr")
+
+
+    # injuries are more likely at night, with trucks (word 3), and for
+    # some factors (words 0 and 7)
+    logit = (-0.5 + 0.08 * np.abs(numeric[:, 3] - 12)
+             + 1.5 * vehicles[:, 3].toarray().ravel()
+             + 1.0 * factors[:, 0].toarray().ravel()
+             - 1.2 * factors[:, 7].toarray().ravel()
+             + 0.01 * (zip_code % 7))
+    y = (rng.random(n_rows) < 1 / (1 + np.exp(-logit))).astype(int)
+
+    return X, y
+
+
+
+def measure(func):
+
+    """Run func(), returning its result, the seconds it took and the
+    peak memory it allocated (MB)."""
+
+    import time
+    import tracemalloc
+
+
+    tracemalloc.start()
+    t_start = time.perf_counter()
+
+    result = func()
+
+    elapsed = time.perf_counter() - t_start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, elapsed, peak / 1e6
+
+
+
+if __name__ == "__main__":
+
+    import argparse
+    from sklearn.decomposition import PCA
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import train_test_split
+    from crash_utils.sparse_reduction import SparseReducer
+
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500000)
+    parser.add_argument("--components", type=int, default=20)
+    parser.add_argument("--trees", type=int, default=50)
+    args = parser.parse_args()
+
+
+    X, y = synthetic_design_matrix(args.rows)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, stratify=y, random_state=0)
+
+    print(f"{args.rows} rows, {X.shape[1]} columns, {X.nnz} nonzeros")
+
+
+    def pca_path():
+        pca = PCA(n_components=args.components).fit(X_train.toarray())
+        return pca.transform(X_train.toarray()), pca.transform(X_test.toarray())
+
+    def reducer_path(method):
+        def run():
+            reducer = SparseReducer(method=method, n_components=args.components).fit(X_train)
+            return reducer.transform(X_train), reducer.transform(X_test)
+        return run
+
+    paths = [("PCA (dense)", pca_path)]
+    paths += [(method, reducer_path(method)) for method in ["svd", "incremental", "hashing"]]
+
+
+    for name, path in paths:
+
+        (Z_train, Z_test), elapsed, peak = measure(path)
+
+        rf = RandomForestClassifier(max_depth=40, n_estimators=args.trees, n_jobs=-1, random_state=0)
+        rf.fit(Z_train, y_train)
+
+        print(f"{name:12s}  reduce {elapsed:6.2f} s  peak {peak:8.1f} MB  "
+              f"test accuracy {rf.score(Z_test, y_test):.3f}")
@@ -0,0 +1,221 @@
+"""Time and memory-profile the crash_utils cleaning and modelling steps
+on synthetic crash data (see crash_utils/synthetic_crashes.py) at
+growing sizes, and keep the results as JSON to compare across commits.
+
+Run from the top of the repo:
+
+    python -m benchmarks.run_benchmarks --sizes 10000,100000,1000000,10000000
+    python -m benchmarks.run_benchmarks --compare benchmarks/results/a1b2c3d.json benchmarks/results/e4f5a6b.json
+
+The steps are run in the order of the notebooks, each on a copy of the
+output of the step it depends on:
+    zip_code_and_borough_from_coords    raw crashes
+    fix_vehicle_names                   output of the zip code step
+    basic_cleaning                      output of fix_vehicle_names
+    make_crash_features                 output of basic_cleaning
+    prepare_data_for_modelling          output of basic_cleaning
+For every step and size the wall time, the peak memory allocated
+(tracemalloc, unless --no-memory) and the rows in and out are written
+to benchmarks/results/<commit>.json, along with the commit and the
+Python, pandas and numpy versions.  --compare prints the ratio of the
+times (and peaks) of two such files.
+
+"""
+
+
+def benchmark_steps():
+
+    """(name, function, name of the step whose output it takes) for
+    every step benchmarked; None is the raw synthetic crashes."""
+
+    from crash_utils.zip_code_and_borough_from_coords import zip_code_and_borough_from_coords
+    from crash_utils.fix_vehicle_names import fix_vehicle_names
+    from crash_utils.basic_cleaning import basic_cleaning
+    from crash_utils.make_crash_features import make_crash_features
+    from crash_utils.prepare_data_for_modelling import prepare_data_for_modelling
+
+
+    return [("zip_code_and_borough_from_coords", zip_code_and_borough_from_coords, None),
+            ("fix_vehicle_names", fix_vehicle_names, "zip_code_and_borough_from_coords"),
+            ("basic_cleaning", basic_cleaning, "fix_vehicle_names"),
+            ("make_crash_features", make_crash_features, "basic_cleaning"),
+            ("prepare_data_for_modelling", prepare_data_for_modelling, "basic_cleaning")]
+
+
+
+def run_benchmarks(sizes, track_memory=True, seed=0, verbose=True):
+
+    """Run benchmark_steps() on synthetic_crashes(n_rows) for every
+    n_rows in sizes.  Returns a list of one dict per step and size."""
+
+    import gc
+    import time
+    import tracemalloc
+    from crash_utils.synthetic_crashes import synthetic_crashes
+
+
+    results = []
+
+    for n_rows in sizes:
+
+        outputs = {None: synthetic_crashes(n_rows, seed=seed)}
+
+        for name, func, source in benchmark_steps():
+
+            df = outputs[source].copy()
+            gc.collect()
+
+            if track_memory:
+                tracemalloc.start()
+            t_start = time.perf_counter()
+
+            out = func(df)
+
+            elapsed = time.perf_counter() - t_start
+            peak = None
+            if track_memory:
+                peak = tracemalloc.get_traced_memory()[1] / 1e6
+                tracemalloc.stop()
+
+            outputs[name] = out
+
+            results.append({"step": name,
+                            "rows": n_rows,
+                            "rows in": len(outputs[source]),
+                            "rows out": len(out),
+                            "seconds": round(elapsed, 4),
+                            "peak MB": None if peak is None else round(peak, 1)})
+
+            if verbose:
+                print(_format_result(results[-1]), flush=True)
+
+        del outputs, df, out
+
+
+    return results
+
+
+
+def git_commit():
+
+    """Short hash of the checked out commit (with "-dirty" if there are
+    uncommitted changes), or "unknown" outside of a git checkout."""
+
+    import subprocess
+
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+    return commit + "-dirty" if dirty else commit
+
+
+
+def compare_results(old_file, new_file):
+
+    """Print the time and peak memory of every step and size in two
+    result files, and the new / old ratios."""
+
+    import json
+
+
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+
+    old_results = {(r["step"], r["rows"]): r for r in old["results"]}
+
+    print(f"{old['commit']} -> {new['commit']}")
+
+    for r in new["results"]:
+
+        o = old_results.get((r["step"], r["rows"]))
+        if o is None:
+            continue
+
+        line = f"{r['step']:34s} {r['rows']:>10d}  {o['seconds']:9.3f} s -> {r['seconds']:9.3f} s " \
+               f"({r['seconds'] / max(o['seconds'], 1e-9):5.2f}x)"
+
+        if o["peak MB"] is not None and r["peak MB"] is not None:
+            line += f"  {o['peak MB']:8.1f} MB -> {r['peak MB']:8.1f} MB " \
+                    f"({r['peak MB'] / max(o['peak MB'], 1e-9):5.2f}x)"
+
+        print(line)
+
+
+
+def _format_result(r):
+
+    line = f"{r['step']:34s} {r['rows']:>10d} rows  {r['seconds']:9.3f} s"
+
+    if r["peak MB"] is not None:
+        line += f"  peak {r['peak MB']:9.1f} MB"
+
+    return line + f"  ({r['rows in']} -> {r['rows out']} rows)"
+
+
+
+if __name__ == "__main__":
+
+    import os
+    import sys
+    import json
+    import argparse
+    import platform
+    import warnings
+    import numpy as np
+    import pandas as pd
+
+
+    my_parser = argparse.ArgumentParser(description="Benchmark the crash_utils steps on synthetic data")
+    my_parser.add_argument("--sizes", type=str, default="10000,100000,1000000,10000000",
+                           help="Comma separated numbers of rows")
+    my_parser.add_argument("--no-memory", action="store_true",
+                           help="Don't track peak memory (tracemalloc slows things down)")
+    my_parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data")
+    my_parser.add_argument("--output", type=str, default=None,
+                           help="JSON file for the results (default benchmarks/results/<commit>.json)")
+    my_parser.add_argument("--compare", type=str, nargs=2, metavar=("OLD", "NEW"), default=None,
+                           help="Compare two result files instead of running the benchmarks")
+    args = my_parser.parse_args()
+
+
+    if args.compare is not None:
+        compare_results(*args.compare)
+        sys.exit()
+
+
+    # the cleaning steps warn about chained assignment and the like;
+    # that is not what is being measured here
+    warnings.simplefilter("ignore")
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    commit = git_commit()
+
+    results = run_benchmarks(sizes, track_memory=not args.no_memory, seed=args.seed)
+
+
+    output = args.output
+    if output is None:
+        output = os.path.join("benchmarks", "results", f"{commit}.json")
+
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+
+    with open(output, "w") as f:
+        json.dump({"commit": commit,
+                   "date": pd.Timestamp.now().isoformat(timespec="seconds"),
+                   "python": platform.python_version(),
+                   "pandas": pd.__version__,
+                   "numpy": np.__version__,
+                   "seed": args.seed,
+                   "track memory": not args.no_memory,
+                   "results": results}, f, indent=1)
+
+    print(f"results written to {output}")
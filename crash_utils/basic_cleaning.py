@@ -11,11 +11,12 @@ def basic_cleaning(df):
     8.  Removes rows with no cyclist involvement.
     9.  Sorts rows by "DATETIME"
     10. Drops duplicate rows
+
+    Steps 2-4 and 6-7 only look at one row at a time and are done by
+    clean_crash_rows(), step 8 by bike_crash_mask().
     """
 
-    # imports
-    import pandas as pd
-    import numpy as np
+    from crash_utils.instrumentation import profile_stage
 
 
     # order the columns alphabetically
@@ -23,18 +24,58 @@ def basic_cleaning(df):
 
 
     # first, remove LOCATION.  it is redundant with LATITUDE and LONGITUDE
-    df.drop(columns="location", inplace=True)
+    # (data read from the Parquet store doesn't have it)
+    #
+    # off-street name
+    # list( df["off street name"][~df["off street name"].isna()] )
+    # basically a street address if there is one.  missing 90% of the values
+    df.drop(columns=["location", "off street name"], inplace=True, errors="ignore")
+
+
+    df = clean_crash_rows(df)
+
+
+    # sort the collisions by timestamp.  a stable sort, so that crashes
+    # at the same time stay in the order they came in (and filtering
+    # before or after the sort gives the same result)
+    with profile_stage("sort by datetime", df):
+        df.sort_values(by="datetime", inplace=True, kind="stable", ignore_index=True)
+
 
+    # keep only the crashes involving a cyclist
+    df = df.loc[bike_crash_mask(df)]
+
+
+    # any duplicate rows?
+    with profile_stage("drop duplicates", df):
+        df.drop_duplicates(inplace=True, ignore_index=True)
+
+
+    return df
 
-    # change date and time to datetime64
-    crash_dt = df["crash date"] + " " + df["crash time"]
-    crash_dt = pd.to_datetime(crash_dt)
-    df.insert(0, "datetime", crash_dt)
-    df.drop(columns=["crash date", "crash time"], inplace=True)
 
 
-    # sort the collisions by timestamp
-    df.sort_values(by="datetime", inplace=True, ignore_index=True)
+def clean_crash_rows(df):
+
+    """The cleaning steps of basic_cleaning() that treat every row on its
+    own, so they give the same result whether they are applied to the
+    whole table or to any block of rows from it.
+    """
+
+    # imports
+    import pandas as pd
+    import numpy as np
+    from crash_utils.parse_crash_datetime import parse_crash_datetime
+    from crash_utils.instrumentation import profile_stage
+
+
+    # change date and time to datetime64.  data read from the Parquet
+    # store already has "datetime"
+    if "datetime" not in df.columns:
+        with profile_stage("parse crash datetime", df):
+            crash_dt = parse_crash_datetime(df["crash date"], df["crash time"])
+        df.insert(0, "datetime", crash_dt)
+        df.drop(columns=["crash date", "crash time"], inplace=True)
 
 
     # there are some zeros in the positions
@@ -45,17 +86,10 @@ def basic_cleaning(df):
 
     # correct the mis-spelling of "illness"
     mask = df["contributing factor vehicle 1"].str.fullmatch("illnes", case=False)
-    mask.fillna(False, inplace=True)
+    mask = mask.fillna(False).astype(bool)
     df.loc[mask,"contributing factor vehicle 1"] = "Illness"
 
 
-    
-    # off-street name
-    # list( df["off street name"][~df["off street name"].isna()] )
-    # basically a street address if there is one.  missing 90% of the values
-    df.drop(columns="off street name", inplace=True)
-
-
     # title-ize the street names
     df["on street name"] = df["on street name"].str.title()
     df["cross street name"] = df["cross street name"].str.title()
@@ -65,22 +99,17 @@ def basic_cleaning(df):
     df["borough"] = df["borough"].str.capitalize()
 
 
-    # NUMBER OF PERSONS INJURED and NUMBER OF PERSONS KILLED have a few nans
-    # fix them
-    na_rows = df["number of persons injured"].isna()
-    na_rows = df.loc[na_rows,:].index
-
-    # the first one has no injuries or deaths, but a bike was involved
-    # assume then this was a property damage incident (no injury or
-    # death)
-    df.loc[na_rows[0],"number of persons injured"] = 0
-    df.loc[na_rows[0],"number of persons killed"] = 0
-
-
-    # the second one has a NUMER OF CYCLIST INJURED = 1, but nothing
-    # in the persons injured or persons killed columns
-    df.loc[na_rows[1],"number of persons injured"] = 1
-    df.loc[na_rows[1],"number of persons killed"] = 0
+    # NUMBER OF PERSONS INJURED and NUMBER OF PERSONS KILLED have a few
+    # nans.  fill them in with the sum of the pedestrian, cyclist and
+    # motorist counts.  e.g., one has no injuries or deaths, but a bike
+    # was involved, so assume it was a property damage incident (no
+    # injury or death).  another has NUMBER OF CYCLIST INJURED = 1, but
+    # nothing in the persons injured or persons killed columns.
+    for outcome in ["injured", "killed"]:
+        col = f"number of persons {outcome}"
+        parts = [f"number of {who} {outcome}" for who in ["pedestrians", "cyclist", "motorist"]]
+        total = df[parts].fillna(0).sum(axis=1)
+        df[col] = df[col].fillna(total)
 
 
     # convert the following columns to integer dtypes
@@ -88,21 +117,28 @@ def basic_cleaning(df):
     df["number of persons killed"] = df["number of persons killed"].astype("int")
 
 
-    # remove instances when no bicyclist was involved.  here we state
-    # that "bike" must be mentioned in the "VEHICLES" column, OR that
-    # there must have been a cyclist injuries or fatality
+    return df
+
+
+
+def bike_crash_mask(df):
+
+    """True for the crashes with cyclist involvement.  here we state that
+    "bike" must be mentioned in the "VEHICLES" column, OR that there
+    must have been a cyclist injuries or fatality
+    """
 
     # easiest to search all columsn of VEHICLE TYPE by cat'ing them first
-    col_ind = df.columns.str.match("vehicle_type")
+    col_ind = df.columns.str.match("vehicle type")
     cols = df.columns[col_ind].tolist()
 
-    new_str = df["vehicle type code 1"]
+    new_str = df[cols[0]].astype(object)
     for col in cols[1:]:
-        new_str = new_str.str.cat(df[col], sep=",", na_rep="")
+        new_str = new_str.str.cat(df[col].astype(object), sep=",", na_rep="")
 
 
     # what rows contain "bike"?
-    has_bike = new_str.str.contains("bike")
+    has_bike = new_str.str.contains("bike").fillna(False).astype(bool)
 
 
     # maybe "bike" was recorded in vehicle types.  also check if there
@@ -110,14 +146,4 @@ def basic_cleaning(df):
     cyclist_mask = (df["number of cyclist injured"] > 0) | (df["number of cyclist killed"] > 0)
 
     # combine the masks
-    the_mask = has_bike | cyclist_mask
-
-    # keep only the desired rows
-    df = df.loc[the_mask]
-
-
-    # any duplicate rows?
-    df.drop_duplicates(inplace=True, ignore_index=True)
-
-
-    return df
+    return has_bike | cyclist_mask.fillna(False).astype(bool)
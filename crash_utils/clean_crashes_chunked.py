@@ -0,0 +1,245 @@
+def clean_crashes_chunked(input_path, output_path, chunksize=500000, tmp_dir=None):
+
+    """Run fix_vehicle_names() and basic_cleaning() over a crash table too
+    big to hold in memory, chunksize rows at a time.
+
+    input_path is a csv file (e.g. the full Motor_Vehicle_Collisions_-_Crashes.csv
+    from the NYC Open Data portal) or a Parquet data set written by
+    crash_utils/crash_parquet_store.py.  The cleaned crashes are written
+    to output_path, a csv file if it ends in ".csv", otherwise a Parquet
+    data set with one file per month, named so that reading the
+    directory gives the crashes in datetime order.
+
+    The steps that need the whole table are handled in passes:
+    1.  the vehicle names are normalized block by block and their
+        counts summed, so the "fewer than 5 / 3 incidents -> other"
+        thresholds of fix_vehicle_names() use the counts over the
+        whole table
+    2.  every block is then cleaned and filtered to bike crashes, and
+        written to temporary files partitioned by the year and month of
+        the crash
+    3.  each month is read back on its own, sorted by datetime and
+        de-duplicated (duplicate rows share a datetime, so they always
+        land in the same month), and appended to output_path in
+        order.  Crashes without a datetime get a partition of their
+        own, written last, as sorting the whole table puts them last
+
+    Only one block or one month of crashes is in memory at a time.  The
+    result holds the same rows as
+    basic_cleaning(fix_vehicle_names(df)).  Returns the number of
+    crashes written.
+
+    """
+
+    import os
+    import shutil
+    import tempfile
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from crash_utils.fix_vehicle_names import normalize_vehicle_names
+    from crash_utils.fix_vehicle_names import rare_vehicle_names_from_counts
+    from crash_utils.fix_vehicle_names import vehicle_names_to_other
+    from crash_utils.basic_cleaning import clean_crash_rows, bike_crash_mask
+
+
+    # 1. global counts of the normalized vehicle names
+    counts_1 = pd.Series(dtype=float)
+    counts_2 = pd.Series(dtype=float)
+
+    vehicle_cols = ["vehicle type code 1", "vehicle type code 2"]
+
+    for chunk in _read_chunks(input_path, chunksize, columns=vehicle_cols):
+        chunk = normalize_vehicle_names(chunk)
+        counts_1 = counts_1.add(chunk["vehicle type code 1"].value_counts(), fill_value=0)
+        counts_2 = counts_2.add(chunk["vehicle type code 2"].value_counts(), fill_value=0)
+
+    strs_to_other = rare_vehicle_names_from_counts(counts_1, counts_2)
+
+
+    # 2. clean each block and spill it to disk by month
+    tmp_path = tempfile.mkdtemp(dir=tmp_dir)
+    partitioning = ds.partitioning(pa.schema([("year", pa.int16()), ("month", pa.int8())]),
+                                   flavor="hive")
+    schema = None
+
+    try:
+
+        for k, chunk in enumerate(_read_chunks(input_path, chunksize)):
+
+            chunk = normalize_vehicle_names(chunk)
+            chunk = vehicle_names_to_other(chunk, strs_to_other)
+
+            chunk.sort_index(axis=1, inplace=True)
+            chunk.drop(columns=["location", "off street name"], inplace=True, errors="ignore")
+
+            chunk = clean_crash_rows(chunk)
+            chunk = chunk.loc[bike_crash_mask(chunk)]
+
+            if len(chunk) == 0:
+                continue
+
+            # nullable, so crashes without a datetime go to the null
+            # partition
+            chunk = chunk.assign(year=chunk["datetime"].dt.year.astype("Int16"),
+                                 month=chunk["datetime"].dt.month.astype("Int8"))
+
+            # every block has to be written with the same schema, whatever
+            # dtypes read_csv guessed for it
+            if schema is None:
+                schema = _cleaned_schema(chunk.columns)
+
+            table = _to_table(chunk, schema)
+            ds.write_dataset(table, tmp_path, format="parquet", partitioning=partitioning,
+                             basename_template=f"chunk-{k}-{{i}}.parquet",
+                             existing_data_behavior="overwrite_or_ignore")
+
+
+        # 3. sort and de-duplicate one month at a time
+        n_written = 0
+
+        if schema is None:
+            return n_written
+
+        if os.path.exists(output_path):
+            if os.path.isdir(output_path):
+                shutil.rmtree(output_path)
+            else:
+                os.remove(output_path)
+
+        out_schema = pa.schema([field for field in schema if field.name not in ["year", "month"]])
+
+        dataset = ds.dataset(tmp_path, format="parquet", partitioning=partitioning)
+        months = dataset.to_table(columns=["year", "month"]).group_by(["year", "month"]).aggregate([])
+        months = zip(months["year"].to_pylist(), months["month"].to_pylist())
+        # the crashes without a datetime (year None) last
+        months = sorted(months, key=lambda ym: (ym[0] is None, ym))
+
+        for year, month in months:
+
+            if year is None:
+                expr = ds.field("year").is_null()
+            else:
+                expr = (ds.field("year") == year) & (ds.field("month") == month)
+            df = dataset.to_table(filter=expr).to_pandas()
+
+            df.sort_values(by="datetime", inplace=True, kind="stable", ignore_index=True)
+            df.drop_duplicates(inplace=True, ignore_index=True)
+
+            if output_path.endswith(".csv"):
+                df.drop(columns=["year", "month"]).to_csv(output_path, mode="a", index=False,
+                                                          header=n_written == 0)
+            else:
+                # "part-nat" sorts after the months
+                name = "part-nat" if year is None else f"part-{year:04d}-{month:02d}"
+                table = _to_table(df.drop(columns=["year", "month"]), out_schema)
+                ds.write_dataset(table, output_path, format="parquet",
+                                 basename_template=f"{name}-{{i}}.parquet",
+                                 existing_data_behavior="overwrite_or_ignore")
+
+            n_written += len(df)
+
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+    return n_written
+
+
+
+def _read_chunks(input_path, chunksize, columns=None):
+
+    """Blocks of rows from a csv file or a Parquet data set, with the
+    lower-case column names used by the cleaning functions."""
+
+    import os
+    import pandas as pd
+    from crash_utils.crash_parquet_store import iter_crash_parquet
+
+
+    if os.path.isdir(input_path):
+        yield from iter_crash_parquet(input_path, batch_size=chunksize, columns=columns)
+        return
+
+    # the csv exported from the NYC Open Data portal has upper-case
+    # column names with a few underscores
+    def normalize(name):
+        return name.lower().replace("_", " ")
+
+    usecols = None
+    if columns is not None:
+        usecols = lambda name: normalize(name) in columns
+
+    # read the text columns as strings, even in blocks where they happen
+    # to be all NaN
+    header = pd.read_csv(input_path, nrows=0).columns
+    dtype = {name: str for name in header if not _is_numeric_column(normalize(name))}
+
+    for chunk in pd.read_csv(input_path, chunksize=chunksize, usecols=usecols, dtype=dtype):
+        chunk.columns = chunk.columns.map(normalize)
+        yield chunk
+
+
+
+def _cleaned_schema(columns):
+
+    """Arrow schema for cleaned blocks of crashes.  read_csv can guess
+    different dtypes for the same column in different blocks (e.g. a
+    column of strings that happens to be all NaN), so the types are set
+    by column name: the counts, coordinates and zip codes are numbers,
+    everything else is a string."""
+
+    import pyarrow as pa
+
+
+    fields = []
+
+    for name in columns:
+        if name == "datetime":
+            fields.append((name, pa.timestamp("ns")))
+        elif name == "year":
+            fields.append((name, pa.int16()))
+        elif name == "month":
+            fields.append((name, pa.int8()))
+        elif name in ["number of persons injured", "number of persons killed", "collision id"]:
+            fields.append((name, pa.int64()))
+        elif _is_numeric_column(name):
+            fields.append((name, pa.float64()))
+        else:
+            fields.append((name, pa.string()))
+
+    return pa.schema(fields)
+
+
+
+def _is_numeric_column(name):
+
+    return name.startswith("number of") or name in ["latitude", "longitude",
+                                                    "zip code", "collision id"]
+
+
+
+def _to_table(chunk, schema):
+
+    """Convert a block of crashes to an Arrow table with the given
+    schema."""
+
+    import pandas as pd
+    import pyarrow as pa
+
+
+    arrays = []
+
+    for field in schema:
+
+        values = chunk[field.name]
+
+        if pa.types.is_string(field.type):
+            values = values.astype(object).where(values.notna(), None)
+            values = values.map(lambda x: x if x is None else str(x))
+        elif pa.types.is_floating(field.type):
+            values = pd.to_numeric(values, errors="coerce").astype(float)
+
+        arrays.append(pa.array(values, type=field.type, from_pandas=True))
+
+    return pa.Table.from_arrays(arrays, schema=schema)
@@ -0,0 +1,165 @@
+def to_compact(df):
+
+    """A compact copy of a cleaned crash table (the output of
+    basic_cleaning() or the crash pipeline), holding the same data in
+    a fraction of the memory:
+    1.  the vehicle type and contributing factor columns are
+        categoricals sharing one vocabulary, so the same name has the
+        same integer code in all ten columns
+    2.  on and cross street names share a vocabulary too; borough and
+        zip code are categoricals of their own
+    3.  counts are stored in the narrowest integer type that holds them
+        (int8 for the person counts, which never exceed a few dozen),
+        nullable if they have missing values
+    4.  latitude and longitude are float32 (about a metre at NYC's
+        latitude, plenty for the zip code and grid lookups)
+    5.  is_intersection (on and cross street both known, as in
+        make_crash_features()) is added as a bool column, if df doesn't
+        have it already
+
+    Group-bys on the categorical columns (with observed=True) work on
+    the integer codes instead of hashing strings.  from_compact() gives
+    back a frame with the original dtypes; the dtypes are kept in
+    attrs["compact dtypes"] for it.
+
+    """
+
+    import numpy as np
+    import pandas as pd
+
+
+    dtypes = df.dtypes.to_dict()
+    out = {}
+
+
+    # shared vocabularies
+    vehicle_cols = [col for col in df.columns
+                    if col.startswith("vehicle type") or col.startswith("contributing factor")]
+    street_cols = [col for col in ["on street name", "cross street name"] if col in df.columns]
+
+    shared = {}
+    for cols in [vehicle_cols, street_cols]:
+        if cols:
+            dtype = _shared_categories(df, cols)
+            shared.update({col: dtype for col in cols})
+
+
+    for col in df.columns:
+
+        values = df[col]
+
+        if col in shared:
+            out[col] = values.astype(shared[col])
+        elif col in ["borough", "zip code"]:
+            out[col] = values.astype("category")
+        elif col in ["latitude", "longitude"]:
+            out[col] = values.astype(np.float32)
+        elif col == "is_intersection":
+            out[col] = values.astype(bool)
+        elif col.startswith("number of") or col == "collision id":
+            out[col] = _narrow_integers(values)
+        else:
+            out[col] = values
+
+
+    if "is_intersection" not in df.columns and street_cols == ["on street name", "cross street name"]:
+        out["is_intersection"] = (df["on street name"].notna() & df["cross street name"].notna()).to_numpy()
+
+
+    compact = pd.DataFrame(out, index=df.index)
+    compact.attrs["compact dtypes"] = dtypes
+
+    return compact
+
+
+
+def from_compact(compact, dtypes=None):
+
+    """The crash table to_compact() was made from, with its original
+    columns and dtypes (coordinates to float32 precision).  dtypes
+    defaults to those to_compact() kept in compact.attrs; without them,
+    categoricals become strings, coordinates float64 and counts int64,
+    or float64 where they have missing values."""
+
+    import numpy as np
+    import pandas as pd
+
+
+    if dtypes is None:
+        dtypes = compact.attrs.get("compact dtypes")
+
+    if dtypes is None:
+        dtypes = {}
+        for col in compact.columns:
+            values = compact[col]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                dtypes[col] = values.cat.categories.dtype
+            elif col in ["latitude", "longitude"]:
+                dtypes[col] = np.float64
+            elif col.startswith("number of") or col == "collision id":
+                dtypes[col] = np.float64 if values.isna().any() else np.int64
+            else:
+                dtypes[col] = values.dtype
+
+
+    out = {}
+
+    for col, dtype in dtypes.items():
+
+        values = compact[col]
+
+        if isinstance(values.dtype, pd.CategoricalDtype) and not isinstance(dtype, pd.CategoricalDtype):
+            # missing values come back as the missing value of dtype
+            values = values.astype(object).where(values.notna(), None)
+        elif pd.api.types.is_extension_array_dtype(values.dtype) and not pd.api.types.is_extension_array_dtype(dtype):
+            # nullable integers with missing values
+            values = values.astype(np.float64)
+
+        out[col] = values.astype(dtype)
+
+
+    return pd.DataFrame(out, index=compact.index)
+
+
+
+def _shared_categories(df, cols):
+
+    """One CategoricalDtype with every name in the columns cols, in
+    sorted order."""
+
+    import numpy as np
+    import pandas as pd
+
+
+    names = [pd.unique(df[col].dropna().to_numpy()) for col in cols]
+    names = np.unique(np.concatenate(names).astype(str)) if names else []
+
+    return pd.CategoricalDtype(names)
+
+
+
+def _narrow_integers(values):
+
+    """values in the narrowest integer type holding them: int8, int16,
+    int32 or int64, the nullable (pandas) version if any are
+    missing.  Values that aren't whole numbers are left as they are."""
+
+    import numpy as np
+
+
+    known = values.dropna()
+
+    if len(known) > 0 and not (known == np.round(known)).all():
+        return values
+
+    low = known.min() if len(known) > 0 else 0
+    high = known.max() if len(known) > 0 else 0
+
+    for dtype in [np.int8, np.int16, np.int32, np.int64]:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            break
+
+    if len(known) < len(values):
+        return values.astype(np.dtype(dtype).name.capitalize())
+
+    return values.astype(dtype)
@@ -0,0 +1,307 @@
+class CrashCube:
+
+    """Crash counts aggregated by month, day of week, hour, borough, zip
+    code, vehicles and contributing factors, kept up to date as new
+    crashes arrive.
+
+    The summary statistics notebook groups the whole cleaned crash
+    table again for every figure (injuries by hour, by day of week, per
+    month, by borough, by vehicle, ...).  The cube holds the counts
+        crashes        number of crashes
+        no injury      crashes in which no cyclist was hurt
+        injured        sum of "number of cyclist injured"
+        killed         sum of "number of cyclist killed"
+    and every such breakdown is a group-by of the counts instead:
+
+    cube = CrashCube().update(df)
+    cube.slice("hour")                                  # hourly breakdown
+    cube.slice("month", borough="Brooklyn")
+    cube.slice(["year", "month"], start="2019-01-01")   # time series
+    cube.slice("vehicles")
+
+    A table keyed by every dimension at once would have about one row
+    per crash, so the counts are kept in a few small tables (cuboids)
+    instead, one for every entry of cuboids:
+        month start, borough
+        year, day of week, hour
+        year, borough, zip code
+        year, vehicles
+        year, factors
+    ("month start" is the first day of the month).  Each has a few
+    thousand rows at most, however many crashes are counted.  A slice
+    is a group-by of the smallest cuboid that has all the dimensions it
+    groups or filters by ("year" and "month" can be taken from the
+    month start).  start / end select whole months, or whole years in
+    the cuboids kept by year: those whose first day is in the range.
+    Asking for dimensions no cuboid has together (e.g. hour by
+    vehicles) raises a ValueError.
+
+    update() aggregates the new crashes only and adds their counts to
+    those already in the cuboids.  Collision ids already in the cube
+    are skipped, so an overlapping batch (e.g. from an incremental
+    download) is not counted twice.  save() / load() keep the cube as
+    a directory of Parquet files.
+
+    """
+
+    CUBOIDS = [("month start", "borough"),
+               ("year", "day of week", "hour"),
+               ("year", "borough", "zip code"),
+               ("year", "vehicles"),
+               ("year", "factors")]
+    MEASURES = ["crashes", "no injury", "injured", "killed"]
+
+
+    def __init__(self, cuboids=None):
+
+        import numpy as np
+        import pandas as pd
+
+
+        if cuboids is None:
+            cuboids = self.CUBOIDS
+
+        self.cuboids = {}
+
+        for dims in cuboids:
+            dims = _as_tuple(dims)
+            index = pd.MultiIndex.from_tuples([], names=list(dims))
+            self.cuboids[dims] = pd.DataFrame({col: np.array([], dtype=np.int64) for col in self.MEASURES},
+                                              index=index)
+
+        self.collision_ids = np.array([], dtype=np.int64)
+
+
+    def update(self, df):
+
+        """Add the crashes in df (cleaned crash data, see
+        crash_pipeline.py or basic_cleaning.py) to the cube."""
+
+        import numpy as np
+        import pandas as pd
+
+
+        if "collision id" in df.columns:
+            ids = df["collision id"].to_numpy(dtype=np.int64)
+            new = ~np.isin(ids, self.collision_ids)
+            # and only the first of any repeated id within df
+            new &= ~pd.Series(ids).duplicated().to_numpy()
+            df = df.loc[new]
+            self.collision_ids = np.union1d(self.collision_ids, ids[new])
+
+        if len(df) == 0:
+            return self
+
+
+        rows = _cube_rows(df)
+
+        for dims, counts in self.cuboids.items():
+            added = rows.groupby(list(dims), dropna=False, sort=False)[self.MEASURES].sum()
+            self.cuboids[dims] = _add_counts(counts, added)
+
+
+        return self
+
+
+    def slice(self, by, start=None, end=None, **filters):
+
+        """Counts grouped by the dimension(s) in by, over the crashes
+        in the months (or years) from start up to (not including) end
+        and matching every filter, e.g. borough = "Brooklyn" or hour =
+        [7, 8, 9] (a value or a list of values; dimension names with
+        spaces are written with underscores, zip_code = ...)."""
+
+        import pandas as pd
+
+
+        by = _as_tuple(by)
+        filters = {name.replace("_", " "): value for name, value in filters.items()}
+
+        counts = self._cuboid(set(by) | set(filters)).reset_index()
+        mask = None
+
+        if start is not None or end is not None:
+            if "month start" in counts.columns:
+                first_day = counts["month start"]
+            else:
+                first_day = pd.to_datetime(counts["year"].astype(str), format="%Y")
+            if start is not None:
+                mask = _and(mask, first_day >= pd.Timestamp(start))
+            if end is not None:
+                mask = _and(mask, first_day < pd.Timestamp(end))
+
+        for name, value in filters.items():
+            values = _with_derived(counts, [name])[name]
+            if isinstance(value, (list, tuple, set)):
+                mask = _and(mask, values.isin(value))
+            else:
+                mask = _and(mask, values == value)
+
+        if mask is not None:
+            counts = counts.loc[mask.to_numpy()]
+
+
+        counts = _with_derived(counts, by)
+
+        return counts.groupby(list(by), observed=True, dropna=False)[self.MEASURES].sum().sort_index()
+
+
+    def total(self):
+
+        """The counts over all crashes."""
+
+        return next(iter(self.cuboids.values()))[self.MEASURES].sum()
+
+
+    def save(self, path):
+
+        """Write the cuboids (and the collision ids the cube has
+        counted) to Parquet files in the directory path."""
+
+        import os
+        import pandas as pd
+
+
+        os.makedirs(path, exist_ok=True)
+
+        for dims, counts in self.cuboids.items():
+            counts.reset_index().to_parquet(os.path.join(path, _cuboid_file(dims)), index=False)
+
+        pd.DataFrame({"collision id": self.collision_ids}).to_parquet(
+            os.path.join(path, "collision ids.parquet"), index=False)
+
+
+    @classmethod
+    def load(cls, path, cuboids=None):
+
+        import os
+        import pandas as pd
+
+
+        cube = cls(cuboids=cuboids)
+
+        for dims in cube.cuboids:
+            counts = pd.read_parquet(os.path.join(path, _cuboid_file(dims)))
+            cube.cuboids[dims] = counts.set_index(list(dims))
+
+        cube.collision_ids = pd.read_parquet(os.path.join(path, "collision ids.parquet"))["collision id"] \
+                               .to_numpy(copy=True)
+
+        return cube
+
+
+    def _cuboid(self, names):
+
+        """The smallest cuboid with every dimension in names."""
+
+        def has(dims, name):
+            return name in dims or (name in ["year", "month"] and "month start" in dims)
+
+        candidates = [dims for dims in self.cuboids if all(has(dims, name) for name in names)]
+
+        if not candidates:
+            raise ValueError(f"no cuboid has all of {sorted(names)}; "
+                             f"the cube keeps {[list(dims) for dims in self.cuboids]}")
+
+        return min((self.cuboids[dims] for dims in candidates), key=len)
+
+
+
+def _cube_rows(df):
+
+    """One row per crash with the cube dimensions and measures."""
+
+    import numpy as np
+    import pandas as pd
+    from crash_utils.make_crash_features import make_crash_features
+
+
+    cols = ["datetime", "on street name", "cross street name"]
+    cols += [col for col in df.columns if col.startswith("vehicle type") or col.startswith("contributing")]
+
+    features = make_crash_features(df[cols].copy(), categorical=True)
+
+    injured = df["number of cyclist injured"].fillna(0).to_numpy(dtype=np.int64)
+    killed = df["number of cyclist killed"].fillna(0).to_numpy(dtype=np.int64)
+
+    return pd.DataFrame({"month start": df["datetime"].dt.to_period("M").dt.start_time.to_numpy(),
+                         "year": df["datetime"].dt.year.to_numpy(),
+                         "day of week": df["datetime"].dt.dayofweek.to_numpy(),
+                         "hour": df["datetime"].dt.hour.to_numpy(),
+                         "borough": df["borough"].to_numpy(),
+                         "zip code": df["zip code"].astype(str).to_numpy(),
+                         "vehicles": features["vehicles"].to_numpy(),
+                         "factors": features["factors"].to_numpy(),
+                         "crashes": 1,
+                         "no injury": ((injured == 0) & (killed == 0)).astype(np.int64),
+                         "injured": injured,
+                         "killed": killed})
+
+
+
+def _add_counts(counts, added):
+
+    """counts with the counts in added (both indexed by the cuboid's
+    keys) added in: keys counts already has are incremented in place,
+    new keys appended.  Only the rows of added are looked up, counts is
+    never grouped again."""
+
+    import pandas as pd
+
+
+    if len(counts) == 0:
+        return added
+
+    positions = counts.index.get_indexer(added.index)
+    known = positions >= 0
+
+    if known.any():
+        counts.iloc[positions[known]] = counts.iloc[positions[known]].to_numpy() + added.loc[known].to_numpy()
+
+    if not known.all():
+        counts = pd.concat((counts, added.loc[~known]))
+
+    return counts
+
+
+
+def _with_derived(counts, names):
+
+    """counts with the date dimensions in names it doesn't have taken
+    from its month start."""
+
+    derived = {}
+
+    if "year" in names and "year" not in counts.columns:
+        derived["year"] = counts["month start"].dt.year
+    if "month" in names and "month" not in counts.columns:
+        derived["month"] = counts["month start"].dt.month
+
+    if not derived:
+        return counts
+
+    return counts.assign(**derived)
+
+
+
+def _cuboid_file(dims):
+
+    return "-".join(dim.replace(" ", "_") for dim in dims) + ".parquet"
+
+
+
+def _as_tuple(by):
+
+    if isinstance(by, str):
+        return (by,)
+
+    return tuple(by)
+
+
+
+def _and(mask, other):
+
+    if mask is None:
+        return other
+
+    return mask & other
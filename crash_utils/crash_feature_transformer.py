@@ -0,0 +1,216 @@
+from sklearn.base import BaseEstimator, TransformerMixin
+
+
+class CrashFeatureTransformer(BaseEstimator, TransformerMixin):
+
+    """Builds the features of prepare_data_for_modelling(sparse = True)
+    from cleaned crashes, learning everything that depends on the data
+    once.
+
+    prepare_data_for_modelling() re-fits the one-hot encoder and the
+    vehicle / factor vocabularies, and recounts the "fewer than 10
+    crashes -> other" street threshold, on whatever frame it is given,
+    so its columns change from one frame to the next.  Here, fit()
+    learns:
+    1.  the on street names with at least min_street_crashes crashes
+        (if encode_streets is True)
+    2.  the categories of the one-hot encoded columns
+    3.  the vehicle and contributing factor vocabularies
+    4.  the vehicle names of the training crashes.  fix_vehicle_names()
+        replaced the rare ones with "other" there, so any other name
+        (as normalized by normalize_vehicle_names()) is replaced with
+        "other" by transform(), as it would have been in training
+
+    transform() then gives a scipy CSR matrix with the same columns,
+    in the same order, for any batch of crashes, however small.
+    Unknown streets become "other", unknown boroughs and zip codes get
+    all zeros in their one-hot columns, and unknown vehicle / factor
+    words are ignored.  get_feature_names_out() gives the column names.
+
+    Unlike prepare_data_for_modelling(), every category keeps its
+    one-hot column (no drop = "first"): otherwise the all-zeros of an
+    unknown borough or zip code would be the encoding of the dropped
+    first category, and unknowns would be scored as that category.
+
+    The input has the columns of the cleaned crash data (see
+    crash_pipeline.py or basic_cleaning.py); the injury and fatality
+    counts are not needed by transform(), so new crashes can be scored
+    before their outcome is known.
+
+    transformer = CrashFeatureTransformer(encode_streets = True).fit(df)
+    transformer.save("data/crash_features.pkl")
+    ...
+    transformer = CrashFeatureTransformer.load("data/crash_features.pkl")
+    X = transformer.transform(new_crashes)
+
+    """
+
+    def __init__(self, encode_streets = False, min_street_crashes = 10):
+
+        self.encode_streets = encode_streets
+        self.min_street_crashes = min_street_crashes
+
+
+    def fit(self, df, y = None):
+
+        from sklearn.preprocessing import OneHotEncoder
+        from crash_utils.make_crash_features import crash_token_counts
+
+
+        import numpy as np
+        import pandas as pd
+
+
+        df = _feature_frame(df)
+
+
+        # vehicle names left after the rare ones were made "other"
+        cols = _vehicle_name_columns(df)
+        self.vehicle_names_ = np.unique(pd.concat([df[col] for col in cols]).dropna().to_numpy(dtype = str))
+
+
+        # streets with enough crashes to get their own column
+        street_counts = df["on street name"].fillna("missing").str.strip().value_counts()
+        self.street_names_ = street_counts.index[street_counts.values >= self.min_street_crashes].to_numpy()
+
+
+        # vehicle and factor vocabularies
+        _, self.vehicle_vocabulary_ = crash_token_counts(df, "vehicles")
+        _, self.factor_vocabulary_ = crash_token_counts(df, "factors")
+
+
+        features = self._make_features(df)
+
+        self.numeric_columns_ = [col for col in features.columns
+                                 if col not in self._encoded_columns() + ["on street name"]]
+
+        self.encoder_ = OneHotEncoder(handle_unknown = "ignore")
+        self.encoder_.fit(features[self._encoded_columns()])
+
+
+        return self
+
+
+    def transform(self, df):
+
+        import scipy.sparse as sp
+        from crash_utils.make_crash_features import crash_token_counts
+
+
+        df = _feature_frame(df)
+
+        # transformers saved before vehicle_names_ was learned don't
+        # have it
+        if getattr(self, "vehicle_names_", None) is not None:
+            for col in _vehicle_name_columns(df):
+                unknown = df[col].notna() & ~df[col].isin(self.vehicle_names_)
+                if unknown.any():
+                    df[col] = df[col].astype(object).where(~unknown, "other")
+
+        veh_matrix = _align_columns(*crash_token_counts(df, "vehicles"), self.vehicle_vocabulary_)
+        factors_matrix = _align_columns(*crash_token_counts(df, "factors"), self.factor_vocabulary_)
+
+        features = self._make_features(df)
+
+        # reindex so a batch missing a column still gets the fitted
+        # column order
+        dense_matrix = sp.csr_matrix(features.reindex(columns = self.numeric_columns_)
+                                             .to_numpy(dtype = float))
+
+        ohe_matrix = self.encoder_.transform(features[self._encoded_columns()])
+
+
+        return sp.hstack((dense_matrix, ohe_matrix, veh_matrix, factors_matrix), format = "csr")
+
+
+    def get_feature_names_out(self, input_features = None):
+
+        import numpy as np
+
+
+        return np.concatenate((np.asarray(self.numeric_columns_, dtype = object),
+                               self.encoder_.get_feature_names_out().astype(object),
+                               self.vehicle_vocabulary_.astype(object),
+                               self.factor_vocabulary_.astype(object)))
+
+
+    def save(self, path):
+
+        import pickle
+
+        with open(path, "wb") as outfile:
+            pickle.dump(self, outfile)
+
+
+    @classmethod
+    def load(cls, path):
+
+        import pickle
+
+        with open(path, "rb") as infile:
+            transformer = pickle.load(infile)
+
+        if not isinstance(transformer, cls):
+            raise TypeError(f"{path} does not hold a {cls.__name__}")
+
+        return transformer
+
+
+    def _encoded_columns(self):
+
+        cols = ["borough", "zip code"]
+
+        if self.encode_streets:
+            cols.append("on street name")
+
+        return cols
+
+
+    def _make_features(self, df):
+
+        from crash_utils.make_crash_features import make_crash_features
+
+
+        return make_crash_features(df, categorical = True, street_names = self.street_names_,
+                                   token_columns = False)
+
+
+
+def _feature_frame(df):
+
+    """The columns of df that features are made from, with the
+    lower-case names used by the crash_utils functions."""
+
+    df = df.rename(columns = lambda name: name.lower().replace("_", " "))
+
+    unused = ["latitude", "longitude", "collision id", "outcome"]
+    unused += [col for col in df.columns if col.startswith("number of")]
+
+    return df.drop(columns = unused, errors = "ignore")
+
+
+
+def _vehicle_name_columns(df):
+
+    return [col for col in df.columns if col.startswith("vehicle type")]
+
+
+
+def _align_columns(counts, words, vocabulary):
+
+    """Move the columns of counts (one per entry of words) to their
+    place in vocabulary, dropping words that are not in it."""
+
+    import numpy as np
+    import scipy.sparse as sp
+
+
+    position = np.searchsorted(vocabulary, words)
+    position = np.minimum(position, len(vocabulary) - 1)
+    known = vocabulary[position] == words if len(vocabulary) else np.zeros(len(words), dtype = bool)
+
+    # a (words x vocabulary) selection matrix
+    selection = sp.csr_matrix((np.ones(known.sum()), (np.nonzero(known)[0], position[known])),
+                              shape = (len(words), len(vocabulary)))
+
+    return (counts @ selection).tocsr()
@@ -0,0 +1,207 @@
+class CrashGridIndex:
+
+    """Spatial index of cleaned crashes on a uniform grid of square
+    cells, cell_km kilometres on a side.
+
+    The coordinates are projected to kilometres the same way
+    zip_code_and_borough_from_coords() does it, every crash is given
+    the number of the cell it falls in, and the crashes are sorted by
+    cell (then by time), so the crashes of a cell are one contiguous
+    block found with a lookup in cell_start.  Crashes without
+    coordinates are left out.
+
+    Queries return positions of rows of the indexed frame (use
+    df.iloc[...]):
+        bbox()     crashes inside a latitude / longitude box
+        radius()   crashes within some kilometres of a point
+        nearest()  the n crashes closest to a point
+    and cell_stats() gives the crashes, injuries, fatalities and injury
+    rate of every cell over any date window, e.g. for a hotspot map:
+
+    index = CrashGridIndex(df)
+    cells = index.cell_stats(start="2019-01-01", end="2020-01-01")
+    plt.scatter(cells["longitude"], cells["latitude"], c=cells["injury rate"])
+
+    """
+
+    def __init__(self, df, cell_km=0.25):
+
+        import numpy as np
+        from crash_utils.zip_code_and_borough_from_coords import _project_coords
+
+
+        lat = df["latitude"].to_numpy(dtype=float)
+        lon = df["longitude"].to_numpy(dtype=float)
+
+        has_coords = np.isfinite(lat) & np.isfinite(lon)
+        rows = np.nonzero(has_coords)[0]
+
+        xy = _project_coords(lat[rows], lon[rows])
+
+        self.cell_km = cell_km
+        self.origin = xy.min(axis=0) if len(rows) > 0 else np.zeros(2)
+
+        ij = np.floor((xy - self.origin) / cell_km).astype(np.int64)
+        self.shape = tuple(int(n) for n in ij.max(axis=0) + 1) if len(rows) > 0 else (0, 0)
+
+        cell = ij[:, 0] * self.shape[1] + ij[:, 1]
+
+        time = df["datetime"].to_numpy(dtype="datetime64[ns]")[rows].astype(np.int64)
+
+
+        # sort by cell, then by time within each cell
+        order = np.lexsort((time, cell))
+
+        self.rows = rows[order]
+        self.cell = cell[order]
+        self.xy = xy[order]
+        self.time = time[order]
+        self.injured = df["number of cyclist injured"].fillna(0).to_numpy(dtype=np.int64)[self.rows]
+        self.killed = df["number of cyclist killed"].fillna(0).to_numpy(dtype=np.int64)[self.rows]
+
+        # the crashes of cell k are self.rows[cell_start[k]:cell_start[k + 1]]
+        self.cell_start = np.searchsorted(self.cell, np.arange(self.shape[0] * self.shape[1] + 1))
+
+        self._tree = None
+
+
+    def bbox(self, min_lat, max_lat, min_lon, max_lon):
+
+        """Crashes with min_lat <= latitude <= max_lat and min_lon <=
+        longitude <= max_lon."""
+
+        import numpy as np
+        from crash_utils.zip_code_and_borough_from_coords import _project_coords
+
+
+        (x0, y0), (x1, y1) = _project_coords([min_lat, max_lat], [min_lon, max_lon])
+
+        ind = self._candidates(x0, x1, y0, y1)
+        x, y = self.xy[ind, 0], self.xy[ind, 1]
+
+        inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+
+        return self.rows[ind[inside]]
+
+
+    def radius(self, lat, lon, km):
+
+        """Crashes within km kilometres of (lat, lon), nearest first."""
+
+        import numpy as np
+        from crash_utils.zip_code_and_borough_from_coords import _project_coords
+
+
+        (x, y), = _project_coords([lat], [lon])
+
+        ind = self._candidates(x - km, x + km, y - km, y + km)
+        dist = np.hypot(self.xy[ind, 0] - x, self.xy[ind, 1] - y)
+
+        inside = dist <= km
+        ind, dist = ind[inside], dist[inside]
+
+        return self.rows[ind[np.argsort(dist, kind="stable")]]
+
+
+    def nearest(self, lat, lon, n=10):
+
+        """The n crashes closest to (lat, lon), nearest first, and their
+        distances in km."""
+
+        import numpy as np
+        from scipy.spatial import cKDTree
+        from crash_utils.zip_code_and_borough_from_coords import _project_coords
+
+
+        # a KD-tree over the crashes, as for the zip codes, built on the
+        # first nearest-neighbour query
+        if self._tree is None:
+            self._tree = cKDTree(self.xy)
+
+        n = min(n, len(self.rows))
+
+        dist, ind = self._tree.query(_project_coords([lat], [lon])[0], k=n)
+
+        return self.rows[np.atleast_1d(ind)], np.atleast_1d(dist)
+
+
+    def cell_stats(self, start=None, end=None, min_crashes=1):
+
+        """Per cell counts of the crashes with start <= datetime < end:
+        crashes, cyclists injured, cyclists killed, crashes with a
+        cyclist injured or killed, and their share of the crashes
+        ("injury rate").  Cells with fewer than min_crashes crashes are
+        left out."""
+
+        import numpy as np
+        import pandas as pd
+        from crash_utils.zip_code_and_borough_from_coords import _unproject_coords
+
+
+        in_window = np.ones(len(self.rows), dtype=bool)
+
+        if start is not None:
+            in_window &= self.time >= pd.Timestamp(start).value
+        if end is not None:
+            in_window &= self.time < pd.Timestamp(end).value
+
+
+        n_cells = self.shape[0] * self.shape[1]
+        cell = self.cell[in_window]
+
+        crashes = np.bincount(cell, minlength=n_cells)
+        injured = np.bincount(cell, weights=self.injured[in_window], minlength=n_cells)
+        killed = np.bincount(cell, weights=self.killed[in_window], minlength=n_cells)
+        hurt = np.bincount(cell, weights=(self.injured[in_window] + self.killed[in_window]) > 0,
+                           minlength=n_cells)
+
+        keep = np.nonzero(crashes >= max(min_crashes, 1))[0]
+
+
+        # cell centres
+        i, j = np.divmod(keep, self.shape[1])
+        x = self.origin[0] + (i + 0.5) * self.cell_km
+        y = self.origin[1] + (j + 0.5) * self.cell_km
+        lat, lon = _unproject_coords(x, y)
+
+        return pd.DataFrame({"cell": keep,
+                             "latitude": lat,
+                             "longitude": lon,
+                             "crashes": crashes[keep],
+                             "injured": injured[keep].astype(np.int64),
+                             "killed": killed[keep].astype(np.int64),
+                             "injury rate": hurt[keep] / crashes[keep]})
+
+
+    def _candidates(self, x0, x1, y0, y1):
+
+        """Positions (in the sorted arrays) of the crashes in the cells
+        overlapping the box x0 <= x <= x1, y0 <= y <= y1 (km)."""
+
+        import numpy as np
+
+
+        if len(self.rows) == 0:
+            return np.array([], dtype=np.int64)
+
+        i0, j0 = np.floor((np.array([x0, y0]) - self.origin) / self.cell_km).astype(np.int64)
+        i1, j1 = np.floor((np.array([x1, y1]) - self.origin) / self.cell_km).astype(np.int64)
+
+        i0, i1 = max(i0, 0), min(i1, self.shape[0] - 1)
+        j0, j1 = max(j0, 0), min(j1, self.shape[1] - 1)
+
+        if i0 > i1 or j0 > j1:
+            return np.array([], dtype=np.int64)
+
+
+        # each column of cells i is one run of cells i * ny + j0 ... i * ny + j1
+        i = np.arange(i0, i1 + 1)
+        first = self.cell_start[i * self.shape[1] + j0]
+        last = self.cell_start[i * self.shape[1] + j1 + 1]
+
+        lengths = last - first
+
+        # concatenate the ranges first[k]:last[k] without a Python loop
+        offsets = np.repeat(first - np.cumsum(np.concatenate(([0], lengths[:-1]))), lengths)
+
+        return np.arange(lengths.sum()) + offsets
@@ -0,0 +1,270 @@
+def crash_schema():
+
+    """Arrow schema of the crash data stored as Parquet.
+
+    Compared to the csv files:
+    1.  "crash date" and "crash time" are combined into a timestamp,
+        "datetime" (the same column basic_cleaning() makes)
+    2.  "location" is dropped (it is redundant with latitude and
+        longitude)
+    3.  the borough, zip code, vehicle type and contributing factor
+        columns are dictionary encoded (categoricals in pandas)
+    4.  the person counts are 8- or 16-bit integers
+    5.  latitude and longitude are 32-bit floats
+
+    """
+
+    import pyarrow as pa
+
+
+    category = pa.dictionary(pa.int32(), pa.string())
+
+    fields = [("datetime", pa.timestamp("ns")),
+              ("borough", category),
+              ("zip code", category),
+              ("latitude", pa.float32()),
+              ("longitude", pa.float32()),
+              ("on street name", pa.string()),
+              ("cross street name", pa.string()),
+              ("off street name", pa.string()),
+              ("number of persons injured", pa.int16()),
+              ("number of persons killed", pa.int8()),
+              ("number of pedestrians injured", pa.int16()),
+              ("number of pedestrians killed", pa.int8()),
+              ("number of cyclist injured", pa.int16()),
+              ("number of cyclist killed", pa.int8()),
+              ("number of motorist injured", pa.int16()),
+              ("number of motorist killed", pa.int8())]
+
+    fields += [(f"contributing factor vehicle {k}", category) for k in range(1, 6)]
+    fields += [("collision id", pa.int64())]
+    fields += [(f"vehicle type code {k}", category) for k in range(1, 6)]
+
+    return pa.schema(fields)
+
+
+
+def _partition_schema():
+
+    import pyarrow as pa
+
+    return pa.schema([("year", pa.int16()), ("month", pa.int8())])
+
+
+
+def write_crash_parquet(df, path, append=False, basename=None):
+
+    """Write crash data to a Parquet data set at path, partitioned by
+    year and month of the crash (path/year=2020/month=6/...).
+
+    df has the columns of the csv files written by
+    retrieve_nyc_crashes_soda.py and is converted to crash_schema().
+    Unless append is True, any partition df has data for is replaced.
+    With append = True, df is added alongside the data already stored,
+    which is how pages of a download are written as they arrive.
+    The files get random names, unless basename is given: writing
+    another frame with the same basename then replaces the files of
+    the first one (e.g. a page written again by a resumed download).
+
+    """
+
+    import uuid
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from crash_utils.parse_crash_datetime import parse_crash_datetime
+
+
+    schema = crash_schema()
+
+
+    # combine the crash date and time
+    if "datetime" in df.columns:
+        crash_dt = pd.to_datetime(df["datetime"])
+    else:
+        crash_dt = parse_crash_datetime(df["crash date"], df["crash time"])
+
+
+    # zip codes come back from read_csv as floats, so store them as
+    # 5-digit strings
+    zip_code = pd.to_numeric(df["zip code"], errors="coerce").astype("Int64").astype(str)
+    zip_code = zip_code.where(zip_code != "<NA>", None)
+
+
+    arrays = []
+
+    for field in schema:
+
+        if field.name == "datetime":
+            values = crash_dt
+        elif field.name == "zip code":
+            values = zip_code
+        elif field.name in df.columns:
+            values = df[field.name]
+        else:
+            values = pd.Series([None] * len(df))
+
+        if pa.types.is_dictionary(field.type):
+            values = values.astype(object).where(values.notna(), None)
+            arrays.append(pa.array(values, type=pa.string()).cast(field.type))
+        elif pa.types.is_integer(field.type):
+            values = pd.to_numeric(values, errors="coerce")
+            arrays.append(pa.array(values.to_numpy(dtype=float, na_value=np.nan),
+                                   from_pandas=True).cast(field.type))
+        elif pa.types.is_floating(field.type):
+            values = pd.to_numeric(values, errors="coerce")
+            arrays.append(pa.array(values.to_numpy(dtype=float, na_value=np.nan),
+                                   type=field.type, from_pandas=True))
+        else:
+            arrays.append(pa.array(values, type=field.type, from_pandas=True))
+
+
+    # partition columns
+    arrays.append(pa.array(crash_dt.dt.year.to_numpy(dtype=float, na_value=np.nan),
+                           from_pandas=True).cast(pa.int16()))
+    arrays.append(pa.array(crash_dt.dt.month.to_numpy(dtype=float, na_value=np.nan),
+                           from_pandas=True).cast(pa.int8()))
+
+    table = pa.Table.from_arrays(arrays, schema=_append_schema(schema, _partition_schema()))
+
+
+    if basename is None:
+        basename = f"part-{uuid.uuid4().hex}"
+
+    if append:
+        existing_data_behavior = "overwrite_or_ignore"
+    else:
+        existing_data_behavior = "delete_matching"
+
+    ds.write_dataset(table, path, format="parquet",
+                     partitioning=ds.partitioning(_partition_schema(), flavor="hive"),
+                     basename_template=f"{basename}-{{i}}.parquet",
+                     existing_data_behavior=existing_data_behavior)
+
+
+
+def read_crash_parquet(path, columns=None, start=None, end=None, as_categorical=True):
+
+    """Read crash data written by write_crash_parquet().
+
+    Only the requested columns are read from disk (all of them by
+    default).  If start and/or end are given, only crashes with start
+    <= datetime < end are returned; whole year/month partitions outside
+    the range are skipped without being opened, and the remaining row
+    groups are filtered as they are scanned.
+
+    The dictionary encoded columns come back as pandas categoricals and
+    the person counts as nullable integers.  The cleaning functions in
+    crash_utils assign new labels to the borough, zip code and vehicle
+    columns, so pass as_categorical = False to get plain strings when
+    the frame is headed there.
+
+    """
+
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+
+    dataset = ds.dataset(path, format="parquet",
+                         partitioning=ds.partitioning(_partition_schema(), flavor="hive"))
+
+    if columns is None:
+        columns = crash_schema().names
+
+
+    # filter on the partition columns first so whole directories can be
+    # pruned, then on the timestamps themselves
+    expr = None
+
+    if start is not None:
+        start = pd.Timestamp(start)
+        expr = _and(expr, (ds.field("year") > start.year) |
+                          ((ds.field("year") == start.year) & (ds.field("month") >= start.month)))
+        expr = _and(expr, ds.field("datetime") >= pa.scalar(start.to_pydatetime(), pa.timestamp("ns")))
+
+    if end is not None:
+        end = pd.Timestamp(end)
+        expr = _and(expr, (ds.field("year") < end.year) |
+                          ((ds.field("year") == end.year) & (ds.field("month") <= end.month)))
+        expr = _and(expr, ds.field("datetime") < pa.scalar(end.to_pydatetime(), pa.timestamp("ns")))
+
+
+    table = dataset.to_table(columns=columns, filter=expr)
+
+    if not as_categorical:
+        table = pa.Table.from_arrays([col.cast(pa.string()) if pa.types.is_dictionary(col.type) else col
+                                      for col in table.columns],
+                                     names=table.column_names)
+
+    int_types = {pa.int8(): pd.Int8Dtype(),
+                 pa.int16(): pd.Int16Dtype(),
+                 pa.int64(): pd.Int64Dtype()}
+
+    return table.to_pandas(types_mapper=int_types.get)
+
+
+
+def iter_crash_parquet(path, batch_size=500000, columns=None):
+
+    """Read crash data written by write_crash_parquet() batch_size rows
+    at a time, as DataFrames ready for the cleaning functions (plain
+    strings rather than categoricals, nullable integer counts)."""
+
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+
+    dataset = ds.dataset(path, format="parquet",
+                         partitioning=ds.partitioning(_partition_schema(), flavor="hive"))
+
+    if columns is None:
+        columns = crash_schema().names
+
+    int_types = {pa.int8(): pd.Int8Dtype(),
+                 pa.int16(): pd.Int16Dtype(),
+                 pa.int64(): pd.Int64Dtype()}
+
+    for batch in dataset.to_batches(columns=columns, batch_size=batch_size):
+
+        table = pa.Table.from_batches([batch])
+        table = pa.Table.from_arrays([col.cast(pa.string()) if pa.types.is_dictionary(col.type) else col
+                                      for col in table.columns],
+                                     names=table.column_names)
+
+        yield table.to_pandas(types_mapper=int_types.get)
+
+
+
+def crash_parquet_to_csv(path, output_file, **kwargs):
+
+    """Export crash data stored by write_crash_parquet() to a csv file.
+
+    Keyword arguments (columns, start, end) are passed on to
+    read_crash_parquet().
+
+    """
+
+    df = read_crash_parquet(path, as_categorical=False, **kwargs)
+    df.to_csv(output_file, index=False)
+
+    return df
+
+
+
+def _append_schema(schema, other):
+
+    import pyarrow as pa
+
+    return pa.schema(list(schema) + list(other))
+
+
+
+def _and(expr, other):
+
+    if expr is None:
+        return other
+
+    return expr & other
@@ -0,0 +1,254 @@
+class CrashPipeline:
+
+    """Runs the crash cleaning steps as one planned sequence of stages,
+    timing each one.
+
+    The notebooks run zip_code_and_borough_from_coords(),
+    fix_vehicle_names(), basic_cleaning() and
+    prepare_data_for_modelling() one after the other on the whole
+    table.  The default stages (see cleaning_stages()) do the same work
+    in a cheaper order:
+    1.  the unused columns are dropped in one go
+    2.  crashes without cyclist involvement are filtered out first, so
+        every later stage works on the smaller frame
+    3.  missing zip codes and boroughs are filled in
+    4.  the vehicle names are normalized, once
+    5.  the remaining row-by-row cleaning (see clean_crash_rows())
+    6.  a single sort by datetime, then duplicates are dropped
+
+    The result differs from that of the notebook order in two ways:
+    -   because of 2., the "fewer than 5 / 3 incidents" vehicle name
+        thresholds are counted over the bike crashes only
+    -   the zip codes are looked for in the fixed region NYC_BOUNDS,
+        i.e. as zip_code_and_borough_from_coords(df, bounds=NYC_BOUNDS),
+        rather than in the region covered by the crashes
+
+    Stages are (name, function, keyword arguments) tuples; the function
+    takes and returns a DataFrame.  More can be added with add_stage(),
+    e.g.
+
+    pipe = CrashPipeline()
+    pipe.add_stage("modelling", prepare_data_for_modelling, encode_streets=True)
+    df = pipe.run(df)
+    pipe.report()
+
+    After run(), report() gives the wall time, rows in and out and (if
+    track_memory is True) the peak memory allocated by each stage.
+    Memory tracking uses tracemalloc, which slows things down a bit, so
+    it is off by default.
+    With profiling on (see crash_utils/instrumentation.py) every stage
+    is also profiled, as the parent of the stages inside it.
+
+    With a PipelineCache (see crash_utils/pipeline_cache.py) as cache,
+    the output of every stage is stored, keyed by the input data, the
+    stages up to it and their code.  A later run on the same data
+    starts from the output of the last stage found in the cache; the
+    stages skipped are reported with "cached" = True.
+
+    """
+
+    def __init__(self, stages=None, track_memory=False, verbose=False, cache=None):
+
+        if stages is None:
+            stages = cleaning_stages()
+
+        self.stages = [_as_stage(stage) for stage in stages]
+        self.track_memory = track_memory
+        self.verbose = verbose
+        self.cache = cache
+        self.timings = []
+
+
+    def add_stage(self, name, func, **kwargs):
+
+        self.stages.append((name, func, kwargs))
+
+        return self
+
+
+    def run(self, df):
+
+        import time
+        from crash_utils.instrumentation import profile_stage, peak_memory
+
+
+        self.timings = []
+
+        stages = self.stages
+        keys = [None] * len(stages)
+
+        if self.cache is not None:
+            stages, keys, df = self._skip_cached_stages(df)
+
+        for (name, func, kwargs), key in zip(stages, keys):
+
+            rows_in = len(df)
+
+            t_start = time.perf_counter()
+
+            with peak_memory(self.track_memory) as memory, profile_stage(name, df) as stage:
+                df = func(df, **kwargs)
+                stage.rows_out = len(df)
+
+            elapsed = time.perf_counter() - t_start
+
+            timing = {"stage": name,
+                      "seconds": elapsed,
+                      "rows in": rows_in,
+                      "rows out": len(df)}
+
+            if self.cache is not None:
+                self.cache.put(key, df)
+                timing["cached"] = False
+
+            if self.track_memory:
+                timing["peak MB"] = memory.peak_mb
+
+            self.timings.append(timing)
+
+            if self.verbose:
+                print(f"{name}: {elapsed:.2f} s, {rows_in} -> {len(df)} rows")
+
+        return df
+
+
+    def _skip_cached_stages(self, df):
+
+        """The stages left to run, their cache keys, and the frame to
+        start them from."""
+
+        import time
+        from crash_utils.pipeline_cache import data_fingerprint
+
+
+        # the key of each stage depends on the key of the one before,
+        # so only the input has to be hashed
+        keys = []
+        key = data_fingerprint(df)
+
+        for name, func, kwargs in self.stages:
+            key = self.cache.key(key, name, func, kwargs)
+            keys.append(key)
+
+
+        for k in reversed(range(len(self.stages))):
+
+            if keys[k] not in self.cache:
+                continue
+
+            t_start = time.perf_counter()
+
+            try:
+                df = self.cache.get(keys[k])
+            except KeyError:
+                # evicted in the meantime
+                continue
+
+            elapsed = time.perf_counter() - t_start
+
+            for name, _, _ in self.stages[:k + 1]:
+                self.timings.append({"stage": name, "seconds": 0.0,
+                                     "rows in": None, "rows out": None, "cached": True})
+
+            self.timings[-1].update({"seconds": elapsed, "rows out": len(df)})
+
+            if self.verbose:
+                print(f"read {self.stages[k][0]} from the cache: {elapsed:.2f} s")
+
+            return self.stages[k + 1:], keys[k + 1:], df
+
+
+        return self.stages, keys, df
+
+
+    def report(self):
+
+        import pandas as pd
+
+        return pd.DataFrame(self.timings)
+
+
+
+def cleaning_stages():
+
+    """The default stages of CrashPipeline."""
+
+    from crash_utils.basic_cleaning import clean_crash_rows
+    from crash_utils.fix_vehicle_names import fix_vehicle_names
+    from crash_utils.zip_code_and_borough_from_coords import zip_code_and_borough_from_coords
+    from crash_utils.zip_code_and_borough_from_coords import NYC_BOUNDS
+
+
+    # the zip codes are looked for in a fixed region: the region
+    # covered by the crashes would depend on the filtering before
+    return [("drop columns", drop_unused_columns, {}),
+            ("filter bike crashes", filter_bike_crashes, {}),
+            ("zip codes", zip_code_and_borough_from_coords, {"bounds": NYC_BOUNDS}),
+            ("vehicle names", fix_vehicle_names, {}),
+            ("clean rows", clean_crash_rows, {}),
+            ("sort and deduplicate", sort_and_deduplicate, {})]
+
+
+
+def drop_unused_columns(df):
+
+    """Drop all of the columns basic_cleaning() throws away at once, and
+    order the rest alphabetically."""
+
+    df = df.drop(columns=["location", "off street name"], errors="ignore")
+
+    return df.sort_index(axis=1)
+
+
+
+def filter_bike_crashes(df):
+
+    """Keep only the crashes basic_cleaning() would keep (see
+    bike_crash_mask()), before the vehicle names have been cleaned.
+
+    A crash is kept if, once normalized by fix_vehicle_names(), one of
+    its vehicle names contains "bike".  Rather than normalizing every
+    row, each distinct raw name is normalized once.
+    """
+
+    import pandas as pd
+    from crash_utils.fix_vehicle_names import normalize_vehicle_name_values
+
+
+    col_ind = df.columns.str.match("vehicle type")
+    cols = df.columns[col_ind].tolist()
+
+    mask = (df["number of cyclist injured"] > 0) | (df["number of cyclist killed"] > 0)
+    mask = mask.fillna(False).astype(bool).to_numpy()
+
+    for col in cols:
+
+        raw_names = df[col].dropna().unique()
+        names = pd.Series(normalize_vehicle_name_values(raw_names))
+
+        bike_names = raw_names[names.str.contains("bike", na=False).to_numpy()]
+        mask = mask | df[col].isin(bike_names).to_numpy()
+
+    return df.loc[mask]
+
+
+
+def sort_and_deduplicate(df):
+
+    """Sort the crashes by datetime and drop duplicate rows."""
+
+    # stable, so crashes at the same time keep their order, as in
+    # basic_cleaning()
+    df = df.sort_values(by="datetime", kind="stable", ignore_index=True)
+
+    return df.drop_duplicates(ignore_index=True)
+
+
+
+def _as_stage(stage):
+
+    if len(stage) == 2:
+        name, func = stage
+        return (name, func, {})
+
+    return tuple(stage)
@@ -0,0 +1,145 @@
+def fetch_soda_pages(url, where=None, order="crash_date, collision_id",
+                     page_size=50000, start_offset=0, max_workers=4,
+                     token=None, max_retries=5, backoff=1.0, timeout=60):
+
+    """Fetch the results of a SODA query as pages, several at a time.
+
+    The number of matching records is looked up first, then the query
+    is split into disjoint $offset/$limit pages which are requested in
+    parallel by a pool of max_workers threads sharing one pooled HTTP
+    session.  Requests answered with a 429 or 5xx status are retried
+    up to max_retries times with exponential backoff (or after the
+    server's Retry-After delay, if it sends one).
+
+    Pages are yielded in offset order as lists of record dictionaries,
+    whatever order they arrive in, so the output is the same as a
+    sequential download.  At most 2 * max_workers pages are held in
+    memory at any time.  The download rate (rows/second) is printed
+    when the last page has been fetched.
+
+    url is the SODA resource endpoint, e.g.
+    https://data.cityofnewyork.us/resource/h9gi-nx95.json.  order must
+    give the records a stable order for the pages to be disjoint.
+
+    """
+
+    import time
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+
+    session = _pooled_session(max_workers, token)
+
+    params = {}
+    if where is not None:
+        params["$where"] = where
+
+    try:
+
+        n_records = _soda_count(session, url, params, max_retries, backoff, timeout)
+
+        offsets = iter(range(start_offset, n_records, page_size))
+
+        t_start = time.perf_counter()
+        n_rows = 0
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+
+            def submit_next():
+                offset = next(offsets, None)
+                if offset is not None:
+                    page_params = dict(params, **{"$order": order,
+                                                  "$limit": page_size,
+                                                  "$offset": offset})
+                    in_flight.append(pool.submit(_soda_get, session, url, page_params,
+                                                 max_retries, backoff, timeout))
+
+            # keep a bounded window of requests in flight and hand the
+            # pages back in the order they were submitted
+            in_flight = deque()
+            for _ in range(2 * max_workers):
+                submit_next()
+
+            while in_flight:
+                page = in_flight.popleft().result()
+                submit_next()
+
+                n_rows += len(page)
+                yield page
+
+        elapsed = time.perf_counter() - t_start
+        rate = n_rows / elapsed if elapsed > 0 else float("inf")
+        print(f"Fetched {n_rows} rows in {elapsed:.1f} s ({rate:.0f} rows/second)")
+
+    finally:
+        session.close()
+
+
+
+def _pooled_session(max_workers, token=None):
+
+    """requests session with a connection pool big enough for all of the
+    worker threads."""
+
+    import requests
+    from requests.adapters import HTTPAdapter
+
+
+    session = requests.Session()
+
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    if token is not None:
+        session.headers["X-App-Token"] = token
+
+    return session
+
+
+
+def _soda_get(session, url, params, max_retries, backoff, timeout):
+
+    """GET one page of JSON records, retrying on throttling, server
+    errors and dropped connections."""
+
+    import time
+    import requests
+
+
+    for attempt in range(max_retries + 1):
+
+        try:
+            response = session.get(url, params=params, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == max_retries:
+                raise
+            time.sleep(backoff * 2**attempt)
+            continue
+
+        retryable = response.status_code == 429 or response.status_code >= 500
+        if not retryable or attempt == max_retries:
+            response.raise_for_status()
+            return response.json()
+
+        # honour the server's requested delay if there is one
+        delay = response.headers.get("Retry-After")
+        try:
+            delay = float(delay)
+        except (TypeError, ValueError):
+            delay = backoff * 2**attempt
+
+        time.sleep(delay)
+
+
+
+def _soda_count(session, url, params, max_retries, backoff, timeout):
+
+    """Number of records matching the query."""
+
+    count_params = dict(params, **{"$select": "count(*)"})
+    result = _soda_get(session, url, count_params, max_retries, backoff, timeout)
+
+    # the count comes back as a single record with a single field whose
+    # name depends on the API version
+    return int(list(result[0].values())[0])
@@ -1,5 +1,40 @@
 def fix_vehicle_names(df):
 
+    """Clean up the VEHICLE TYPE CODE columns:
+    1.  lower-cases and trims the names, and maps the many spellings of
+        each type of vehicle onto one name (see vehicle_name_map())
+    2.  replaces the names with very few incidents with "other"
+    """
+
+    from crash_utils.instrumentation import profile_stage
+
+
+    with profile_stage("normalize vehicle names", df):
+        df = normalize_vehicle_names(df)
+
+    # now fill in everything with fewer than 5 incidents in vehicle
+    # column 1 and everything with fewer than 3 incidents in vehicle
+    # column 2 with "other".
+    with profile_stage("vehicle names to other", df):
+        strs_to_other = rare_vehicle_names(df)
+        df = vehicle_names_to_other(df, strs_to_other)
+
+    return df
+
+
+
+def normalize_vehicle_names(df):
+
+    """Lower-case, trim and map the names in the VEHICLE TYPE CODE
+    columns.  Every row is treated on its own.
+
+    There are only a few hundred distinct raw names in millions of
+    rows, so each column is factorized and each of its distinct names
+    is normalized once (see normalize_vehicle_name_values()); the
+    results are then broadcast back to the rows through the integer
+    codes.
+    """
+
     # the usual
     import pandas as pd
     import numpy as np
@@ -13,46 +48,96 @@ def fix_vehicle_names(df):
 
 
     # generate list of columns on which to operate
-    col_ind = df.columns.str.match("vehicle type")
-    cols = df.columns[col_ind].tolist()
+    cols = _vehicle_columns(df)
 
 
-    # first lower-case and trim trailing and leading white space everything
     for col in cols:
-        df[col] = df[col].str.lower()
-        df[col] = df[col].str.strip()
+
+        # missing names get code -1, which picks up the trailing nan
+        codes, uniques = pd.factorize(df[col])
+
+        names = normalize_vehicle_name_values(uniques)
+        names = np.append(names, np.nan)
+
+        df[col] = names[codes]
+
+
+    return df
+
+
+
+def normalize_vehicle_name_values(names):
+
+    """Lower-case, trim and map an array of raw vehicle names.  Anything
+    that isn't a string becomes nan."""
+
+    import numpy as np
 
 
-    # do the actual mapping
     vehicle_map = vehicle_name_map()
 
+    out = np.empty(len(names), dtype=object)
 
-    for col in cols:
-        for old, new in vehicle_map.items():
-            df[col] = df[col].replace(old,new, regex = False)
+    for k, name in enumerate(names):
+        if isinstance(name, str):
+            name = name.lower().strip()
+            out[k] = vehicle_map.get(name, name)
+        else:
+            out[k] = np.nan
 
+    return out
 
-    # now fill in everything with fewer than 5 incidents in vehicle
-    # column 1 and everything with fewer than 3 incidents in vehicle
-    # column 2 with "other".
-    strs_to_other_1 = df["vehicle type code 1"].value_counts()
-    strs_to_other_1 = strs_to_other_1[strs_to_other_1<5]
 
-    strs_to_other_2 = df["vehicle type code 2"].value_counts()
-    strs_to_other_2 = strs_to_other_2[strs_to_other_2<3]
 
-    strs_to_other = pd.concat([strs_to_other_1,strs_to_other_2]).index
-    
-    for col in cols:
+def rare_vehicle_names(df):
+
+    """Names with fewer than 5 incidents in vehicle column 1 or fewer
+    than 3 incidents in vehicle column 2."""
+
+    counts_1 = df["vehicle type code 1"].value_counts()
+    counts_2 = df["vehicle type code 2"].value_counts()
+
+    return rare_vehicle_names_from_counts(counts_1, counts_2)
+
+
+
+def rare_vehicle_names_from_counts(counts_1, counts_2):
+
+    """rare_vehicle_names() given the value counts of vehicle columns 1
+    and 2, e.g. summed over blocks of a table too big to count at
+    once."""
+
+    import pandas as pd
+
+
+    strs_to_other_1 = counts_1[counts_1<5]
+    strs_to_other_2 = counts_2[counts_2<3]
+
+    return pd.concat([strs_to_other_1,strs_to_other_2]).index
+
+
+
+def vehicle_names_to_other(df, strs_to_other):
+
+    """Replace the names in strs_to_other with "other" in all of the
+    VEHICLE TYPE CODE columns."""
+
+    for col in _vehicle_columns(df):
         mask = df[col].isin(strs_to_other)
         df.loc[mask,col] = "other"
 
-
     return df
 
 
 
-        
+def _vehicle_columns(df):
+
+    col_ind = df.columns.str.match("vehicle type")
+
+    return df.columns[col_ind].tolist()
+
+
+
 def vehicle_name_map():
     vehicle_map = {
 
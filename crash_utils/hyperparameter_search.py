@@ -0,0 +1,347 @@
+def hyperparameter_search(estimator, param_grid, X_train, y_train, X_test, y_test,
+                          results_file, n_workers=None, halving=True, factor=3,
+                          min_samples=1000, validation_size=0.2, random_state=0,
+                          data_dir=None, verbose=True):
+
+    """Search param_grid for the best parameters of estimator, fitting
+    the candidates in parallel worker processes.
+
+    This does what the max_depth / min_samples_leaf / C loops and the
+    GridSearchCV cells of the notebooks do, without letting the test
+    set pick the winner: validation_size of the training rows are held
+    out as a validation set, each candidate is fit on (some of) the
+    other training rows and the candidates are compared by their
+    validation score (estimator.score(), i.e. accuracy for the
+    classifiers).  Only the chosen candidate is then refit on all of
+    (X_train, y_train) and scored, once, on (X_test, y_test), so its
+    test score is an honest estimate.
+
+    1.  The training and test data are written once to data_dir (a
+        temporary directory by default) as .npy files, and every worker
+        process memory-maps them, rather than receiving its own pickled
+        copy with every task.  X can be a numpy array or a scipy sparse
+        matrix (e.g. from prepare_data_for_modelling(sparse = True)).
+    2.  With halving = True, the candidates go through successive
+        halving: in the first round each is fit on min_samples training
+        rows; after every round only the best 1/factor of the candidates
+        (by validation score) go on, with factor times more rows, until
+        one candidate is left or all the training rows are used.  Poor
+        candidates are thus dropped after cheap fits.  With halving =
+        False every candidate is fit once on all the rows.
+    3.  Every finished fit is appended to results_file (one JSON record
+        per line) as soon as it is done, with the estimator's class and
+        parameters and a fingerprint of the data (a hash of the saved
+        arrays and of the validation rows).  Running the search again
+        with the same results_file skips the fits already in it for the
+        same estimator and data, so a killed sweep carries on where it
+        stopped; records of other estimators or data are ignored.
+
+    param_grid is a dict (or list of dicts) of parameter lists, as for
+    GridSearchCV, e.g. {"max_depth": [10, 40, 80], "n_estimators": [50, 100]}.
+
+    Returns a DataFrame with one row per fit (estimator, params, number
+    of rows, round, train and validation score, seconds), best
+    validation score
+    first within the last round, and a last row for the final fit of
+    the chosen candidate (round "final"), the only one with a test
+    score.
+
+    """
+
+    import os
+    import json
+    import shutil
+    import tempfile
+    import numpy as np
+    import pandas as pd
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from sklearn.model_selection import ParameterGrid, train_test_split
+
+
+    candidates = list(ParameterGrid(param_grid))
+
+
+    # hold out the validation rows, stratified by the outcome if that
+    # is possible
+    all_rows = np.arange(X_train.shape[0])
+    try:
+        fit_rows, validation_rows = train_test_split(all_rows, test_size=validation_size,
+                                                     random_state=random_state, stratify=y_train)
+    except ValueError:
+        fit_rows, validation_rows = train_test_split(all_rows, test_size=validation_size,
+                                                     random_state=random_state)
+
+    validation_rows = np.sort(validation_rows)
+    n_rows = len(fit_rows)
+
+
+    # rows used in each round: a fixed random order of the fitting
+    # rows, of which the first n are used
+    rng = np.random.default_rng(random_state)
+    row_order = fit_rows[rng.permutation(n_rows)]
+
+    if halving:
+        n_rounds = 1
+        while len(candidates) // factor**n_rounds >= 1 and min_samples * factor**n_rounds < n_rows:
+            n_rounds += 1
+        round_rows = [min(min_samples * factor**r, n_rows) for r in range(n_rounds)]
+        round_rows[-1] = n_rows
+    else:
+        round_rows = [n_rows]
+
+
+    temporary = data_dir is None
+    if temporary:
+        data_dir = tempfile.mkdtemp()
+
+    records = []
+
+    try:
+
+        _save_shared(data_dir, X_train=X_train, y_train=y_train, X_test=X_test, y_test=y_test,
+                     X_validation=X_train[validation_rows], y_validation=np.asarray(y_train)[validation_rows])
+        np.save(os.path.join(data_dir, "row_order.npy"), row_order)
+
+
+        # what a fit in the results file has to match to be reused
+        search = {"estimator": type(estimator).__name__,
+                  "estimator params": _candidate_key(estimator.get_params()),
+                  "data": _data_fingerprint(data_dir, validation_rows)}
+
+        def done_key(record, final, rows):
+            return tuple(record.get(name) for name in search) + (record["candidate"], final, rows)
+
+        # fits already done by an earlier run
+        done = {}
+
+        if os.path.exists(results_file):
+            with open(results_file) as infile:
+                for line in infile:
+                    if line.strip():
+                        record = json.loads(line)
+                        done[done_key(record, record["round"] == "final", record["rows"])] = record
+
+
+        alive = list(range(len(candidates)))
+
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_load_shared,
+                                 initargs=(data_dir,)) as pool, \
+             open(results_file, "a") as outfile:
+
+            def save(record, k, r):
+                record.update({**search, "candidate": _candidate_key(candidates[k]), "round": r,
+                               "validation rows": len(validation_rows)})
+                outfile.write(json.dumps(record) + "\n")
+                outfile.flush()
+                return record
+
+
+            for r, rows in enumerate(round_rows):
+
+                scores = {}
+                futures = {}
+
+                for k in alive:
+                    key = done_key({**search, "candidate": _candidate_key(candidates[k])}, False, rows)
+                    if key in done:
+                        scores[k] = done[key]
+                        continue
+                    futures[pool.submit(_fit_and_score, estimator, candidates[k], rows)] = k
+
+                for future in as_completed(futures):
+
+                    k = futures[future]
+                    scores[k] = save(future.result(), k, r)
+
+                    if verbose:
+                        print(f"round {r}, {rows} rows: {candidates[k]} "
+                              f"validation score {scores[k]['validation score']:.3f}")
+
+                records += [scores[k] for k in alive]
+
+
+                # keep the best 1/factor of the candidates for the next
+                # round
+                n_keep = max(1, len(alive) // factor) if r < len(round_rows) - 1 else 1
+                alive = sorted(alive, key=lambda k: scores[k]["validation score"], reverse=True)[:n_keep]
+
+
+            # refit the chosen candidate on all of the training rows and
+            # score it on the test set
+            best = alive[0]
+            key = done_key({**search, "candidate": _candidate_key(candidates[best])}, True, X_train.shape[0])
+
+            if key in done:
+                final = done[key]
+            else:
+                final = save(pool.submit(_fit_and_test, estimator, candidates[best]).result(), best, "final")
+
+            records.append(final)
+
+            if verbose:
+                print(f"chosen: {candidates[best]} test score {final['test score']:.3f}")
+
+    finally:
+        if temporary:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+    results = pd.DataFrame(records)
+    results["params"] = [json.loads(candidate) for candidate in results["candidate"]]
+
+    is_final = (results["round"] == "final").to_numpy()
+    results = pd.concat((results[~is_final].sort_values(by=["rows", "validation score"],
+                                                         ascending=False),
+                         results[is_final]), ignore_index=True)
+
+    return results.drop(columns=["candidate", "estimator params", "data"])
+
+
+
+def _candidate_key(params):
+
+    """The parameters of a candidate as a JSON string, for the results
+    file and for recognising fits done by an earlier run."""
+
+    import json
+
+    return json.dumps(params, sort_keys=True, default=_json_value)
+
+
+
+def _json_value(value):
+
+    # numpy scalars, estimators, ...
+    if hasattr(value, "item"):
+        return value.item()
+
+    return repr(value)
+
+
+
+def _data_fingerprint(data_dir, validation_rows):
+
+    """A hash of the arrays _save_shared() wrote to data_dir and of the
+    validation rows."""
+
+    import os
+    import hashlib
+    import numpy as np
+
+
+    h = hashlib.sha256()
+
+    for name in sorted(os.listdir(data_dir)):
+        h.update(name.encode())
+        with open(os.path.join(data_dir, name), "rb") as infile:
+            for block in iter(lambda: infile.read(1 << 20), b""):
+                h.update(block)
+
+    h.update(np.asarray(validation_rows, dtype=np.int64).tobytes())
+
+    return h.hexdigest()
+
+
+
+def _save_shared(data_dir, **arrays):
+
+    """Write each array (dense or scipy sparse) to data_dir as .npy
+    files the workers can memory-map."""
+
+    import os
+    import json
+    import numpy as np
+    import scipy.sparse as sp
+
+
+    for name, X in arrays.items():
+
+        if sp.issparse(X):
+            X = X.tocsr()
+            for part in ["data", "indices", "indptr"]:
+                np.save(os.path.join(data_dir, f"{name}.{part}.npy"), getattr(X, part))
+            with open(os.path.join(data_dir, f"{name}.shape.json"), "w") as outfile:
+                json.dump(list(X.shape), outfile)
+        else:
+            np.save(os.path.join(data_dir, f"{name}.npy"), np.asarray(X))
+
+
+
+# the memory-mapped data of a worker process, set by _load_shared()
+_shared = {}
+
+def _load_shared(data_dir):
+
+    import os
+    import json
+    import numpy as np
+    import scipy.sparse as sp
+
+
+    for name in ["X_train", "y_train", "X_test", "y_test", "X_validation", "y_validation",
+                 "row_order"]:
+
+        path = os.path.join(data_dir, f"{name}.npy")
+
+        if os.path.exists(path):
+            _shared[name] = np.load(path, mmap_mode="r")
+            continue
+
+        with open(os.path.join(data_dir, f"{name}.shape.json")) as infile:
+            shape = tuple(json.load(infile))
+
+        parts = [np.load(os.path.join(data_dir, f"{name}.{part}.npy"), mmap_mode="r")
+                 for part in ["data", "indices", "indptr"]]
+
+        _shared[name] = sp.csr_matrix(tuple(parts), shape=shape, copy=False)
+
+
+
+def _fit_and_score(estimator, params, rows):
+
+    """Fit a copy of estimator with params on the first rows fitting
+    rows (in the shared random order) and score it on the validation
+    rows."""
+
+    import time
+    import numpy as np
+    from sklearn.base import clone
+
+
+    ind = np.sort(_shared["row_order"][:rows])
+    X_train, y_train = _shared["X_train"][ind], _shared["y_train"][ind]
+
+    model = clone(estimator).set_params(**params)
+
+    t_start = time.perf_counter()
+    model.fit(X_train, y_train)
+    elapsed = time.perf_counter() - t_start
+
+    return {"rows": int(rows),
+            "train score": float(model.score(X_train, y_train)),
+            "validation score": float(model.score(_shared["X_validation"], _shared["y_validation"])),
+            "seconds": elapsed}
+
+
+
+def _fit_and_test(estimator, params):
+
+    """Fit a copy of estimator with params on all of the training rows
+    and score it on the test rows."""
+
+    import time
+    from sklearn.base import clone
+
+
+    X_train, y_train = _shared["X_train"], _shared["y_train"]
+
+    model = clone(estimator).set_params(**params)
+
+    t_start = time.perf_counter()
+    model.fit(X_train, y_train)
+    elapsed = time.perf_counter() - t_start
+
+    return {"rows": int(X_train.shape[0]),
+            "train score": float(model.score(X_train, y_train)),
+            "test score": float(model.score(_shared["X_test"], _shared["y_test"])),
+            "seconds": elapsed}
@@ -0,0 +1,428 @@
+"""Opt-in profiling of the crash_utils stages.
+
+The cleaning and modelling functions wrap their most expensive
+operations in profile_stage() blocks, the stages of CrashPipeline are
+profiled as the parents of those, and profiled() decorates any other
+function as a stage.  Both do nothing but call through until
+profiling is switched on, either with
+
+    from crash_utils.instrumentation import enable_profiling
+    profiler = enable_profiling("profile.jsonl")
+    df = basic_cleaning(df)
+    profiler.report()
+
+or for a whole run by setting the environment variable
+CRASH_UTILS_PROFILE to the file to write to.
+
+While profiling is on, every stage gives one record, appended as a
+line of JSON to the file (if any) and kept in profiler.records:
+    stage        name of the stage
+    parent       the stage it ran inside of (None at the top)
+    started      local time the stage started
+    seconds      wall time
+    cpu seconds  CPU time of this process
+    rows in      rows of the frame passed in (if any)
+    rows out     rows of the result (if any)
+    peak MB      peak memory allocated above what was allocated when
+                 the stage started (tracemalloc, if track_memory)
+    copies       calls of DataFrame.copy() and Series.copy() (deep
+                 copies only).  The copies pandas makes inside other
+                 methods (filtering, sort_values(), astype(), ...) are
+                 not counted; they show up in peak MB
+
+Peak memory is kept with peak_memory(), which CrashPipeline uses as
+well, so the peaks of nested stages and of the pipeline don't
+disturb one another.
+
+"""
+
+import os
+import functools
+
+
+# the active Profiler, None when profiling is off
+_profiler = None
+
+# the open peak_memory() blocks (see _fold_peak())
+_peak_watchers = []
+
+
+
+class Profiler:
+
+    """Collects the stage records while profiling is on.  Made by
+    enable_profiling(); see the module docstring."""
+
+    def __init__(self, path=None, track_memory=True, count_copies=True):
+
+        self.path = path
+        self.track_memory = track_memory
+        self.count_copies = count_copies
+        self.records = []
+
+        self._stack = []
+        self._started_tracemalloc = False
+        self._copy_methods = {}
+
+
+    def report(self):
+
+        """The records as a DataFrame."""
+
+        import pandas as pd
+
+        return pd.DataFrame(self.records)
+
+
+    def _start(self):
+
+        import tracemalloc
+        import pandas as pd
+
+
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+        if self.count_copies:
+            for cls in [pd.DataFrame, pd.Series]:
+                self._copy_methods[cls] = cls.__dict__.get("copy")
+                cls.copy = _counting_copy(cls.copy)
+
+
+    def _stop(self):
+
+        import tracemalloc
+
+
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+        for cls, method in self._copy_methods.items():
+            # the class may only have inherited copy()
+            if method is None:
+                del cls.copy
+            else:
+                cls.copy = method
+        self._copy_methods = {}
+
+
+    def _enter(self, stage):
+
+        import time
+        import datetime
+
+
+        stage.parent = self._stack[-1].name if self._stack else None
+        stage.started = datetime.datetime.now().isoformat(timespec="milliseconds")
+
+        if self.track_memory:
+            stage.memory = peak_memory().__enter__()
+
+        self._stack.append(stage)
+
+        stage.cpu_start = time.process_time()
+        stage.wall_start = time.perf_counter()
+
+
+    def _exit(self, stage):
+
+        import time
+        import json
+
+
+        seconds = time.perf_counter() - stage.wall_start
+        cpu_seconds = time.process_time() - stage.cpu_start
+
+        if self.track_memory:
+            stage.memory.__exit__(None, None, None)
+
+        self._stack.remove(stage)
+
+        record = {"stage": stage.name,
+                  "parent": stage.parent,
+                  "started": stage.started,
+                  "seconds": round(seconds, 6),
+                  "cpu seconds": round(cpu_seconds, 6),
+                  "rows in": stage.rows_in,
+                  "rows out": stage.rows_out,
+                  "peak MB": round(stage.memory.peak_mb, 3) if self.track_memory else None,
+                  "copies": stage.copies if self.count_copies else None}
+
+        self.records.append(record)
+
+        if self.path is not None:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+
+
+
+class _PeakMemory:
+
+    """An open peak_memory() block."""
+
+    def __init__(self, enabled=True):
+
+        self.enabled = enabled
+        self.baseline = self.peak = 0
+        self._started_tracemalloc = False
+
+
+    @property
+    def peak_mb(self):
+
+        if not self.enabled:
+            return None
+
+        return (self.peak - self.baseline) / 1e6
+
+
+    def __enter__(self):
+
+        import tracemalloc
+
+
+        if not self.enabled:
+            return self
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+        _fold_peak()
+        self.baseline = self.peak = tracemalloc.get_traced_memory()[0]
+        _peak_watchers.append(self)
+
+        return self
+
+
+    def __exit__(self, *exc):
+
+        import tracemalloc
+
+
+        if not self.enabled:
+            return False
+
+        _fold_peak()
+        _peak_watchers.remove(self)
+
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+        return False
+
+
+
+class _Stage:
+
+    """An open profile_stage() block.  Set rows_out in the block if the
+    result isn't known to profile_stage() itself."""
+
+    def __init__(self, profiler, name, rows_in):
+
+        self.profiler = profiler
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.copies = 0
+
+
+    def __enter__(self):
+
+        self.profiler._enter(self)
+
+        return self
+
+
+    def __exit__(self, *exc):
+
+        self.profiler._exit(self)
+
+        return False
+
+
+
+class _NoStage:
+
+    """What profile_stage() gives while profiling is off."""
+
+    rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+
+def enable_profiling(path=None, track_memory=True, count_copies=True):
+
+    """Switch profiling on, writing the records to path (JSON lines,
+    appended) if given.  Returns the Profiler."""
+
+    global _profiler
+
+
+    disable_profiling()
+
+    _profiler = Profiler(path, track_memory=track_memory, count_copies=count_copies)
+    _profiler._start()
+
+    return _profiler
+
+
+
+def disable_profiling():
+
+    """Switch profiling off again.  Returns the Profiler that was
+    active (or None), whose records are kept."""
+
+    global _profiler
+
+
+    profiler, _profiler = _profiler, None
+
+    if profiler is not None:
+        profiler._stop()
+
+    return profiler
+
+
+
+def peak_memory(enabled=True):
+
+    """Context manager measuring the peak memory allocated in the block
+    inside it above what was allocated when it started, as peak_mb
+    (None if not enabled).  tracemalloc is started if it isn't running
+    already (and stopped again at the end):
+
+    with peak_memory() as memory:
+        ...
+    print(memory.peak_mb)
+
+    tracemalloc keeps one peak only.  Blocks inside one another each
+    get their own peak because the peak is only ever reset here: it is
+    first folded into every open block (see _fold_peak()).  Don't call
+    tracemalloc.reset_peak() inside a block.
+
+    """
+
+    return _PeakMemory(enabled)
+
+
+
+def profile_stage(name, df=None):
+
+    """Context manager profiling the block inside it as stage name.
+    Pass the frame going in as df to record its rows, and set rows_out
+    on the stage for the rows coming out:
+
+    with profile_stage("parse dates", df) as stage:
+        ...
+        stage.rows_out = len(out)
+
+    """
+
+    if _profiler is None:
+        return _NO_STAGE
+
+    return _Stage(_profiler, name, _n_rows(df))
+
+
+
+def profiled(name=None):
+
+    """Decorator profiling every call of a function as a stage, named
+    after the function unless name is given.  The rows in are those of
+    the first argument, the rows out those of the result."""
+
+    def decorator(func):
+
+        stage_name = func.__name__ if name is None else name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            if _profiler is None:
+                return func(*args, **kwargs)
+
+            with _Stage(_profiler, stage_name, _n_rows(args[0] if args else None)) as stage:
+                result = func(*args, **kwargs)
+                stage.rows_out = _n_rows(result)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+
+def _fold_peak():
+
+    """Fold the peak memory since the last call into every open
+    peak_memory() block, then start measuring a new peak."""
+
+    import tracemalloc
+
+
+    if not tracemalloc.is_tracing():
+        return
+
+    peak = tracemalloc.get_traced_memory()[1]
+
+    for watcher in _peak_watchers:
+        watcher.peak = max(watcher.peak, peak)
+
+    tracemalloc.reset_peak()
+
+
+
+def _counting_copy(copy):
+
+    @functools.wraps(copy)
+    def wrapper(self, *args, **kwargs):
+
+        deep = kwargs.get("deep", args[0] if args else True)
+
+        if deep and _profiler is not None:
+            for stage in _profiler._stack:
+                stage.copies += 1
+
+        return copy(self, *args, **kwargs)
+
+    return wrapper
+
+
+
+def _n_rows(obj):
+
+    """Rows of a frame, array or matrix, or of the first element of a
+    tuple of them (e.g. the (X, feature_names, y) of
+    prepare_data_for_modelling(sparse = True)); None for anything
+    else."""
+
+    if isinstance(obj, tuple) and len(obj) > 0:
+        obj = obj[0]
+
+    shape = getattr(obj, "shape", None)
+
+    if shape is None or len(shape) == 0:
+        return None
+
+    return int(shape[0])
+
+
+
+if os.environ.get("CRASH_UTILS_PROFILE"):
+    enable_profiling(os.environ["CRASH_UTILS_PROFILE"])
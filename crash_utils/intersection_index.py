@@ -0,0 +1,314 @@
+class IntersectionIndex:
+
+    """Integer ids for the intersections (pairs of on street and cross
+    street names) of cleaned crashes, with per-intersection crash and
+    injury counts.
+
+    make_crash_features() only keeps whether a crash happened at an
+    intersection, and collapses the rarer streets into "other".  Here
+    every street name is normalized (see normalize_street_names()) and
+    interned as an integer, and each crash with both names gets the id
+    of its unordered pair of streets, so "Broadway & W 42 Street" and
+    "W 42 St & Broadway" are the same intersection.  Crashes that are
+    not at an intersection get id -1.
+
+    index = IntersectionIndex(df)
+    index.ranking(start="2019-01-01").head(20)     # most injuries first
+    k = index.lookup("Broadway", "West 42 Street")
+    index.crashes[k], index.injured[k], index.count(k, start="2020-01-01")
+    index.history_features(windows=(30, 365))      # for the model
+
+    lookup() is a dictionary lookup and the totals are arrays indexed
+    by id.  The crashes are also kept sorted by intersection and time,
+    so the counts over any date window (count()) are two binary
+    searches.
+
+    """
+
+    def __init__(self, df):
+
+        import numpy as np
+        import pandas as pd
+
+
+        on = normalize_street_names(df["on street name"])
+        cross = normalize_street_names(df["cross street name"])
+
+
+        # intern the street names of both columns together
+        codes, self.streets = pd.factorize(np.concatenate((on, cross)))
+        on_code, cross_code = codes[:len(df)], codes[len(df):]
+
+        self._codes = {name: k for k, name in enumerate(self.streets)}
+
+        is_intersection = (on_code >= 0) & (cross_code >= 0)
+
+        low = np.minimum(on_code, cross_code).astype(np.int64)
+        high = np.maximum(on_code, cross_code).astype(np.int64)
+        pair = low * len(self.streets) + high
+
+        ids, pairs = pd.factorize(pair[is_intersection])
+
+        self.intersection = np.full(len(df), -1, dtype=np.int64)
+        self.intersection[is_intersection] = ids
+
+        self.street_a = self.streets[pairs // len(self.streets)]
+        self.street_b = self.streets[pairs % len(self.streets)]
+
+        self._ids = {(a, b): k for k, (a, b) in enumerate(zip(self.street_a, self.street_b))}
+
+
+        # totals per intersection
+        n = len(pairs)
+        ind = self.intersection[is_intersection]
+
+        injured = df["number of cyclist injured"].fillna(0).to_numpy(dtype=np.int64)
+        killed = df["number of cyclist killed"].fillna(0).to_numpy(dtype=np.int64)
+
+        self.crashes = np.bincount(ind, minlength=n)
+        self.injured = np.bincount(ind, weights=injured[is_intersection], minlength=n).astype(np.int64)
+        self.killed = np.bincount(ind, weights=killed[is_intersection], minlength=n).astype(np.int64)
+
+
+        # crashes sorted by intersection, then time, for the windowed
+        # counts
+        time = df["datetime"].to_numpy(dtype="datetime64[ns]").astype(np.int64)
+        rows = np.nonzero(is_intersection)[0]
+        order = np.lexsort((time[rows], self.intersection[rows]))
+
+        self._rows = rows[order]
+        self._time = time[self._rows]
+        self._start = np.searchsorted(self.intersection[self._rows], np.arange(n + 1))
+        self._injured_sum = np.concatenate(([0], np.cumsum(injured[self._rows])))
+        self._killed_sum = np.concatenate(([0], np.cumsum(killed[self._rows])))
+
+        self._df_time = time
+        self._df_injured = injured
+
+
+    def __len__(self):
+
+        return len(self.crashes)
+
+
+    def lookup(self, street_a, street_b):
+
+        """Id of the intersection of two streets (in either order), or
+        -1 if no crash happened there."""
+
+        a, b = normalize_street_names([street_a, street_b])
+
+        if a not in self._codes or b not in self._codes:
+            return -1
+
+        if self._codes[a] > self._codes[b]:
+            a, b = b, a
+
+        return self._ids.get((a, b), -1)
+
+
+    def name(self, k):
+
+        return f"{self.street_a[k]} & {self.street_b[k]}"
+
+
+    def count(self, k, start=None, end=None):
+
+        """Crashes, cyclists injured and cyclists killed at intersection
+        k with start <= datetime < end."""
+
+        import pandas as pd
+
+
+        first, last = self._start[k], self._start[k + 1]
+
+        if start is not None:
+            first += self._time[first:last].searchsorted(pd.Timestamp(start).value, side="left")
+        if end is not None:
+            last = self._start[k] + self._time[self._start[k]:last].searchsorted(pd.Timestamp(end).value,
+                                                                                 side="left")
+        last = max(first, last)
+
+        return {"crashes": int(last - first),
+                "injured": int(self._injured_sum[last] - self._injured_sum[first]),
+                "killed": int(self._killed_sum[last] - self._killed_sum[first])}
+
+
+    def ranking(self, start=None, end=None, by="injured"):
+
+        """Every intersection with its counts over start <= datetime <
+        end, most dangerous (by = "injured", "killed" or "crashes")
+        first."""
+
+        import numpy as np
+        import pandas as pd
+
+
+        in_window = np.ones(len(self._rows), dtype=bool)
+
+        if start is not None:
+            in_window &= self._time >= pd.Timestamp(start).value
+        if end is not None:
+            in_window &= self._time < pd.Timestamp(end).value
+
+        ind = self.intersection[self._rows[in_window]]
+        n = len(self)
+
+        injured = np.diff(self._injured_sum)[in_window]
+        killed = np.diff(self._killed_sum)[in_window]
+
+        ranking = pd.DataFrame({"intersection": np.arange(n),
+                                "street a": self.street_a,
+                                "street b": self.street_b,
+                                "crashes": np.bincount(ind, minlength=n),
+                                "injured": np.bincount(ind, weights=injured, minlength=n).astype(np.int64),
+                                "killed": np.bincount(ind, weights=killed, minlength=n).astype(np.int64)})
+
+        ranking = ranking[ranking["crashes"] > 0]
+
+        return ranking.sort_values(by=[by, "crashes"], ascending=False, kind="stable", ignore_index=True)
+
+
+    def history_features(self, windows=(30, 365)):
+
+        """For every crash of the indexed frame (in its order), the
+        number of earlier crashes and cyclist injuries at the same
+        intersection in the preceding windows (days).  Only crashes
+        strictly before each crash are counted, so the features never
+        look ahead.  Crashes not at an intersection get 0."""
+
+        import numpy as np
+        import pandas as pd
+
+
+        features = {}
+        at_intersection = self.intersection >= 0
+
+        for days in windows:
+
+            crashes = np.zeros(len(self.intersection), dtype=np.int64)
+            injured = np.zeros(len(self.intersection), dtype=np.int64)
+
+            values = np.column_stack((np.ones(at_intersection.sum()),
+                                      self._df_injured[at_intersection]))
+
+            sums = trailing_window_sums(self.intersection[at_intersection],
+                                        self._df_time[at_intersection], values,
+                                        np.timedelta64(days, "D"))
+
+            crashes[at_intersection] = sums[:, 0]
+            injured[at_intersection] = sums[:, 1]
+
+            features[f"intersection crashes {days}d"] = crashes
+            features[f"intersection injured {days}d"] = injured
+
+
+        return pd.DataFrame(features)
+
+
+
+def normalize_street_names(values):
+
+    """Normalize street names so spelling variants of the same street
+    match: lower-cased, trimmed, runs of white space collapsed and the
+    common abbreviations spelled out ("St" -> "street", "Ave" ->
+    "avenue", ...), then title-cased as in basic_cleaning().  A single
+    letter direction is only spelled out as the first word of a longer
+    name ("W 4 St" -> "West 4 Street", but "Avenue N" stays), and a
+    leading "St" is "Saint" ("St Marks Pl" -> "Saint Marks Place").
+    Missing names stay None.  Each distinct name is only worked on
+    once."""
+
+    import re
+    import numpy as np
+    import pandas as pd
+
+
+    abbreviations = {"st": "street", "str": "street",
+                     "ave": "avenue", "av": "avenue", "avenu": "avenue",
+                     "rd": "road", "blvd": "boulevard", "pkwy": "parkway",
+                     "pl": "place", "dr": "drive", "ln": "lane", "ct": "court",
+                     "hwy": "highway", "expy": "expressway", "expwy": "expressway"}
+
+    # only for the first word of a name with more words after it
+    leading = {"n": "north", "s": "south", "e": "east", "w": "west", "st": "saint"}
+
+    def normalize(name):
+        if not isinstance(name, str):
+            return None
+        words = re.sub(r"[.,]", " ", name.lower()).split()
+        if not words:
+            return None
+        if len(words) > 1 and words[0] in leading:
+            words = [leading[words[0]]] + [abbreviations.get(word, word) for word in words[1:]]
+        else:
+            words = [abbreviations.get(word, word) for word in words]
+        return " ".join(words).title()
+
+
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+
+    names = np.array([normalize(name) for name in uniques] + [None], dtype=object)
+
+    return names[codes]
+
+
+
+def trailing_window_sums(group, time, values, window):
+
+    """Sum of values over the earlier rows of the same group within
+    window before each row: for row i, the rows j with group[j] ==
+    group[i] and time[i] - window <= time[j] < time[i].  Rows at the
+    same time as row i are not counted, so nothing from row i's own
+    moment or later leaks into its result.
+
+    group is an integer array (e.g. intersection or zip code codes),
+    time a datetime64 array, values an array of one or more columns
+    and window a timedelta64 (times are taken to the second).
+    Everything is done with one sort and two binary searches, however
+    many groups there are.  Returns the sums in the order of the rows.
+
+    """
+
+    import numpy as np
+
+
+    group = np.asarray(group, dtype=np.int64)
+    time = np.asarray(time, dtype="datetime64[ns]").astype(np.int64)
+    values = np.asarray(values, dtype=float)
+
+    one_column = values.ndim == 1
+    if one_column:
+        values = values[:, None]
+
+    if len(group) == 0:
+        sums = np.zeros(values.shape)
+        return sums[:, 0] if one_column else sums
+
+
+    # work in whole seconds, so the groups can be laid out on one
+    # int64 time line below
+    time = time // 10**9
+    window = np.timedelta64(window, "s").astype(np.int64)
+
+
+    # put the groups one after the other on a single time line, far
+    # enough apart that no window reaches into the next group
+    offset = time - time.min()
+    spacing = offset.max() + window + 1
+    group_code = np.unique(group, return_inverse=True)[1].ravel()
+    key = group_code * spacing + offset
+
+    order = np.argsort(key, kind="stable")
+    key = key[order]
+
+    cumulative = np.vstack((np.zeros((1, values.shape[1])), np.cumsum(values[order], axis=0)))
+
+    first = np.searchsorted(key, key - window, side="left")
+    last = np.searchsorted(key, key, side="left")
+
+    sums = np.empty(values.shape)
+    sums[order] = cumulative[last] - cumulative[first]
+
+
+    return sums[:, 0] if one_column else sums
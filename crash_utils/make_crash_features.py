@@ -1,11 +1,12 @@
-def make_crash_features(df, drop_featured_columns = True):
+def make_crash_features(df, drop_featured_columns = True, categorical = False,
+                        street_names = None, token_columns = True):
     """
     Feature Engineering
 
     [x] is_intersection (when ON STREET NAME and CROSS STREET NAME are non-null)
-    [ ] is_day, is_dusk, is_dawn, is_night (use hour)
+    [x] is_day, is_dusk, is_dawn, is_night (see make_time_features.py)
     [x] hour, month, day of week
-    [ ] is_summer, is_winter (use month) or maybe do this by season
+    [x] is_summer, is_winter (see make_time_features.py)
     [ ] weather
     [x] number of vehicles in accident
     [x] number of factors in accident
@@ -13,6 +14,21 @@ def make_crash_features(df, drop_featured_columns = True):
     Also concatenates the CONTRIBUTING FACTOR and VEHICLE TYPE columns
     so that the count vectorizer can easily digest them.
 
+    With categorical = True the concatenated columns are built from
+    integer codes instead: each vehicle/factor name is given a code,
+    the codes of each row are sorted as integers, and a string is only
+    built once for every distinct combination of codes.  The result is
+    the same, without any per-row Python string work.  The bag of words
+    counts can also be had straight from the codes, see
+    crash_token_counts(); when those are all that is needed, pass
+    token_columns = False and the concatenated columns aren't built at
+    all (the n_vehicle and n_factor counts still are).
+
+    On street names with fewer than 10 crashes in df are replaced by
+    "other".  To apply a list of streets learned on other data instead
+    (see crash_utils/crash_feature_transformer.py), pass it as
+    street_names: every street not in it becomes "other".
+
     """
 
     # the usual
@@ -29,8 +45,8 @@ def make_crash_features(df, drop_featured_columns = True):
 
 
     # replace missing streets with "missing"
-    df["on street name"].fillna("missing", inplace = True)
-    df["cross street name"].fillna("missing", inplace=True)
+    df["on street name"] = df["on street name"].fillna("missing")
+    df["cross street name"] = df["cross street name"].fillna("missing")
 
 
     # drop cross street
@@ -43,10 +59,14 @@ def make_crash_features(df, drop_featured_columns = True):
 
 
     # let's replace all street names with very few incidents with "other"
-    mask = df["on street name"].value_counts().values < 10
-    strs_to_other = df["on street name"].value_counts().index[mask]
+    if street_names is None:
+        mask = df["on street name"].value_counts().values < 10
+        strs_to_other = df["on street name"].value_counts().index[mask]
+
+        mask = df["on street name"].isin(strs_to_other)
+    else:
+        mask = ~df["on street name"].isin(street_names)
 
-    mask = df["on street name"].isin(strs_to_other)
     df.loc[mask,"on street name"] = "other"
 
 
@@ -88,35 +108,50 @@ def make_crash_features(df, drop_featured_columns = True):
 
     # concatenate the vehicle types into a single column
 
-    # concatenate the columns
-    new_str = df["vehicle type code 1"]
-    for col in cols[1:]:
-        new_str = new_str.str.cat(df[col], sep = ",", na_rep = "")
+    if token_columns and categorical:
+
+        # there are several cases when VEHICLES contains the same two
+        # vehicles, but they are ordered differently.  for example,
+        # “taxi bike” and “bike taxi”. fix by alphabetizing.  the codes
+        # are in alphabetical order, so sort them (missing ones, -1,
+        # last)
+        codes, tokens = _token_codes(df, cols, _vehicle_token)
+        codes = np.sort(codes, axis=1)[:, ::-1]
+
+        df["vehicles"] = _join_tokens(codes, tokens)
+
+    elif token_columns:
+
+        # concatenate the columns
+        new_str = df["vehicle type code 1"]
+        for col in cols[1:]:
+            new_str = new_str.str.cat(df[col], sep = ",", na_rep = "")
+
+
+        # add result as new column.
+        df["vehicles"] = new_str
+
 
+        # first, put a dash in the spaces to keep things like "passenger
+        # vehicle" together
+        df["vehicles"] = df["vehicles"].str.replace(" ","-")
 
-    # add result as new column.
-    df["vehicles"] = new_str
 
+        # replace the commas with a white space for the count vectorizer
+        df["vehicles"] = df["vehicles"].str.replace(","," ")
 
-    # first, put a dash in the spaces to keep things like "passenger
-    # vehicle" together
-    df["vehicles"] = df["vehicles"].str.replace(" ","-")
 
+        # there are several cases when VEHICLES contains the same two
+        # vehicles, but they are ordered differently.  for example, “taxi
+        # bike” and “bike taxi”. fix by alphabetizing
+        df["vehicles"] = df["vehicles"].str.split().apply(sorted,reverse=True).str.join(sep=" ")
 
-    # replace the commas with a white space for the count vectorizer
-    df["vehicles"] = df["vehicles"].str.replace(","," ")
 
     # drop the individual columns
     if drop_featured_columns:
         df.drop(columns = cols, inplace = True)
 
 
-    # there are several cases when VEHICLES contains the same two
-    # vehicles, but they are ordered differently.  for example, “taxi
-    # bike” and “bike taxi”. fix by alphabetizing
-    df["vehicles"] = df["vehicles"].str.split().apply(sorted,reverse=True).str.join(sep=" ")
-
-
     # now concatenate the contributing factors
 
     # build list of columns on which to operate
@@ -128,30 +163,39 @@ def make_crash_features(df, drop_featured_columns = True):
     df["n_factor"] = df.loc[:,cols].notnull().sum(axis=1)
 
 
-    # concatenate all CONTRIBUTING FACTORS text into a single column
-    new_str = df["contributing factor vehicle 1"]
-    for col in cols[1:]:
-        new_str = new_str.str.cat(df[col], sep = ",", na_rep = "")
+    if token_columns and categorical:
+
+        # the factors stay in column order, with an empty string for
+        # each missing one
+        codes, tokens = _token_codes(df, cols, _factor_token)
+        df["factors"] = _join_tokens(codes, tokens, keep_missing = True)
+
+    elif token_columns:
+
+        # concatenate all CONTRIBUTING FACTORS text into a single column
+        new_str = df["contributing factor vehicle 1"]
+        for col in cols[1:]:
+            new_str = new_str.str.cat(df[col], sep = ",", na_rep = "")
 
 
-    # now drop the individual columns
-    df["factors"] = new_str
+        # now drop the individual columns
+        df["factors"] = new_str
 
 
-    # put a dash in the spaces to keep things like "passenger vehicle" together
-    df["factors"] = df["factors"].str.replace(" ","-")
+        # put a dash in the spaces to keep things like "passenger vehicle" together
+        df["factors"] = df["factors"].str.replace(" ","-")
 
 
-    # replace "Driver-Inattention/Distraction" with "Driver-Inattention"
-    df["factors"] = df["factors"].str.replace("Driver-Inattention/Distraction","Driver-Inattention")
+        # replace "Driver-Inattention/Distraction" with "Driver-Inattention"
+        df["factors"] = df["factors"].str.replace("Driver-Inattention/Distraction","Driver-Inattention")
 
-    # replace the commas with a white space for the count vectorizer
-    df["factors"] = df["factors"].str.replace(","," ")
+        # replace the commas with a white space for the count vectorizer
+        df["factors"] = df["factors"].str.replace(","," ")
 
-    # something about the string types is causing the sklearn
-    # CountVectorizer to choke.  solution is to change to unicode:
-    # https://stackoverflow.com/questions/39303912/tfidfvectorizer-in-scikit-learn-valueerror-np-nan-is-an-invalid-document
-    df["factors"] = df["factors"].values.astype('U')
+        # something about the string types is causing the sklearn
+        # CountVectorizer to choke.  solution is to change to unicode:
+        # https://stackoverflow.com/questions/39303912/tfidfvectorizer-in-scikit-learn-valueerror-np-nan-is-an-invalid-document
+        df["factors"] = df["factors"].values.astype('U')
 
 
     if drop_featured_columns:
@@ -159,3 +203,144 @@ def make_crash_features(df, drop_featured_columns = True):
 
 
     return df
+
+
+
+def crash_token_counts(df, kind):
+
+    """Bag of words counts of the vehicles (kind = "vehicles") or the
+    contributing factors (kind = "factors") of each crash, computed
+    straight from the VEHICLE TYPE / CONTRIBUTING FACTOR columns
+    without building any strings.
+
+    Returns a scipy CSR matrix and the array of words (its columns).
+    These are the same as fitting CountVectorizer(token_pattern =
+    r"(?u)\S\S+") on the "vehicles" or "factors" column made by
+    make_crash_features() and transforming it: lower-cased words of at
+    least 2 characters, in alphabetical order.
+
+    """
+
+    import numpy as np
+    import scipy.sparse as sp
+
+
+    if kind == "vehicles":
+        col_ind = df.columns.str.match("vehicle type")
+        token = _vehicle_token
+    elif kind == "factors":
+        col_ind = df.columns.str.match("contributing")
+        token = _factor_token
+    else:
+        raise ValueError(f'kind must be "vehicles" or "factors", not "{kind}"')
+
+    cols = df.columns[col_ind].tolist()
+
+    codes, tokens = _token_codes(df, cols, token)
+
+
+    # the count vectorizer lower-cases the words and ignores 1-character
+    # ones
+    words = np.array([t.lower() for t in tokens], dtype=object)
+    keep = np.array([len(w) >= 2 for w in words], dtype=bool)
+    vocabulary, word_codes = np.unique(words[keep], return_inverse=True)
+
+    token_to_word = np.full(len(tokens) + 1, -1)
+    token_to_word[np.nonzero(keep)[0]] = word_codes
+
+
+    rows = np.repeat(np.arange(codes.shape[0]), codes.shape[1])
+    word = token_to_word[codes.ravel()]
+    found = word >= 0
+
+    # duplicate (row, word) entries are summed
+    counts = sp.csr_matrix((np.ones(found.sum(), dtype=np.int64), (rows[found], word[found])),
+                           shape=(codes.shape[0], len(vocabulary)))
+    counts.sum_duplicates()
+
+    return counts, vocabulary.astype(str)
+
+
+
+def _vehicle_token(name):
+
+    # put a dash in the spaces to keep things like "passenger vehicle"
+    # together
+    return name.replace(" ", "-")
+
+
+
+def _factor_token(name):
+
+    name = name.replace(" ", "-")
+
+    return name.replace("Driver-Inattention/Distraction", "Driver-Inattention")
+
+
+
+def _token_codes(df, cols, token):
+
+    """Integer code of the token of every value in cols (-1 where the
+    value is missing or empty), and the alphabetical array of tokens
+    the codes refer to."""
+
+    import numpy as np
+    import pandas as pd
+
+
+    # factorize the columns one at a time, then translate each column's
+    # codes into codes of the shared, sorted vocabulary
+    col_codes = []
+    col_tokens = []
+
+    for col in cols:
+        codes, uniques = pd.factorize(df[col])
+        col_codes.append(codes)
+        col_tokens.append([token(u) if isinstance(u, str) else "" for u in uniques])
+
+    tokens = np.array(sorted(set(t for ts in col_tokens for t in ts) - {""}), dtype=object)
+    lookup = {t: k for k, t in enumerate(tokens)}
+
+    out = np.empty((len(df), len(cols)), dtype=np.int64)
+
+    for k, (codes, ts) in enumerate(zip(col_codes, col_tokens)):
+        # one extra entry at the end for the missing values' code -1
+        lut = np.array([lookup.get(t, -1) for t in ts] + [-1], dtype=np.int64)
+        out[:, k] = lut[codes]
+
+    return out, tokens
+
+
+
+def _join_tokens(codes, tokens, keep_missing = False):
+
+    """Space-separated string of the tokens of each row of codes, built
+    once for every distinct row.  Missing tokens (code -1) are skipped,
+    or kept as empty strings if keep_missing is True."""
+
+    import numpy as np
+    import pandas as pd
+
+
+    if codes.shape[0] == 0:
+        return np.array([], dtype=str)
+
+    # pack each row of codes into a single integer so that the distinct
+    # rows can be found with a hash table rather than a sort
+    base = len(tokens) + 1
+
+    if base ** codes.shape[1] < 2**62:
+        powers = base ** np.arange(codes.shape[1], dtype=np.int64)
+        inverse, keys = pd.factorize(((codes + 1) * powers).sum(axis=1))
+        unique_rows = (keys[:, None] // powers) % base - 1
+    else:
+        unique_rows, inverse = np.unique(codes, axis=0, return_inverse=True)
+
+    strings = []
+    for row in unique_rows:
+        if keep_missing:
+            strings.append(" ".join(tokens[c] if c >= 0 else "" for c in row))
+        else:
+            strings.append(" ".join(tokens[c] for c in row if c >= 0))
+
+    return np.array(strings, dtype=str)[inverse.ravel()]
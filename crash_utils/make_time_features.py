@@ -0,0 +1,127 @@
+def make_time_features(df, windows = (7, 30, 365)):
+
+    """Time-aware features for the crashes of basic_cleaning() (or the
+    crash pipeline), added as new columns:
+
+    1.  is_day, is_dawn, is_dusk, is_night: the phase of the sun at the
+        time and place of the crash (see solar_elevation()).  Day is
+        the sun above the horizon, dawn and dusk civil twilight (the
+        sun less than 6 degrees below it) in the morning and evening,
+        night the rest.
+    2.  is_spring, is_summer, is_fall, is_winter (from the month;
+        winter is December to February)
+    3.  for every window (days): the number of crashes and of cyclists
+        injured in the same zip code, and at the same intersection (see
+        crash_utils/intersection_index.py), over the window before the
+        crash.  Only crashes strictly earlier than each crash are
+        counted, so none of these features look ahead.
+
+    These are the "is_day, is_dusk, ..." and "is_summer, is_winter"
+    items of the make_crash_features() to-do list.  Everything is
+    vectorized; the windowed counts take one sort per window (see
+    trailing_window_sums()).
+
+    """
+
+    import numpy as np
+    import pandas as pd
+    from crash_utils.intersection_index import IntersectionIndex, trailing_window_sums
+
+
+    # phase of the sun.  crashes without coordinates are taken to be
+    # in the middle of the city
+    lat = df["latitude"].fillna(40.7128).to_numpy(dtype = float)
+    lon = df["longitude"].fillna(-74.0060).to_numpy(dtype = float)
+
+    elevation, morning = solar_elevation(df["datetime"], lat, lon)
+
+    df["is_day"] = elevation > -0.833
+    df["is_dawn"] = (elevation <= -0.833) & (elevation > -6) & morning
+    df["is_dusk"] = (elevation <= -0.833) & (elevation > -6) & ~morning
+    df["is_night"] = elevation <= -6
+
+
+    # seasons
+    month = df["datetime"].dt.month
+    df["is_spring"] = month.isin([3, 4, 5])
+    df["is_summer"] = month.isin([6, 7, 8])
+    df["is_fall"] = month.isin([9, 10, 11])
+    df["is_winter"] = month.isin([12, 1, 2])
+
+
+    # crashes and injuries over the preceding windows, by zip code and
+    # by intersection
+    time = df["datetime"].to_numpy(dtype = "datetime64[ns]")
+    injured = df["number of cyclist injured"].fillna(0).to_numpy(dtype = float)
+    values = np.column_stack((np.ones(len(df)), injured))
+
+    zip_code = pd.factorize(df["zip code"])[0]
+    intersection = IntersectionIndex(df).intersection
+
+    for name, group in [("zip", zip_code), ("intersection", intersection)]:
+
+        known = group >= 0
+
+        for days in windows:
+
+            sums = np.zeros((len(df), 2))
+            sums[known] = trailing_window_sums(group[known], time[known], values[known],
+                                               np.timedelta64(days, "D"))
+
+            df[f"{name} crashes {days}d"] = sums[:, 0].astype(np.int64)
+            df[f"{name} injured {days}d"] = sums[:, 1].astype(np.int64)
+
+
+    return df
+
+
+
+def solar_elevation(datetime, lat, lon, timezone = "America/New_York"):
+
+    """Elevation of the sun (degrees above the horizon) at the local
+    times in datetime and the given latitudes and longitudes, and
+    whether it is morning (the sun east of the meridian).
+
+    Uses the NOAA fractional-year approximation of the equation of time
+    and the solar declination, good to a fraction of a degree, which is
+    plenty to tell day from twilight from night.  The crash times are
+    local New York times and are converted to UTC first (times in the
+    hour repeated when daylight saving time ends are taken as standard
+    time).
+
+    """
+
+    import numpy as np
+    import pandas as pd
+
+
+    datetime = pd.Series(pd.to_datetime(datetime)).reset_index(drop = True)
+
+    utc = datetime.dt.tz_localize(timezone, ambiguous = np.zeros(len(datetime), dtype = bool),
+                                  nonexistent = "shift_forward").dt.tz_convert("UTC")
+
+    day_of_year = utc.dt.dayofyear.to_numpy(dtype = float)
+    minutes = (utc.dt.hour * 60 + utc.dt.minute + utc.dt.second / 60).to_numpy(dtype = float)
+
+    # fractional year (radians)
+    gamma = 2 * np.pi / 365 * (day_of_year - 1 + (minutes / 60 - 12) / 24)
+
+    # equation of time (minutes) and declination (radians)
+    eqtime = 229.18 * (0.000075 + 0.001868 * np.cos(gamma) - 0.032077 * np.sin(gamma)
+                       - 0.014615 * np.cos(2 * gamma) - 0.040849 * np.sin(2 * gamma))
+
+    decl = (0.006918 - 0.399912 * np.cos(gamma) + 0.070257 * np.sin(gamma)
+            - 0.006758 * np.cos(2 * gamma) + 0.000907 * np.sin(2 * gamma)
+            - 0.002697 * np.cos(3 * gamma) + 0.00148 * np.sin(3 * gamma))
+
+    # true solar time (minutes) and hour angle (degrees)
+    true_solar_time = minutes + eqtime + 4 * np.asarray(lon, dtype = float)
+    hour_angle = np.mod(true_solar_time / 4, 360) - 180
+
+    lat = np.deg2rad(np.asarray(lat, dtype = float))
+
+    cos_zenith = np.sin(lat) * np.sin(decl) + np.cos(lat) * np.cos(decl) * np.cos(np.deg2rad(hour_angle))
+
+    elevation = 90 - np.rad2deg(np.arccos(np.clip(cos_zenith, -1, 1)))
+
+    return elevation, hour_angle < 0
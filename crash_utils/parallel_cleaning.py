@@ -0,0 +1,205 @@
+# the frame the worker processes read their blocks of rows from (see
+# _map_blocks())
+_shared_frame = None
+
+
+
+def parallel_clean_crashes(df, n_workers=None, n_blocks=None):
+
+    """basic_cleaning(fix_vehicle_names(df)) on n_workers processes
+    (default: one per CPU).
+
+    The rows are split into n_blocks blocks (default: two per worker)
+    and the work is done in map and reduce phases, as in
+    clean_crashes_chunked():
+    1.  map: the normalized vehicle names of columns 1 and 2 are
+        counted in every block
+        reduce: the counts are summed, giving the names with fewer than
+        5 / 3 incidents in the whole table (see fix_vehicle_names())
+    2.  map: every block has its vehicle names normalized and the rare
+        ones replaced by "other", goes through the row by row cleaning
+        of clean_crash_rows() (datetime parsing, coordinates, street
+        and borough names, person counts) and is filtered to the bike
+        crashes
+        reduce: the blocks are put back together in order, sorted by
+        datetime and de-duplicated
+
+    The result is the same as that of the serial functions.  df itself
+    is left as it is.
+
+    """
+
+    import pandas as pd
+    from crash_utils.fix_vehicle_names import rare_vehicle_names_from_counts
+    from crash_utils.instrumentation import profile_stage
+
+
+    with profile_stage("count vehicle names", df):
+        counts = _map_blocks(_vehicle_name_counts, df, n_workers, n_blocks)
+
+    counts_1 = pd.Series(dtype=float)
+    counts_2 = pd.Series(dtype=float)
+
+    for block_1, block_2 in counts:
+        counts_1 = counts_1.add(block_1, fill_value=0)
+        counts_2 = counts_2.add(block_2, fill_value=0)
+
+    strs_to_other = rare_vehicle_names_from_counts(counts_1, counts_2)
+
+
+    with profile_stage("clean blocks", df):
+        blocks = _map_blocks(_clean_block, df, n_workers, n_blocks, strs_to_other=strs_to_other)
+
+    df = pd.concat(blocks, ignore_index=True)
+    del blocks
+
+    df.sort_values(by="datetime", inplace=True, kind="stable", ignore_index=True)
+    df.drop_duplicates(inplace=True, ignore_index=True)
+
+
+    return df
+
+
+
+def parallel_crash_features(df, n_workers=None, n_blocks=None, drop_featured_columns=True,
+                            categorical=False, street_names=None):
+
+    """make_crash_features() on n_workers processes (default: one per
+    CPU), with the same arguments and result.
+
+    The only step of make_crash_features() that needs the whole table
+    is the count of crashes per on street name (streets with fewer than
+    10 become "other").  Those counts are taken first, over the
+    distinct names; the blocks of rows are then featured concurrently
+    with the streets to keep passed as street_names, and put back
+    together in order.  Unlike make_crash_features(), df itself is left
+    as it is.
+
+    """
+
+    import pandas as pd
+    from crash_utils.instrumentation import profile_stage
+
+
+    if street_names is None:
+        streets = df["on street name"].fillna("missing").value_counts()
+        streets = streets.groupby(streets.index.str.strip()).sum()
+        street_names = streets.index[streets.to_numpy() >= 10]
+
+
+    with profile_stage("feature blocks", df):
+        blocks = _map_blocks(_feature_block, df, n_workers, n_blocks,
+                             drop_featured_columns=drop_featured_columns, categorical=categorical,
+                             street_names=street_names)
+
+    return pd.concat(blocks)
+
+
+
+def _vehicle_name_counts(df):
+
+    """Counts of the normalized names in vehicle columns 1 and 2 of a
+    block.  Each distinct raw name is normalized once."""
+
+    from crash_utils.fix_vehicle_names import normalize_vehicle_name_values
+
+
+    counts = []
+
+    for col in ["vehicle type code 1", "vehicle type code 2"]:
+        raw = df[col].value_counts()
+        names = normalize_vehicle_name_values(raw.index.to_numpy())
+        counts.append(raw.groupby(names).sum())
+
+    return counts
+
+
+
+def _clean_block(df, strs_to_other):
+
+    """The row by row part of parallel_clean_crashes() for one block."""
+
+    from crash_utils.fix_vehicle_names import normalize_vehicle_names, vehicle_names_to_other
+    from crash_utils.basic_cleaning import clean_crash_rows, bike_crash_mask
+
+
+    df = normalize_vehicle_names(df)
+    df = vehicle_names_to_other(df, strs_to_other)
+
+    # as in basic_cleaning()
+    df.sort_index(axis=1, inplace=True)
+    df.drop(columns=["location", "off street name"], inplace=True, errors="ignore")
+
+    df = clean_crash_rows(df)
+
+    return df.loc[bike_crash_mask(df)]
+
+
+
+def _feature_block(df, **kwargs):
+
+    from crash_utils.make_crash_features import make_crash_features
+
+    return make_crash_features(df, **kwargs)
+
+
+
+def _map_blocks(func, df, n_workers=None, n_blocks=None, **kwargs):
+
+    """[func(block, **kwargs) for every block of rows of df], in order,
+    run on a pool of n_workers processes.
+
+    Where processes can be forked (Linux, macOS), the workers inherit
+    df and slice their blocks out of it, so the input is never pickled;
+    only the results are sent back.  Elsewhere the blocks are sent to
+    the workers.  With one worker everything is done in this process.
+
+    """
+
+    import os
+    import multiprocessing
+    import numpy as np
+    from concurrent.futures import ProcessPoolExecutor
+
+    global _shared_frame
+
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+
+    if n_blocks is None:
+        n_blocks = 2 * n_workers if n_workers > 1 else 1
+
+    n_blocks = max(1, min(n_blocks, len(df)))
+
+    bounds = np.linspace(0, len(df), n_blocks + 1).astype(int)
+    ranges = list(zip(bounds[:-1], bounds[1:]))
+
+
+    if n_workers == 1 or n_blocks == 1:
+        return [func(df.iloc[start:stop].copy(), **kwargs) for start, stop in ranges]
+
+
+    if "fork" in multiprocessing.get_all_start_methods():
+
+        _shared_frame = df
+
+        try:
+            with ProcessPoolExecutor(max_workers=n_workers,
+                                     mp_context=multiprocessing.get_context("fork")) as pool:
+                futures = [pool.submit(_apply_to_shared_block, func, start, stop, kwargs)
+                           for start, stop in ranges]
+                return [future.result() for future in futures]
+        finally:
+            _shared_frame = None
+
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = [pool.submit(func, df.iloc[start:stop].copy(), **kwargs) for start, stop in ranges]
+        return [future.result() for future in futures]
+
+
+
+def _apply_to_shared_block(func, start, stop, kwargs):
+
+    return func(_shared_frame.iloc[start:stop].copy(), **kwargs)
@@ -0,0 +1,112 @@
+# formats of "crash date": the API's floating timestamp, the csv
+# exported from the NYC Open Data portal, and plain ISO dates
+CRASH_DATE_FORMATS = ["%Y-%m-%dT%H:%M:%S.%f", "%m/%d/%Y", "%Y-%m-%d", "%Y-%m-%d %H:%M:%S"]
+
+
+
+def parse_crash_datetime(crash_date, crash_time):
+
+    """The datetime64[ns] of every crash from its "crash date" and
+    "crash time" columns, the same as
+
+    pd.to_datetime(crash_date + " " + crash_time)
+
+    without building the combined strings or parsing them one by one:
+    the date (see parse_crash_date()) and the time of day (see
+    parse_crash_time()) are each parsed once per distinct value, and
+    added as integer nanoseconds.  A crash missing either is NaT.
+    Returns a Series with the index of crash_date (if it has one).
+
+    """
+
+    import numpy as np
+    import pandas as pd
+
+
+    index = getattr(crash_date, "index", None)
+
+    date = parse_crash_date(crash_date).to_numpy().astype(np.int64)
+    time = parse_crash_time(crash_time)
+
+    missing = (date == np.iinfo(np.int64).min) | (time < 0)
+
+    values = date + time
+    values[missing] = np.iinfo(np.int64).min
+
+    return pd.Series(values.view("datetime64[ns]"), index=index)
+
+
+
+def parse_crash_date(values):
+
+    """The dates (datetime64[ns], at midnight) of an array or Series of
+    crash date strings in any of CRASH_DATE_FORMATS.  Values that are
+    already datetimes are only normalized.
+
+    There are only a few thousand distinct dates in millions of
+    crashes, so each distinct string is parsed once, with an explicit
+    format, and the results are broadcast back through the integer
+    codes of pd.factorize().  Strings in none of the formats are left
+    to pd.to_datetime() to make sense of, and raise if it can't.
+
+    """
+
+    import numpy as np
+    import pandas as pd
+
+
+    values = pd.Series(values)
+
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return values.astype("datetime64[ns]").dt.normalize()
+
+
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques, dtype=object).astype(str)
+
+    dates = pd.Series(pd.NaT, index=uniques.index, dtype="datetime64[ns]")
+
+    for date_format in CRASH_DATE_FORMATS:
+        todo = dates.isna()
+        if not todo.any():
+            break
+        dates[todo] = pd.to_datetime(uniques[todo], format=date_format, errors="coerce")
+
+    todo = dates.isna()
+    if todo.any():
+        dates[todo] = pd.to_datetime(uniques[todo], format="mixed")
+
+    dates = dates.dt.normalize().to_numpy(dtype="datetime64[ns]")
+
+    # missing values have code -1, which picks up the trailing NaT
+    dates = np.append(dates, np.datetime64("NaT", "ns"))
+
+    return pd.Series(dates[codes], index=values.index)
+
+
+
+def parse_crash_time(values):
+
+    """Time of day in integer nanoseconds of an array or Series of crash
+    time strings ("H:MM", "HH:MM" or "HH:MM:SS"), -1 where missing.
+    Each distinct string (there are at most 86400) is split once."""
+
+    import numpy as np
+    import pandas as pd
+
+
+    codes, uniques = pd.factorize(pd.Series(values))
+
+    seconds = np.empty(len(uniques) + 1, dtype=np.int64)
+    seconds[-1] = -1
+
+    for k, value in enumerate(uniques):
+
+        parts = str(value).strip().split(":")
+
+        if len(parts) not in (2, 3):
+            raise ValueError(f"crash time {value!r} is not H:MM or H:MM:SS")
+
+        seconds[k] = 3600 * int(parts[0]) + 60 * int(parts[1]) + (int(parts[2]) if len(parts) == 3 else 0)
+
+    return seconds[codes] * 10**9
@@ -0,0 +1,265 @@
+from functools import lru_cache
+
+
+class PipelineCache:
+
+    """On-disk cache of the outputs of the crash processing steps.
+
+    Entries are keyed by a hash of
+    1.  a fingerprint of the input data (see data_fingerprint())
+    2.  the name of the step and its keyword arguments (e.g.
+        include_fatalities, encode_streets)
+    3.  the source code of crash_utils and of the module defining the
+        step function
+    so a change to the raw data, to a parameter or to the code gives a
+    new key, and the stale entry is never read again.
+
+    Outputs are pickled with the highest protocol, which stores the
+    numpy buffers behind DataFrames and sparse matrices as raw bytes
+    and gives back exactly what was stored (dtypes, categoricals, index
+    and all).  Once the entries take more than max_bytes, the least
+    recently used ones are deleted.
+
+    cache = PipelineCache("data/cache")
+    df = cache.call(prepare_data_for_modelling, df, encode_streets=True)
+
+    or pass it to CrashPipeline(cache=cache), which then only runs the
+    stages after the last one found in the cache.
+
+    """
+
+    def __init__(self, cache_dir="data/cache", max_bytes=5e9, verbose=False):
+
+        import os
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.verbose = verbose
+
+
+    def key(self, fingerprint, name, func, kwargs):
+
+        """Key of the output of func(data, **kwargs), where data has the
+        given fingerprint."""
+
+        import hashlib
+
+
+        h = hashlib.sha256()
+        h.update(fingerprint.encode())
+        h.update(name.encode())
+        h.update(repr(sorted(kwargs.items())).encode())
+        h.update(_code_fingerprint(func).encode())
+
+        return h.hexdigest()
+
+
+    def __contains__(self, key):
+
+        import os
+
+        return os.path.exists(self._path(key))
+
+
+    def get(self, key):
+
+        """The output stored under key.  Raises KeyError if there is
+        none."""
+
+        import os
+        import pickle
+
+
+        path = self._path(key)
+
+        try:
+            with open(path, "rb") as infile:
+                value = pickle.load(infile)
+        except FileNotFoundError:
+            raise KeyError(key) from None
+
+        # mark as recently used
+        os.utime(path)
+
+        if self.verbose:
+            print(f"cache hit: {key[:12]}")
+
+        return value
+
+
+    def put(self, key, value):
+
+        import os
+        import pickle
+
+
+        path = self._path(key)
+
+        # write to a temporary file first, so an interrupted write never
+        # leaves a truncated entry behind
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as outfile:
+            pickle.dump(value, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        self.evict()
+
+
+    def call(self, func, data, name=None, **kwargs):
+
+        """func(data, **kwargs), read from the cache if it was computed
+        before."""
+
+        if name is None:
+            name = func.__name__
+
+        key = self.key(data_fingerprint(data), name, func, kwargs)
+
+        try:
+            return self.get(key)
+        except KeyError:
+            pass
+
+        value = func(data, **kwargs)
+        self.put(key, value)
+
+        return value
+
+
+    def evict(self):
+
+        """Delete the least recently used entries until the cache holds
+        at most max_bytes."""
+
+        import os
+
+
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+
+        for path, size, _ in sorted(entries, key=lambda entry: entry[2]):
+
+            if total <= self.max_bytes:
+                break
+
+            os.remove(path)
+            total -= size
+
+            if self.verbose:
+                print(f"cache evict: {os.path.basename(path)}")
+
+
+    def clear(self):
+
+        import os
+
+        for path, _, _ in self._entries():
+            os.remove(path)
+
+
+    def size(self):
+
+        """Bytes used by the cache."""
+
+        return sum(size for _, size, _ in self._entries())
+
+
+    def _path(self, key):
+
+        import os
+
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+
+    def _entries(self):
+
+        """(path, size, last used) of every entry."""
+
+        import os
+
+
+        entries = []
+
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".pkl"):
+                stat = entry.stat()
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+
+        return entries
+
+
+
+def data_fingerprint(data):
+
+    """A hash of the contents of data.
+
+    DataFrames and Series are hashed row by row with
+    pd.util.hash_pandas_object() plus their column names and dtypes;
+    a path to a file by its name, size and modification time (e.g. the
+    raw csv download); anything else by its pickled bytes.
+
+    """
+
+    import os
+    import pickle
+    import hashlib
+    import pandas as pd
+
+
+    h = hashlib.sha256()
+
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        h.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+        if isinstance(data, pd.DataFrame):
+            h.update(repr(list(data.columns)).encode())
+            h.update(repr([str(dtype) for dtype in data.dtypes]).encode())
+        else:
+            h.update(repr((data.name, str(data.dtype))).encode())
+    elif isinstance(data, (str, os.PathLike)) and os.path.exists(data):
+        stat = os.stat(data)
+        h.update(repr((os.path.abspath(data), stat.st_size, stat.st_mtime_ns)).encode())
+    else:
+        h.update(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+
+    return h.hexdigest()
+
+
+
+def _code_fingerprint(func):
+
+    """A hash of the source of the module defining func and of every
+    crash_utils module (the cleaning steps call each other)."""
+
+    import os
+    import glob
+    import inspect
+
+
+    files = set(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.py")))
+
+    module = inspect.getmodule(func)
+    if module is not None and getattr(module, "__file__", None):
+        files.add(os.path.abspath(module.__file__))
+
+    return _hash_files(tuple(sorted(files)),
+                       tuple(os.stat(path).st_mtime_ns for path in sorted(files)))
+
+
+
+@lru_cache(maxsize=None)
+def _hash_files(paths, mtimes):
+
+    # mtimes is only part of the arguments so the sources are read
+    # again when one of them changes
+    import hashlib
+
+
+    h = hashlib.sha256()
+
+    for path in paths:
+        with open(path, "rb") as infile:
+            h.update(infile.read())
+
+    return h.hexdigest()
@@ -1,4 +1,5 @@
-def prepare_data_for_modelling(df, include_fatalities = False, encode_streets = False):
+def prepare_data_for_modelling(df, include_fatalities = False, encode_streets = False,
+                               sparse = False):
 
     '''Prepare the collision data for modelling:
 
@@ -9,6 +10,14 @@ def prepare_data_for_modelling(df, include_fatalities = False, encode_streets =
     4. One-hot-encodes borough, zip-code, and on-street name
     5. Generates document-term matrix for vehicles and collision factors
 
+    By default the result is a DataFrame with the outcome as its first
+    column.  With sparse = True, (X, feature_names, y) is returned
+    instead: X is a scipy CSR matrix holding the same columns as the
+    DataFrame (minus the outcome), feature_names the array of their
+    names and y the outcome.  X is built by stacking the one-hot and
+    document-term matrices next to the other features once, so nothing
+    is ever densified and memory goes with the number of nonzeros.
+
     '''
 
     import pandas as pd
@@ -16,10 +25,18 @@ def prepare_data_for_modelling(df, include_fatalities = False, encode_streets =
     from sklearn.preprocessing import OneHotEncoder
     from sklearn.feature_extraction.text import CountVectorizer
     from crash_utils.make_crash_features import make_crash_features
+    from crash_utils.make_crash_features import crash_token_counts
+    from crash_utils.instrumentation import profile_stage
+
+
+    # the csv exported from the NYC Open Data portal has upper-case
+    # column names, the API lower-case ones (see
+    # retrieve_nyc_crashes_soda.py)
+    df.columns = df.columns.str.lower().str.replace("_", " ")
 
 
     # trim more columns that aren't useful for modelling
-    df.drop(columns=["LATITUDE","LONGITUDE","COLLISION_ID"],inplace = True)
+    df.drop(columns=["latitude","longitude","collision id"],inplace = True)
 
     # now encode the outcome: 0 = no injury, 1 = injury, 2 = fatality
     # (if include_fatalities = True)
@@ -28,15 +45,15 @@ def prepare_data_for_modelling(df, include_fatalities = False, encode_streets =
     df["outcome"] = np.nan
 
     # no injuries
-    mask = df["NUMBER OF CYCLIST INJURED"] == 0
+    mask = df["number of cyclist injured"] == 0
     df.loc[mask,"outcome"] = 0
 
     # injuries only
-    mask = df["NUMBER OF CYCLIST INJURED"] > 0
+    mask = df["number of cyclist injured"] > 0
     df.loc[mask,"outcome"] = 1
 
     # fatalities
-    mask = df["NUMBER OF CYCLIST KILLED"] > 0
+    mask = df["number of cyclist killed"] > 0
 
     if include_fatalities:
         df.loc[mask,"outcome"] = 2
@@ -44,21 +61,31 @@ def prepare_data_for_modelling(df, include_fatalities = False, encode_streets =
         df = df.loc[~mask]
 
 
-    df.drop(columns = ["NUMBER OF CYCLIST INJURED","NUMBER OF CYCLIST KILLED"],
+    df.drop(columns = ["number of cyclist injured","number of cyclist killed"],
             inplace = True)
 
 
     # finally, let's trim down the data to focus on predicting the
     # outcome of the cyclist
-    drop_cols = ["NUMBER OF PERSONS INJURED", "NUMBER OF PERSONS KILLED",
-                 "NUMBER OF PEDESTRIANS INJURED", "NUMBER OF PEDESTRIANS KILLED",
-                 "NUMBER OF MOTORIST INJURED", "NUMBER OF MOTORIST KILLED"]
+    drop_cols = ["number of persons injured", "number of persons killed",
+                 "number of pedestrians injured", "number of pedestrians killed",
+                 "number of motorist injured", "number of motorist killed"]
 
     df.drop(columns=drop_cols, inplace=True)
 
+
+    if sparse:
+        # the document-term matrices can be had straight from the
+        # vehicle type and contributing factor columns
+        with profile_stage("document-term matrices", df):
+            veh_matrix, veh_names = crash_token_counts(df, "vehicles")
+            factors_matrix, factors_names = crash_token_counts(df, "factors")
+
    
-    # compute features useful for modelling with custom function
-    df = make_crash_features(df)
+    # compute features useful for modelling with custom function.  the
+    # sparse matrix has the document-term matrices already, so it
+    # doesn't need the concatenated vehicles and factors
+    df = make_crash_features(df, categorical = sparse, token_columns = not sparse)
 
 
     # lowercase the column names
@@ -72,11 +99,19 @@ def prepare_data_for_modelling(df, include_fatalities = False, encode_streets =
     if encode_streets:
         cols_to_encode.append("on street name")
 
-    ohe = OneHotEncoder(drop = "first")
-    ohe.fit(df[cols_to_encode])
-    ohe_matrix = ohe.transform(df[cols_to_encode])
+    with profile_stage("one-hot encoding", df):
+        ohe = OneHotEncoder(drop = "first")
+        ohe.fit(df[cols_to_encode])
+        ohe_matrix = ohe.transform(df[cols_to_encode])
+
+
+    if sparse:
+        return _sparse_design_matrix(df, cols_to_encode, ohe_matrix, _feature_names(ohe),
+                                     veh_matrix, veh_names, factors_matrix, factors_names)
+
+
     ohe_df = pd.DataFrame.sparse.from_spmatrix(data = ohe_matrix,
-                                               columns = ohe.get_feature_names())
+                                               columns = _feature_names(ohe))
 
 
     # generate a document-term matrix for the vehicles and contributing factors
@@ -85,14 +120,16 @@ def prepare_data_for_modelling(df, include_fatalities = False, encode_streets =
     # 1. Instantiate
     bagofwords = CountVectorizer(token_pattern=r"(?u)\S\S+")
 
-    # 2. Fit
-    bagofwords.fit(df["vehicles"])
+    with profile_stage("vehicle document-term matrix", df):
+
+        # 2. Fit
+        bagofwords.fit(df["vehicles"])
 
-    # 3. Transform
-    veh_transformed = bagofwords.transform(df["vehicles"])
+        # 3. Transform
+        veh_transformed = bagofwords.transform(df["vehicles"])
 
     veh_df = pd.DataFrame.sparse.from_spmatrix(data = veh_transformed,
-                                               columns = bagofwords.get_feature_names())
+                                               columns = _feature_names(bagofwords))
 
 
     # crash factors
@@ -100,15 +137,17 @@ def prepare_data_for_modelling(df, include_fatalities = False, encode_streets =
     # 1. Instantiate
     bagofwords = CountVectorizer(token_pattern=r"(?u)\S\S+")
 
-    # 2. Fit
-    bagofwords.fit(df["factors"])
+    with profile_stage("factor document-term matrix", df):
 
-    # 3. Transform
-    factors_transformed = bagofwords.transform(df["factors"])
+        # 2. Fit
+        bagofwords.fit(df["factors"])
+
+        # 3. Transform
+        factors_transformed = bagofwords.transform(df["factors"])
 
 
     factors_df = pd.DataFrame.sparse.from_spmatrix(data = factors_transformed,
-                                                   columns = bagofwords.get_feature_names())
+                                                   columns = _feature_names(bagofwords))
 
 
 
@@ -121,7 +160,9 @@ def prepare_data_for_modelling(df, include_fatalities = False, encode_streets =
     factors_df.reset_index(drop = True, inplace=True)
 
 
-    df = pd.concat((df,ohe_df,veh_df, factors_df),axis=1)
+    with profile_stage("concatenate features", df) as stage:
+        df = pd.concat((df,ohe_df,veh_df, factors_df),axis=1)
+        stage.rows_out = len(df)
     del ohe_df, veh_df, factors_df
 
     # drop all columns that we encoded or count-vectorized
@@ -136,3 +177,43 @@ def prepare_data_for_modelling(df, include_fatalities = False, encode_streets =
 
 
     return df
+
+
+
+def _sparse_design_matrix(df, encoded_cols, ohe_matrix, ohe_names,
+                          veh_matrix, veh_names, factors_matrix, factors_names):
+
+    """Stack the remaining columns of df and the one-hot and
+    document-term matrices into a single CSR matrix, in the column order
+    of the DataFrame prepare_data_for_modelling() returns."""
+
+    import numpy as np
+    import scipy.sparse as sp
+
+
+    y = df["outcome"].to_numpy()
+
+    df = df.drop(columns = ["outcome"] + encoded_cols)
+    df = df.drop(columns = ["on street name"], errors = "ignore")
+
+    dense_matrix = sp.csr_matrix(df.to_numpy(dtype = float))
+
+    X = sp.hstack((dense_matrix, ohe_matrix, veh_matrix, factors_matrix), format = "csr")
+
+    feature_names = np.concatenate((df.columns.to_numpy(dtype = object),
+                                    np.asarray(ohe_names, dtype = object),
+                                    np.asarray(veh_names, dtype = object),
+                                    np.asarray(factors_names, dtype = object)))
+
+    return X, feature_names, y
+
+
+
+def _feature_names(estimator):
+
+    # get_feature_names() was replaced by get_feature_names_out() in
+    # scikit-learn 1.0 and removed in 1.2
+    if hasattr(estimator, "get_feature_names_out"):
+        return estimator.get_feature_names_out()
+
+    return estimator.get_feature_names()
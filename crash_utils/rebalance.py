@@ -0,0 +1,122 @@
+def balanced_sample_weights(y):
+
+    """Per-sample weights that make every class count the same in
+    total, as if the smaller classes had been upsampled to the size of
+    the largest one.
+
+    The notebooks balance the training set by resampling the minority
+    class and stacking it onto the majority rows (a dense copy larger
+    than X_train).  Passing these weights as fit(X, y, sample_weight =
+    ...) gives the same balance without touching X, dense or sparse:
+    the rows of the largest class get weight 1, those of a class with a
+    third as many rows get weight 3, and so on.
+
+    """
+
+    import numpy as np
+
+
+    y = np.asarray(y)
+
+    _, codes, counts = np.unique(y, return_inverse=True, return_counts=True)
+
+    return (counts.max() / counts)[codes]
+
+
+
+def upsample_indices(y, n_samples=None, random_state=None):
+
+    """Row indices that balance the classes of y, for estimators
+    without sample_weight.
+
+    Every row of the largest class is kept once; the rows of each
+    other class are drawn with replacement until the class has
+    n_samples rows (by default, as many as the largest class), as
+    sklearn.utils.resample does in the notebooks.  Only the index array
+    is built: X[ind], y[ind] select the rows (a copy only when the
+    estimator needs one), and for CSR matrices only the nonzeros are
+    copied.
+
+    """
+
+    import numpy as np
+
+
+    y = np.asarray(y)
+    rng = np.random.default_rng(random_state)
+
+    classes, counts = np.unique(y, return_counts=True)
+
+    if n_samples is None:
+        n_samples = counts.max()
+
+    ind = []
+
+    for c, count in zip(classes, counts):
+
+        rows = np.flatnonzero(y == c)
+
+        if count < n_samples:
+            rows = np.concatenate((rows, rng.choice(rows, size=n_samples - count, replace=True)))
+
+        ind.append(rows)
+
+    ind = np.concatenate(ind)
+    rng.shuffle(ind)
+
+    return ind
+
+
+
+def stratified_batches(X, y, batch_size, sample_weight=None, indices=None,
+                       shuffle=True, random_state=None):
+
+    """Iterate over (X_batch, y_batch[, weight_batch]) blocks of about
+    batch_size rows, each with the class proportions of the whole set,
+    e.g. for estimators with partial_fit().
+
+    indices selects (and may repeat) the rows to use, e.g. from
+    upsample_indices(); by default every row is used once.  Rows are
+    picked by index, so X can be a numpy array or any scipy sparse
+    matrix that supports row indexing (CSR), and only one batch is ever
+    copied.
+
+    """
+
+    import numpy as np
+
+
+    y = np.asarray(y)
+    rng = np.random.default_rng(random_state)
+
+    if indices is None:
+        indices = np.arange(len(y))
+
+    indices = np.asarray(indices)
+
+    n_batches = max(1, int(np.ceil(len(indices) / batch_size)))
+
+
+    # split the rows of every class evenly over the batches
+    parts = [[] for _ in range(n_batches)]
+
+    for c in np.unique(y[indices]):
+
+        rows = indices[y[indices] == c]
+        if shuffle:
+            rows = rng.permutation(rows)
+
+        for k, block in enumerate(np.array_split(rows, n_batches)):
+            parts[k].append(block)
+
+
+    for part in parts:
+
+        batch = np.concatenate(part)
+        if shuffle:
+            rng.shuffle(batch)
+
+        if sample_weight is None:
+            yield X[batch], y[batch]
+        else:
+            yield X[batch], y[batch], np.asarray(sample_weight)[batch]
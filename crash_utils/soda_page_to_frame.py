@@ -0,0 +1,95 @@
+from functools import lru_cache
+
+
+# all columns of the crash table, with the names used in the csv
+# files.  the API leaves null fields out of the JSON records, so a page
+# of results may not contain all of them.
+CRASH_COLUMNS = ["crash date", "crash time", "borough", "zip code",
+                 "latitude", "longitude", "location",
+                 "on street name", "cross street name", "off street name",
+                 "number of persons injured", "number of persons killed",
+                 "number of pedestrians injured", "number of pedestrians killed",
+                 "number of cyclist injured", "number of cyclist killed",
+                 "number of motorist injured", "number of motorist killed",
+                 "contributing factor vehicle 1", "contributing factor vehicle 2",
+                 "contributing factor vehicle 3", "contributing factor vehicle 4",
+                 "contributing factor vehicle 5",
+                 "collision id",
+                 "vehicle type code 1", "vehicle type code 2",
+                 "vehicle type code 3", "vehicle type code 4",
+                 "vehicle type code 5"]
+
+
+# the API returns every value as a string.  these columns are
+# converted to numbers, everything else is kept as strings.
+FLOAT_COLUMNS = ["latitude", "longitude"]
+
+INTEGER_COLUMNS = ["number of persons injured", "number of persons killed",
+                   "number of pedestrians injured", "number of pedestrians killed",
+                   "number of cyclist injured", "number of cyclist killed",
+                   "number of motorist injured", "number of motorist killed",
+                   "collision id"]
+
+
+
+def soda_page_to_frame(records, columns=None):
+
+    """Convert one page of SODA JSON records (a list of dictionaries)
+    into a DataFrame with one typed column per entry of columns.
+
+    Each column is pulled out of the records straight into its own
+    buffer, so the only copy of the data besides the page itself is the
+    final, typed one.  Coordinates become floats and the person counts
+    and collision id become nullable integers.  Fields missing from a
+    record are filled with nulls.
+
+    columns defaults to CRASH_COLUMNS.  The csv-style column names are
+    translated to the API's field names (e.g. "vehicle type code 1" ->
+    "vehicle_type_code1") once per set of columns, not once per page.
+
+    """
+
+    import numpy as np
+    import pandas as pd
+
+
+    if columns is None:
+        columns = CRASH_COLUMNS
+
+    keys = _soda_field_names(tuple(columns))
+
+    data = {}
+
+    for col, key in zip(columns, keys):
+
+        values = [record.get(key) for record in records]
+
+        if col in FLOAT_COLUMNS:
+            data[col] = np.array(values, dtype=float)
+        elif col in INTEGER_COLUMNS:
+            data[col] = pd.array(np.array(values, dtype=float), dtype="Int64")
+        else:
+            data[col] = np.array(values, dtype=object)
+
+    return pd.DataFrame(data, columns=columns)
+
+
+
+@lru_cache(maxsize=None)
+def _soda_field_names(columns):
+
+    """API field names of the csv-style column names."""
+
+    return [_soda_field_name(col) for col in columns]
+
+
+
+def _soda_field_name(column):
+
+    # sodapy goofs up a few column names
+    goofs = {"vehicle_type_code_1": "vehicle_type_code1",
+             "vehicle_type_code_2": "vehicle_type_code2"}
+
+    key = column.replace(" ", "_")
+
+    return goofs.get(key, key)
@@ -0,0 +1,143 @@
+from sklearn.base import BaseEstimator, TransformerMixin
+
+
+class SparseReducer(BaseEstimator, TransformerMixin):
+
+    """Reduces the sparse design matrix of prepare_data_for_modelling(
+    sparse = True) to n_components columns without densifying it.
+
+    The best model found in the notebooks runs PCA(n_components = 20)
+    before the random forest, which needs the whole training matrix as
+    a dense array.  method picks the replacement:
+
+    "svd"         TruncatedSVD (randomized) straight on the sparse
+                  matrix; memory goes with the number of nonzeros.
+    "incremental" IncrementalPCA fit batch_size rows at a time, each
+                  batch densified on its own.  This centers the data
+                  like PCA does, so it gives the same components, but
+                  only one batch is ever dense.  Batches can also be
+                  passed to partial_fit() as they are read.
+    "hashing"     feature hashing of the columns: every column is
+                  added, with a random sign, to one of n_components
+                  outputs picked by hashing its name (feature_names, or
+                  the column number).  Nothing is learned, so fit() is
+                  free and the output stays sparse.
+
+    """
+
+    def __init__(self, method = "svd", n_components = 20, batch_size = 10000,
+                 feature_names = None, random_state = 0):
+
+        self.method = method
+        self.n_components = n_components
+        self.batch_size = batch_size
+        self.feature_names = feature_names
+        self.random_state = random_state
+
+
+    def fit(self, X, y = None):
+
+        import scipy.sparse as sp
+        from sklearn.decomposition import TruncatedSVD
+
+
+        if self.method == "svd":
+            self.reducer_ = TruncatedSVD(n_components = self.n_components,
+                                         algorithm = "randomized",
+                                         random_state = self.random_state)
+            self.reducer_.fit(sp.csr_matrix(X))
+
+        elif self.method == "incremental":
+            self.reducer_ = None
+
+            # IncrementalPCA needs at least n_components rows per batch,
+            # so a short last batch is merged into the one before
+            starts = list(range(0, X.shape[0], self.batch_size)) + [X.shape[0]]
+            if len(starts) > 2 and starts[-1] - starts[-2] < self.n_components:
+                del starts[-2]
+
+            for start, stop in zip(starts[:-1], starts[1:]):
+                self.partial_fit(X[start:stop])
+
+        elif self.method == "hashing":
+            self.reducer_ = None
+            self.projection_ = _hashing_projection(X.shape[1], self.n_components,
+                                                   self.feature_names)
+
+        else:
+            raise ValueError(f'method must be "svd", "incremental" or "hashing", not "{self.method}"')
+
+
+        return self
+
+
+    def partial_fit(self, X, y = None):
+
+        """Update an "incremental" reducer with one batch of rows."""
+
+        import scipy.sparse as sp
+        from sklearn.decomposition import IncrementalPCA
+
+
+        if self.method != "incremental":
+            raise ValueError('partial_fit() is only available with method = "incremental"')
+
+        if getattr(self, "reducer_", None) is None:
+            self.reducer_ = IncrementalPCA(n_components = self.n_components)
+
+        if sp.issparse(X):
+            X = X.toarray()
+
+        self.reducer_.partial_fit(X)
+
+
+        return self
+
+
+    def transform(self, X):
+
+        import numpy as np
+        import scipy.sparse as sp
+
+
+        if self.method == "hashing":
+            return sp.csr_matrix(X) @ self.projection_
+
+        if self.method == "svd":
+            return self.reducer_.transform(X)
+
+
+        # incremental: densify one batch at a time here too
+        out = np.empty((X.shape[0], self.n_components))
+
+        for start in range(0, X.shape[0], self.batch_size):
+            batch = X[start:start + self.batch_size]
+            if sp.issparse(batch):
+                batch = batch.toarray()
+            out[start:start + self.batch_size] = self.reducer_.transform(batch)
+
+        return out
+
+
+
+def _hashing_projection(n_features, n_components, feature_names = None):
+
+    """(n_features x n_components) sparse matrix with a single +1 or -1
+    per row, in the column picked by hashing the feature's name."""
+
+    import zlib
+    import numpy as np
+    import scipy.sparse as sp
+
+
+    if feature_names is None:
+        feature_names = [str(k) for k in range(n_features)]
+
+    # a stable hash, unlike hash(), which changes with every interpreter
+    hashes = np.array([zlib.crc32(str(name).encode()) for name in feature_names], dtype = np.int64)
+
+    column = hashes % n_components
+    sign = np.where((hashes // n_components) % 2 == 0, 1.0, -1.0)
+
+    return sp.csr_matrix((sign, (np.arange(n_features), column)),
+                         shape = (n_features, n_components))
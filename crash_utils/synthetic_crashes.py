@@ -0,0 +1,175 @@
+def synthetic_crashes(n_rows, seed=0, bike_share=0.5, start="2012-07-01", end="2021-01-01"):
+
+    """A made-up crash table of n_rows crashes, shaped like the data
+    retrieve_nyc_crashes_soda.py downloads (the columns of
+    CRASH_COLUMNS, with the same string formats), for benchmarks and
+    trying out the crash_utils functions at any scale.
+
+    It has the quirks the cleaning functions deal with:
+    1.  vehicle types drawn from the raw spellings in vehicle_name_map()
+        plus a few unmapped and rare ones, in mixed case and with stray
+        white space
+    2.  crash locations scattered around NYC zip code centroids (from
+        data/NY-zip-code-latitude-and-longitude.csv); about 30% of the
+        crashes are missing their zip code and borough, 4% their
+        coordinates and 1% have zeroed coordinates
+    3.  a few NaN person counts, and the "Illnes" misspelling among
+        the contributing factors
+    4.  about bike_share of the crashes involve a bike (by vehicle type
+        or cyclist injury), the rest are crashes the cleaning filters
+        out
+
+    The same seed always gives the same table.
+
+    """
+
+    import numpy as np
+    import pandas as pd
+    from crash_utils.fix_vehicle_names import vehicle_name_map
+    from crash_utils.zip_code_and_borough_from_coords import NYC_BOUNDS
+
+
+    rng = np.random.default_rng(seed)
+
+
+    # dates and times
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    days = rng.integers(0, (end - start).days, n_rows)
+    crash_date = (start + pd.to_timedelta(np.unique(days), unit="D")).strftime("%Y-%m-%dT%H:%M:%S.000")
+    crash_date = crash_date.to_numpy(dtype=object)[np.searchsorted(np.unique(days), days)]
+
+    # more crashes in the afternoon than at night
+    hour_p = np.array([2, 1, 1, 1, 1, 2, 3, 5, 7, 6, 6, 6, 7, 7, 8, 9, 9, 9, 8, 7, 5, 4, 3, 2], dtype=float)
+    hour = rng.choice(24, n_rows, p=hour_p / hour_p.sum())
+    minute = rng.integers(0, 60, n_rows)
+    times = np.array([f"{h}:{m:02d}" for h in range(24) for m in range(60)], dtype=object)
+    crash_time = times[hour * 60 + minute]
+
+
+    # locations: near the centroid of a NYC zip code
+    ny = pd.read_csv("data/NY-zip-code-latitude-and-longitude.csv", delimiter=";", usecols=[0, 1, 3, 4])
+    minlat, maxlat, minlon, maxlon = NYC_BOUNDS
+    ny = ny[ny["Latitude"].between(minlat, maxlat) & ny["Longitude"].between(minlon, maxlon)]
+
+    city_to_borough = {"New York": "MANHATTAN", "Brooklyn": "BROOKLYN", "Bronx": "BRONX",
+                       "Staten Island": "STATEN ISLAND"}
+    borough_names = np.array([city_to_borough.get(city, "QUEENS") for city in ny["City"]], dtype=object)
+
+    k = rng.integers(0, len(ny), n_rows)
+    latitude = ny["Latitude"].to_numpy()[k] + rng.normal(0, 0.004, n_rows)
+    longitude = ny["Longitude"].to_numpy()[k] + rng.normal(0, 0.005, n_rows)
+    zip_code = ny["Zip"].to_numpy(dtype=float)[k]
+    borough = borough_names[k]
+
+    missing_zip = rng.random(n_rows) < 0.3
+    zip_code[missing_zip] = np.nan
+    borough[missing_zip] = None
+
+    missing_coords = rng.random(n_rows) < 0.04
+    latitude[missing_coords] = np.nan
+    longitude[missing_coords] = np.nan
+
+    zeroed = rng.random(n_rows) < 0.01
+    latitude[zeroed] = 0.0
+    longitude[zeroed] = 0.0
+
+    location = np.where(np.isnan(latitude), None,
+                        np.char.add(np.char.add("(", latitude.round(6).astype(str)),
+                                    np.char.add(", ", np.char.add(longitude.round(6).astype(str), ")"))))
+
+
+    # streets.  a few busy streets, many quiet ones
+    streets = ["BROADWAY", "5 AVENUE", "ATLANTIC AVENUE", "BEDFORD AVENUE", "OCEAN PARKWAY",
+               "GRAND CONCOURSE", "QUEENS BOULEVARD", "FLATBUSH AVENUE", "2 AVENUE", "1 AVENUE"]
+    streets += [f"{k} STREET" for k in range(1, 230)] + [f"EAST {k} STREET" for k in range(1, 100)]
+    streets = np.array(streets, dtype=object)
+
+    street_p = 1 / np.arange(1, len(streets) + 1) ** 0.8
+    street_p /= street_p.sum()
+
+    on_street = streets[rng.choice(len(streets), n_rows, p=street_p)]
+    cross_street = streets[rng.choice(len(streets), n_rows, p=street_p)]
+    off_street = np.full(n_rows, None, dtype=object)
+
+    no_streets = rng.random(n_rows) < 0.2
+    on_street[no_streets] = None
+    cross_street[no_streets | (rng.random(n_rows) < 0.15)] = None
+    off_street[no_streets] = [f"{k} {s}" for k, s in zip(rng.integers(1, 999, no_streets.sum()),
+                                                       streets[rng.integers(0, len(streets), no_streets.sum())])]
+
+
+    # vehicles: the raw spellings of vehicle_name_map(), in mixed case
+    raw = [name for name in vehicle_name_map() if name not in ["bicycle", "bike"]]
+    raw += ["taxi", "bus", "van", "tractor", "e-bike", "motorcycle"]
+    raw += [f"unknown vehicle {k}" for k in range(40)]   # rare names, become "other"
+    raw = np.array(raw + [name.upper() for name in raw] + [f" {name.title()} " for name in raw], dtype=object)
+
+    bikes = np.array(["Bike", "BICYCLE", "Bicycle", "bike", " Bike "], dtype=object)
+
+    n_vehicles = rng.choice([1, 2, 3, 4, 5], n_rows, p=[0.25, 0.62, 0.09, 0.03, 0.01])
+    is_bike_crash = rng.random(n_rows) < bike_share
+    bike_slot = rng.integers(0, 2, n_rows)
+
+    vehicles = {}
+    for v in range(5):
+        names = raw[rng.integers(0, len(raw), n_rows)]
+        names[(v == bike_slot) & is_bike_crash] = bikes[rng.integers(0, len(bikes), n_rows)][(v == bike_slot) & is_bike_crash]
+        names[v >= n_vehicles] = None
+        vehicles[f"vehicle type code {v + 1}"] = names
+
+
+    # contributing factors, one per vehicle
+    factors = np.array(["Unspecified", "Driver Inattention/Distraction", "Failure to Yield Right-of-Way",
+                        "Passing or Lane Usage Improper", "Passing Too Closely", "Following Too Closely",
+                        "Unsafe Speed", "Traffic Control Disregarded", "Pedestrian/Bicyclist/Other Pedestrian Error/Confusion",
+                        "Driver Inexperience", "Backing Unsafely", "Turning Improperly", "Alcohol Involvement",
+                        "View Obstructed/Limited", "Pavement Slippery", "Illnes", "Illness"], dtype=object)
+    factor_p = 1 / np.arange(1, len(factors) + 1)
+    factor_p /= factor_p.sum()
+
+    contributing = {}
+    for v in range(5):
+        names = factors[rng.choice(len(factors), n_rows, p=factor_p)]
+        names[v >= n_vehicles] = None
+        contributing[f"contributing factor vehicle {v + 1}"] = names
+
+
+    # people hurt
+    cyclist_injured = (rng.random(n_rows) < 0.75 * is_bike_crash).astype(float)
+    cyclist_killed = (rng.random(n_rows) < 0.003 * is_bike_crash).astype(float)
+    cyclist_injured[cyclist_killed > 0] = 0
+    pedestrians_injured = rng.poisson(0.1, n_rows).astype(float)
+    pedestrians_killed = (rng.random(n_rows) < 0.001).astype(float)
+    motorist_injured = rng.poisson(0.3, n_rows).astype(float)
+    motorist_killed = (rng.random(n_rows) < 0.001).astype(float)
+
+    persons_injured = cyclist_injured + pedestrians_injured + motorist_injured
+    persons_killed = cyclist_killed + pedestrians_killed + motorist_killed
+    persons_injured[rng.random(n_rows) < 0.0005] = np.nan
+    persons_killed[rng.random(n_rows) < 0.0005] = np.nan
+
+
+    data = {"crash date": crash_date,
+            "crash time": crash_time,
+            "borough": borough,
+            "zip code": zip_code,
+            "latitude": latitude,
+            "longitude": longitude,
+            "location": location,
+            "on street name": on_street,
+            "cross street name": cross_street,
+            "off street name": off_street,
+            "number of persons injured": persons_injured,
+            "number of persons killed": persons_killed,
+            "number of pedestrians injured": pedestrians_injured,
+            "number of pedestrians killed": pedestrians_killed,
+            "number of cyclist injured": cyclist_injured,
+            "number of cyclist killed": cyclist_killed,
+            "number of motorist injured": motorist_injured,
+            "number of motorist killed": motorist_killed}
+    data.update(contributing)
+    data["collision id"] = np.arange(3000000, 3000000 + n_rows)
+    data.update(vehicles)
+
+
+    return pd.DataFrame(data)
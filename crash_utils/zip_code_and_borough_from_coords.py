@@ -1,4 +1,10 @@
-def zip_code_and_borough_from_coords(df):
+# extent of the five boroughs: (min latitude, max latitude, min
+# longitude, max longitude)
+NYC_BOUNDS = (40.4774, 40.9176, -74.2591, -73.7004)
+
+
+
+def zip_code_and_borough_from_coords(df, max_distance_km = None, bounds = None):
 
     """A fairly large number of postal codes and boroughs are missing from the crash
     data.
@@ -11,11 +17,24 @@ def zip_code_and_borough_from_coords(df):
     borough.  It is possible for such cases to occur when the crash is
     missing coordinates.
 
+    The nearest zip code is found with a KD-tree built over the zip
+    code centroids (projected to kilometres), queried once for all of
+    the crashes that are missing a zip code.  If max_distance_km is
+    given, crashes further than that from every zip code centroid are
+    left unfilled (and are therefore removed).
+
+    Only the zip codes inside the region covered by the crashes are
+    considered.  For a small batch of crashes that region can be a
+    single point, so pass bounds (e.g. NYC_BOUNDS) to use a fixed
+    region instead.
+
     """
 
     ## imports
     import pandas as pd
     import numpy as np
+    from scipy.spatial import cKDTree
+    from crash_utils.instrumentation import profile_stage
 
     data_path = "data/"
 
@@ -37,8 +56,11 @@ def zip_code_and_borough_from_coords(df):
 
     # the NY state file contains zip codes for all of NY state.  subset to
     # the region we need:
-    minlat, maxlat = np.min(df["latitude"]), np.max(df["latitude"])
-    minlon, maxlon = np.min(df["longitude"]), np.max(df["longitude"])
+    if bounds is None:
+        minlat, maxlat = np.min(df["latitude"]), np.max(df["latitude"])
+        minlon, maxlon = np.min(df["longitude"]), np.max(df["longitude"])
+    else:
+        minlat, maxlat, minlon, maxlon = bounds
 
 
     latlonmask = (ny["Longitude"] >= minlon) & (ny["Longitude"] <= maxlon)
@@ -50,40 +72,49 @@ def zip_code_and_borough_from_coords(df):
 
     # get indices of crashes missing a zip code
     missing_mask = df["zip code"].isnull().to_numpy()
-    missing_ind = np.nonzero(missing_mask)[0]
 
 
-    # run through all of the instances of a missing zip code in crash data
-    # frame find the distance between all of the NY zip code coordinates
-    # and the crash coordinates find the nearest zip code to the crash
-    # fill the missing zip code in the crash data frame with the nearest
-    # zip code
+    # find the nearest NY zip code centroid to every crash that is
+    # missing a zip code.  rather than computing the distance to every
+    # zip code for every crash, build a KD-tree over the zip code
+    # centroids once and query it with all of the missing crashes in a
+    # single batched call.
     #
     # in every case but one, a crash with a missing zip code is also
     # missing a borough so use the "city" column of the NY zip code data
     # as the borough.
 
-    borough_col = np.argwhere(df.columns == "borough")[0]
-    zip_col = np.argwhere(df.columns == "zip code")[0]
+    # crashes without coordinates can't be located, so leave them be
+    has_coords = df["latitude"].notna().to_numpy() & df["longitude"].notna().to_numpy()
+    query_ind = np.nonzero(missing_mask & has_coords)[0]
+
+    if len(query_ind) > 0 and len(ny) > 0:
+
+        with profile_stage("nearest zip code query") as stage:
 
-    for k in missing_ind:
+            tree = cKDTree(_project_coords(ny["Latitude"], ny["Longitude"]))
 
-        dist = (df.iloc[k]["longitude"] - ny["Longitude"])**2 + \
-               (df.iloc[k]["latitude"] - ny["Latitude"])**2
-        dist = dist.to_numpy()
+            crash_xy = _project_coords(df["latitude"].to_numpy()[query_ind],
+                                       df["longitude"].to_numpy()[query_ind])
 
-        nearest_ind = np.argmin(dist)
-        nearest_zip = ny.iloc[nearest_ind]["Zip"]
-        nearest_borough = ny.iloc[nearest_ind]["City"]
+            # crashes further than max_distance_km from every zip code
+            # centroid come back with an infinite distance
+            if max_distance_km is None:
+                dist, nearest_ind = tree.query(crash_xy)
+            else:
+                dist, nearest_ind = tree.query(crash_xy, distance_upper_bound=max_distance_km)
 
-        dist = dist[nearest_ind]
+            stage.rows_in = stage.rows_out = len(query_ind)
 
-        if np.isfinite(dist):
-            df.iloc[k,zip_col] = nearest_zip
-            df.iloc[k,borough_col] = nearest_borough
+        found = np.isfinite(dist)
+        fill_ind = query_ind[found]
+        nearest_ind = nearest_ind[found]
 
-            #print(f"k = {k}, min. distance = {dist}, nearest index = {nearest_ind}, nearest zip = {nearest_zip}")
+        zip_col = df.columns.get_loc("zip code")
+        borough_col = df.columns.get_loc("borough")
 
+        df.iloc[fill_ind, zip_col] = ny["Zip"].to_numpy()[nearest_ind]
+        df.iloc[fill_ind, borough_col] = ny["City"].to_numpy()[nearest_ind]
 
 
 
@@ -122,3 +153,39 @@ def zip_code_and_borough_from_coords(df):
     df.loc[mask,"borough"] = "QUEENS"
 
     return df
+
+
+
+def _project_coords(lat, lon):
+    """Project lat/lon (degrees) onto a local flat plane in kilometres.
+
+    An equirectangular projection about New York's latitude is plenty
+    accurate over the extent of the city, and lets the KD-tree use
+    plain euclidean distances.
+    """
+
+    import numpy as np
+
+    earth_radius_km = 6371.0
+    cos_lat0 = np.cos(np.deg2rad(40.7))
+
+    x = earth_radius_km * np.deg2rad(np.asarray(lon, dtype=float)) * cos_lat0
+    y = earth_radius_km * np.deg2rad(np.asarray(lat, dtype=float))
+
+    return np.column_stack((x, y))
+
+
+
+def _unproject_coords(x, y):
+    """Inverse of _project_coords(): kilometres back to lat/lon
+    (degrees)."""
+
+    import numpy as np
+
+    earth_radius_km = 6371.0
+    cos_lat0 = np.cos(np.deg2rad(40.7))
+
+    lon = np.rad2deg(np.asarray(x, dtype=float) / (earth_radius_km * cos_lat0))
+    lat = np.rad2deg(np.asarray(y, dtype=float) / earth_radius_km)
+
+    return lat, lon
@@ -1,15 +1,37 @@
 #!/usr/bin/env python3
-def retrieve_nyc_crashes_soda(token=None, query=None, output_file=None):
+
+# Socrata domain and dataset identifier of the NYPD Motor Vehicle
+# Collisions - Crashes table
+SODA_DOMAIN = "data.cityofnewyork.us"
+CRASH_DATASET_ID = "h9gi-nx95"
+
+
+# SoQL filter retrieving records containing bike crashes
+BIKE_CRASH_WHERE = """
+                   VEHICLE_TYPE_CODE1 = 'Bike' OR VEHICLE_TYPE_CODE1 = 'BICYCLE'
+                   OR
+                   VEHICLE_TYPE_CODE2 = 'Bike' OR VEHICLE_TYPE_CODE2 = 'BICYCLE'
+                   OR
+                   VEHICLE_TYPE_CODE_3 = 'Bike' OR VEHICLE_TYPE_CODE_3 = 'BICYCLE'
+                   OR
+                   VEHICLE_TYPE_CODE_4 = 'Bike' OR VEHICLE_TYPE_CODE_4 = 'BICYCLE'
+                   OR
+                   VEHICLE_TYPE_CODE_5 = 'Bike' OR VEHICLE_TYPE_CODE_5 = 'BICYCLE'
+                   OR
+                   NUMBER_OF_CYCLIST_INJURED > 0 OR NUMBER_OF_CYCLIST_KILLED > 0
+                   """
+
+
+def retrieve_nyc_crashes_soda(token=None, query=None, output_file=None,
+                              page_size=50000, return_df=True, output_format="csv"):
 
     """Retrieve NYC motor vehicle crash data from NYC Open Data using the
     sodapy, the python client for the Socrata Open Data API.  Returns
     data in a pandas dataframe.
 
-    The default SoSQL query (https://dev.socrata.com/docs/queries/)
-    is:
+    By default, crashes involving bicycles are retrieved, i.e. those
+    matching the SoSQL (https://dev.socrata.com/docs/queries/) filter:
 
-    select *
-    where
     VEHICLE_TYPE_CODE1 = 'Bike' OR VEHICLE_TYPE_CODE1 = 'BICYCLE'
     OR
     VEHICLE_TYPE_CODE2 = 'Bike' OR VEHICLE_TYPE_CODE2 = 'BICYCLE'
@@ -21,73 +43,339 @@ def retrieve_nyc_crashes_soda(token=None, query=None, output_file=None):
     VEHICLE_TYPE_CODE_5 = 'Bike' OR VEHICLE_TYPE_CODE_5 = 'BICYCLE'
     OR
     NUMBER_OF_CYCLIST_INJURED > 0 OR NUMBER_OF_CYCLIST_KILLED > 0
-    limit 1000000
 
-    Note we have to specify a very high limit because the query
-    defaults to 1000 records.
+    The records are downloaded page_size at a time.  Each page is
+    converted straight into typed columns (see
+    crash_utils/soda_page_to_frame.py) and written out before the next
+    one is requested, so with return_df = False the memory used is set
+    by the page size, not by the size of the data set.  The pages are
+    written to a new file next to output_file, which replaces it once
+    the download is complete, so an earlier download is kept if this
+    one fails.
+
+    With output_format = "parquet", output_file is a directory and the
+    crashes are stored as a Parquet data set partitioned by year and
+    month (see crash_utils/crash_parquet_store.py).  The new data set
+    replaces the whole directory, so nothing of an earlier download is
+    left behind.
+
+    A custom SoSQL query is sent as a single request.  Note it must
+    specify a very high limit because queries default to 1000 records.
 
     """
 
     import os
+    import uuid
+    import shutil
     import pandas as pd
     from sodapy import Socrata
+    from crash_utils.soda_page_to_frame import soda_page_to_frame
+    from crash_utils.crash_parquet_store import write_crash_parquet
 
 
-    # set up the Socrata client
-    # use custom token to remove throttling):
-    client = Socrata("data.cityofnewyork.us", token)
-
-
-    # If a custom SoSQL query is not specified, set one up to retrieve
-    # records containing bike crashes.  Note we have to specify a very
-    # high limit because the query defaults to 1000 records
+    # If a custom SoSQL query is not specified, page through the
+    # records containing bike crashes
 
     if query is None:
         print("Using default query bicycle crash parameters")
-        query = """
-                select *
-                where
-                VEHICLE_TYPE_CODE1 = 'Bike' OR VEHICLE_TYPE_CODE1 = 'BICYCLE'
-                OR
-                VEHICLE_TYPE_CODE2 = 'Bike' OR VEHICLE_TYPE_CODE2 = 'BICYCLE'
-                OR
-                VEHICLE_TYPE_CODE_3 = 'Bike' OR VEHICLE_TYPE_CODE_3 = 'BICYCLE'
-                OR
-                VEHICLE_TYPE_CODE_4 = 'Bike' OR VEHICLE_TYPE_CODE_4 = 'BICYCLE'
-                OR
-                VEHICLE_TYPE_CODE_5 = 'Bike' OR VEHICLE_TYPE_CODE_5 = 'BICYCLE'
-                OR
-                NUMBER_OF_CYCLIST_INJURED > 0 OR NUMBER_OF_CYCLIST_KILLED > 0
-                limit 1000000
-                """
+        pages = (soda_page_to_frame(results)
+                 for results in _sodapy_pages(token, BIKE_CRASH_WHERE, page_size, 0))
 
+    else:
+        # set up the Socrata client
+        # use custom token to remove throttling):
+        client = Socrata(SODA_DOMAIN, token)
 
-    # results returned as JSON from API / converted to Python list of
-    # dictionaries by sodapy.
-    results = client.get("h9gi-nx95", query=query)
+        # results returned as JSON from API / converted to Python list
+        # of dictionaries by sodapy.
+        results = client.get(CRASH_DATASET_ID, query=query)
+        pages = [format_crash_columns(pd.DataFrame.from_records(results))]
 
 
-    # results is a list of dictionaries.  each dictionary is a crash
-    # Convert to pandas DataFrame
-    df = pd.DataFrame.from_records(results)
+    frames = []
+    n_crashes = 0
 
-    print(f"Retrieved {df.shape[0]} crashes involving bicycles")
+    # the pages are written to a temporary file (or Parquet data set)
+    # next to output_file, which only replaces it once every page is
+    # in, so a failed download leaves the old one as it was
+    if output_file is not None:
+        tmp_path = f"{output_file.rstrip(os.sep)}.tmp-{uuid.uuid4().hex}"
 
+    try:
 
-    # sodapy goofs up a few column names
-    df.rename(columns={"vehicle_type_code1": "vehicle_type_code_1",
-                       "vehicle_type_code2": "vehicle_type_code_2"},inplace=True)
+        for page in pages:
 
+            if output_file is not None and output_format == "parquet":
+                write_crash_parquet(page, tmp_path, append = True)
+            elif output_file is not None:
+                page.to_csv(path_or_buf = tmp_path, index=False,
+                            mode = "a" if n_crashes > 0 else "w",
+                            header = n_crashes == 0)
 
-    # remove underscores from column names
-    df.columns = df.columns.str.replace('_', ' ')
+            n_crashes += len(page)
 
+            if return_df:
+                frames.append(page)
 
-    if output_file is not None:
-        df.to_csv(path_or_buf = output_file, index=False)
+    except BaseException:
+        if output_file is not None and os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        elif output_file is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+    # swap the new file in for the old one
+    if output_file is not None and os.path.exists(tmp_path):
+        if os.path.isdir(output_file):
+            shutil.rmtree(output_file)
+        elif os.path.exists(output_file):
+            os.remove(output_file)
+        os.replace(tmp_path, output_file)
+
+
+    print(f"Retrieved {n_crashes} crashes involving bicycles")
+
+    if output_file is not None and n_crashes > 0:
         print(f"Wrote file: {os.getcwd()}/{output_file}")
 
 
+    if not return_df:
+        return None
+
+    if len(frames) == 0:
+        return pd.DataFrame()
+
+    return pd.concat(frames, ignore_index=True)
+
+
+
+def retrieve_nyc_crashes_soda_incremental(output_file, token=None, where=None,
+                                          page_size=50000, checkpoint_file=None,
+                                          workers=1, output_format="csv"):
+
+    """Append crashes that are newer than those already in output_file.
+
+    Instead of re-downloading the whole table, this pages through the
+    API ordered by crash_date and collision_id ($order, $offset and
+    $limit), asking only for records past the local high-water mark:
+    the latest crash date in output_file and, on that date, the largest
+    collision id.  Each page is appended to output_file as soon as it
+    arrives.
+
+    Progress is saved to checkpoint_file (output_file +
+    ".checkpoint.json" by default) after every page, so a run that is
+    interrupted picks up at the page where it stopped.  The checkpoint
+    is removed once the download finishes.  A page can be written out
+    before the run is killed but after the last checkpoint; so that
+    it isn't appended twice, the checkpoint also holds the size of the
+    csv file, which is truncated back to it on resuming, and Parquet
+    pages are written to files named after the run and the page offset,
+    which the resumed run overwrites.
+
+    With workers > 1 the pages are requested concurrently (see
+    crash_utils/fetch_soda_pages.py) but still appended in order.
+
+    With output_format = "parquet", output_file is a Parquet data set
+    written by crash_utils/crash_parquet_store.py and the new crashes
+    are added to it.
+
+    where defaults to the bike crash filter used by
+    retrieve_nyc_crashes_soda().  Returns the number of crashes
+    appended.
+
+    """
+
+    import os
+    import json
+    import uuid
+    import pandas as pd
+    from crash_utils.fetch_soda_pages import fetch_soda_pages
+    from crash_utils.soda_page_to_frame import soda_page_to_frame, CRASH_COLUMNS
+    from crash_utils.crash_parquet_store import write_crash_parquet
+
+
+    if where is None:
+        where = BIKE_CRASH_WHERE
+
+    if checkpoint_file is None:
+        checkpoint_file = output_file + ".checkpoint.json"
+
+
+    # resume an interrupted run, otherwise start past the newest crash
+    # already on disk
+    if os.path.exists(checkpoint_file):
+        with open(checkpoint_file) as f:
+            checkpoint = json.load(f)
+        print(f"Resuming from {checkpoint_file} at offset {checkpoint['offset']}")
+    else:
+        crash_date, collision_id = crash_high_water_mark(output_file)
+        checkpoint = {"crash date": crash_date,
+                      "collision id": collision_id,
+                      "offset": 0,
+                      "run": uuid.uuid4().hex,
+                      "bytes": None}
+
+        if output_format == "csv" and os.path.exists(output_file):
+            checkpoint["bytes"] = os.path.getsize(output_file)
+
+
+    # drop anything written after the last checkpoint
+    if output_format == "csv" and checkpoint.get("bytes") is not None and os.path.exists(output_file):
+        if os.path.getsize(output_file) > checkpoint["bytes"]:
+            with open(output_file, "r+b") as f:
+                f.truncate(checkpoint["bytes"])
+
+
+    # only ask for records past the high-water mark.  the mark stays
+    # fixed for the whole run (it is stored in the checkpoint) so that
+    # the offsets of the pages don't shift underneath us
+    if checkpoint["crash date"] is not None:
+        hwm_date = checkpoint["crash date"]
+        hwm_id = checkpoint["collision id"]
+        where = f"""({where})
+                    AND
+                    (crash_date > '{hwm_date}'
+                     OR (crash_date = '{hwm_date}' AND collision_id > {hwm_id}))"""
+        print(f"Retrieving crashes after {hwm_date}, collision id {hwm_id}")
+
+
+    # use the columns (and their order) of the existing file so that the
+    # appended rows line up with the header
+    if os.path.exists(output_file) and output_format == "csv":
+        columns = pd.read_csv(output_file, nrows=0).columns.tolist()
+    else:
+        columns = CRASH_COLUMNS
+
+
+    offset = checkpoint["offset"]
+    n_appended = 0
+
+    if workers > 1:
+        url = f"https://{SODA_DOMAIN}/resource/{CRASH_DATASET_ID}.json"
+        pages = fetch_soda_pages(url, where=where, order="crash_date, collision_id",
+                                 page_size=page_size, start_offset=offset,
+                                 max_workers=workers, token=token)
+    else:
+        pages = _sodapy_pages(token, where, page_size, offset)
+
+    for results in pages:
+
+        page = soda_page_to_frame(results, columns)
+
+        if output_format == "parquet":
+            write_crash_parquet(page, output_file, append=True,
+                                basename=f"page-{checkpoint.get('run', 'run')}-{offset}")
+        else:
+            page.to_csv(output_file, mode="a", index=False,
+                        header=not os.path.exists(output_file) or os.path.getsize(output_file) == 0)
+
+        offset += len(results)
+        n_appended += len(results)
+
+
+        # write the checkpoint atomically so a crash mid-write can't
+        # leave a corrupt file behind
+        checkpoint["offset"] = offset
+        if output_format == "csv":
+            checkpoint["bytes"] = os.path.getsize(output_file)
+        with open(checkpoint_file + ".tmp", "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(checkpoint_file + ".tmp", checkpoint_file)
+
+        print(f"Appended {n_appended} crashes", end="\r")
+
+
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
+    print(f"Appended {n_appended} new crashes to {output_file}")
+
+
+    return n_appended
+
+
+
+def _sodapy_pages(token, where, page_size, offset):
+
+    """Page through the crash table one request at a time with sodapy."""
+
+    from sodapy import Socrata
+
+
+    client = Socrata(SODA_DOMAIN, token)
+
+    while True:
+
+        results = client.get(CRASH_DATASET_ID, where=where,
+                             order="crash_date, collision_id",
+                             limit=page_size, offset=offset)
+
+        if len(results) == 0:
+            return
+
+        yield results
+
+        if len(results) < page_size:
+            return
+
+        offset += len(results)
+
+
+
+def crash_high_water_mark(output_file):
+
+    """Return the (crash date, collision id) of the newest crash in
+    output_file, formatted for a SoQL query, or (None, None) if the
+    file doesn't exist yet.  output_file may be a csv file or a Parquet
+    data set directory.
+
+    """
+
+    import os
+    import pandas as pd
+    from crash_utils.crash_parquet_store import read_crash_parquet
+    from crash_utils.parse_crash_datetime import parse_crash_date
+
+
+    if not os.path.exists(output_file):
+        return None, None
+
+    if os.path.isdir(output_file):
+        df = read_crash_parquet(output_file, columns=["datetime", "collision id"])
+        df = df.rename(columns={"datetime": "crash date"})
+    else:
+        df = pd.read_csv(output_file, usecols=["crash date", "collision id"])
+
+    df = df.dropna()
+
+    if len(df) == 0:
+        return None, None
+
+    # the API's crash_date is the date only, at midnight
+    crash_date = parse_crash_date(df["crash date"])
+    latest = crash_date == crash_date.max()
+
+    hwm_date = crash_date.max().strftime("%Y-%m-%dT%H:%M:%S.000")
+    hwm_id = int(df.loc[latest, "collision id"].max())
+
+    return hwm_date, hwm_id
+
+
+
+def format_crash_columns(df):
+
+    """Fix up the column names of a DataFrame built from the raw API
+    records."""
+
+    # sodapy goofs up a few column names
+    df = df.rename(columns={"vehicle_type_code1": "vehicle_type_code_1",
+                            "vehicle_type_code2": "vehicle_type_code_2"})
+
+
+    # remove underscores from column names
+    df.columns = df.columns.str.replace('_', ' ')
+
     return df
 
 
@@ -101,6 +389,16 @@ if __name__ == "__main__":
     my_parser.add_argument("--token", type=str, help="User's token")
     my_parser.add_argument("output", type=str, help="Data output file name")
     my_parser.add_argument("--query", type=str, help="SoSQL query string")
+    my_parser.add_argument("--incremental", action="store_true",
+                           help="Only append crashes newer than those already in the output file")
+    my_parser.add_argument("--page-size", type=int, default=50000,
+                           help="Records per request")
+    my_parser.add_argument("--checkpoint", type=str,
+                           help="Checkpoint file for resuming an incremental download")
+    my_parser.add_argument("--format", type=str, choices=["csv", "parquet"], default="csv",
+                           help="Write a csv file or a Parquet data set partitioned by year/month")
+    my_parser.add_argument("--workers", type=int, default=1,
+                           help="Number of pages to request concurrently in incremental mode")
 
     args = my_parser.parse_args()
 
@@ -108,4 +406,13 @@ if __name__ == "__main__":
     my_query = args.query
     outfile = args.output
 
-    retrieve_nyc_crashes_soda(token=my_token, query=my_query, output_file=outfile)
+    if args.incremental:
+        retrieve_nyc_crashes_soda_incremental(outfile, token=my_token,
+                                              page_size=args.page_size,
+                                              checkpoint_file=args.checkpoint,
+                                              workers=args.workers,
+                                              output_format=args.format)
+    else:
+        retrieve_nyc_crashes_soda(token=my_token, query=my_query, output_file=outfile,
+                                  page_size=args.page_size, return_df=False,
+                                  output_format=args.format)
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+
+"""Score new crashes with the persisted feature transformer and model.
+
+The transformer is a CrashFeatureTransformer saved with its save()
+method (see crash_utils/crash_feature_transformer.py), the model any
+pickled classifier with predict_proba() trained on its output (e.g. a
+Pipeline of SparseReducer and RandomForestClassifier).  Crashes come
+in the shape retrieve_nyc_crashes_soda.py writes them (csv columns or
+the API's JSON records) and each gets the probability that the
+cyclist was injured.
+
+Score a csv file:
+
+    ./score_crashes.py --transformer data/crash_features.pkl --model data/model.pkl \
+                       data/new_crashes.csv --output data/scores.csv
+
+or serve requests on http://localhost:8000/score (POST a csv file or a
+JSON list of records; GET /stats for the latency percentiles):
+
+    ./score_crashes.py --transformer data/crash_features.pkl --model data/model.pkl --serve
+
+"""
+
+from functools import lru_cache
+
+
+class CrashScorer:
+
+    """Cleans raw crash records and returns injury probabilities.
+
+    The transformer and model are loaded once (and shared by every
+    scorer using the same files, until they change on disk).  Every
+    call to score() is timed; percentiles() gives the latency
+    percentiles of the recent calls.
+
+    """
+
+    def __init__(self, transformer_file, model_file, history=10000):
+
+        from collections import deque
+
+
+        self.transformer, self.model = load_scoring_models(transformer_file, model_file)
+
+        if not hasattr(self.model, "predict_proba"):
+            raise TypeError(f"the model in {model_file} has no predict_proba()")
+
+        # column of the injury class in predict_proba()
+        self.injury_column = list(self.model.classes_).index(1)
+
+        self.latencies = deque(maxlen=history)
+
+        # import the cleaning functions (and with them scipy and
+        # friends) now rather than on the first request
+        import crash_utils.basic_cleaning
+        import crash_utils.crash_pipeline
+        import crash_utils.zip_code_and_borough_from_coords
+
+
+    def score(self, df):
+
+        """Injury probability of every row of df, NaN for crashes that
+        cannot be scored (no zip code or borough, and no coordinates to
+        look them up from)."""
+
+        import time
+        import numpy as np
+
+
+        t_start = time.perf_counter()
+
+        proba = np.full(len(df), np.nan)
+
+        cleaned = clean_new_crashes(df)
+
+        if len(cleaned) > 0:
+            X = self.transformer.transform(cleaned)
+            proba[cleaned.index.to_numpy()] = self.model.predict_proba(X)[:, self.injury_column]
+
+        self.latencies.append((time.perf_counter() - t_start) * 1000)
+
+        return proba
+
+
+    def percentiles(self):
+
+        """Latency percentiles (ms) of the recent calls to score()."""
+
+        import numpy as np
+
+
+        if len(self.latencies) == 0:
+            return {}
+
+        p50, p90, p99 = np.percentile(np.array(self.latencies), [50, 90, 99])
+
+        return {"calls": len(self.latencies), "p50": float(p50), "p90": float(p90), "p99": float(p99)}
+
+
+
+class MicroBatcher:
+
+    """Gathers the crashes of concurrent requests into one call to
+    CrashScorer.score().
+
+    A single worker thread takes the queued requests, waiting at most
+    max_wait seconds for more to arrive, until max_rows crashes are
+    gathered, scores them together and hands each request its own
+    probabilities.  Transforming and predicting a batch costs little
+    more than a single crash, so under load this keeps the latency
+    close to that of one call.
+
+    """
+
+    def __init__(self, scorer, max_rows=2000, max_wait=0.005):
+
+        import queue
+        import threading
+
+
+        self.scorer = scorer
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+
+        self.requests = queue.Queue()
+
+        worker = threading.Thread(target=self._work, daemon=True)
+        worker.start()
+
+
+    def score(self, df):
+
+        from concurrent.futures import Future
+
+        future = Future()
+        self.requests.put((df, future))
+
+        return future.result()
+
+
+    def _work(self):
+
+        import time
+        import queue
+        import numpy as np
+        import pandas as pd
+
+
+        while True:
+
+            batch = [self.requests.get()]
+            n_rows = len(batch[0][0])
+            deadline = time.perf_counter() + self.max_wait
+
+            while n_rows < self.max_rows:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                n_rows += len(batch[-1][0])
+
+            try:
+                proba = self.scorer.score(pd.concat([df for df, _ in batch], ignore_index=True))
+            except Exception:
+                # one bad request shouldn't fail the others: score them
+                # one at a time, so only the culprit gets the error
+                for df, future in batch:
+                    try:
+                        future.set_result(self.scorer.score(df))
+                    except Exception as error:
+                        future.set_exception(error)
+                continue
+
+            bounds = np.cumsum([0] + [len(df) for df, _ in batch])
+
+            for (_, future), start, stop in zip(batch, bounds[:-1], bounds[1:]):
+                future.set_result(proba[start:stop])
+
+
+
+@lru_cache(maxsize=4)
+def _load_models(transformer_file, model_file, mtimes):
+
+    import pickle
+    from crash_utils.crash_feature_transformer import CrashFeatureTransformer
+
+
+    transformer = CrashFeatureTransformer.load(transformer_file)
+
+    with open(model_file, "rb") as infile:
+        model = pickle.load(infile)
+
+    return transformer, model
+
+
+
+def load_scoring_models(transformer_file, model_file):
+
+    """The transformer and model stored in the given files, loaded once
+    and kept in memory; they are only read again when one of the files
+    changes."""
+
+    import os
+
+    mtimes = (os.stat(transformer_file).st_mtime_ns, os.stat(model_file).st_mtime_ns)
+
+    return _load_models(transformer_file, model_file, mtimes)
+
+
+
+def records_to_frame(records):
+
+    """DataFrame of crash records given as a list of dictionaries, with
+    either the API's field names or the csv column names."""
+
+    import pandas as pd
+    from crash_utils.soda_page_to_frame import FLOAT_COLUMNS, INTEGER_COLUMNS
+    from retrieve_nyc_crashes_soda import format_crash_columns
+
+
+    df = pd.DataFrame.from_records(records)
+    df.columns = df.columns.str.lower()
+    df = format_crash_columns(df)
+
+    # the API returns every value as a string
+    for col in FLOAT_COLUMNS + INTEGER_COLUMNS + ["zip code"]:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+
+    return df
+
+
+
+def clean_new_crashes(df):
+
+    """The cleaning steps of the crash pipeline that treat every crash on
+    its own.  Unlike the pipeline, crashes are not filtered to bike
+    crashes or de-duplicated, and the row labels of df are kept, so
+    the result lines up with the input.
+
+    The vehicle names are only normalized here: which of them count as
+    rare (and become "other") was decided on the training crashes, and
+    is applied by the CrashFeatureTransformer."""
+
+    import numpy as np
+    from crash_utils.soda_page_to_frame import CRASH_COLUMNS, FLOAT_COLUMNS, INTEGER_COLUMNS
+    from crash_utils.crash_pipeline import drop_unused_columns
+    from crash_utils.basic_cleaning import clean_crash_rows
+    from crash_utils.fix_vehicle_names import normalize_vehicle_names
+    from crash_utils.zip_code_and_borough_from_coords import zip_code_and_borough_from_coords
+    from crash_utils.zip_code_and_borough_from_coords import NYC_BOUNDS
+
+
+    df = df.reset_index(drop=True)
+
+    # the API leaves null fields out of the records
+    missing = [col for col in CRASH_COLUMNS if col not in df.columns]
+    df = df.assign(**{col: np.nan for col in missing})
+
+    # in a small batch a text column can be all missing, and read_csv
+    # makes it a float column
+    numeric = FLOAT_COLUMNS + INTEGER_COLUMNS + ["zip code"]
+    text = [col for col in df.columns if col not in numeric and col != "datetime"]
+    df = df.astype({col: object for col in text})
+
+    df = drop_unused_columns(df)
+    df = zip_code_and_borough_from_coords(df, bounds=NYC_BOUNDS)
+    df = normalize_vehicle_names(df)
+    df = clean_crash_rows(df)
+
+    return df
+
+
+
+def serve(scorer, host="localhost", port=8000, max_rows=2000, max_wait=0.005):
+
+    """Serve POST /score and GET /stats until interrupted."""
+
+    import io
+    import json
+    import time
+    import pandas as pd
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+    batcher = MicroBatcher(scorer, max_rows=max_rows, max_wait=max_wait)
+
+
+    class ScoringHandler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+
+            if self.path != "/score":
+                self._reply(404, {"error": f"unknown path {self.path}"})
+                return
+
+            t_start = time.perf_counter()
+
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            try:
+                if "csv" in self.headers.get("Content-Type", ""):
+                    df = pd.read_csv(io.BytesIO(body))
+                    df.columns = df.columns.str.lower().str.replace("_", " ")
+                else:
+                    records = json.loads(body)
+                    if isinstance(records, dict):
+                        records = records["records"]
+                    df = records_to_frame(records)
+                proba = batcher.score(df)
+            except Exception as error:
+                self._reply(400, {"error": repr(error)})
+                return
+
+            self._reply(200, {"probabilities": [None if p != p else p for p in proba.tolist()],
+                              "latency ms": (time.perf_counter() - t_start) * 1000,
+                              "scoring latency ms": scorer.percentiles()})
+
+
+        def do_GET(self):
+
+            if self.path != "/stats":
+                self._reply(404, {"error": f"unknown path {self.path}"})
+                return
+
+            self._reply(200, {"scoring latency ms": scorer.percentiles()})
+
+
+        def _reply(self, status, content):
+
+            body = json.dumps(content).encode()
+
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+        def log_message(self, format, *args):
+            pass
+
+
+    server = ThreadingHTTPServer((host, port), ScoringHandler)
+
+    print(f"scoring crashes on http://{host}:{port}/score")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+
+def score_file(scorer, input_file, output_file=None, batch_size=10000):
+
+    """Score a csv file of crashes batch_size rows at a time.  Writes
+    the collision id and injury probability of every crash to
+    output_file (or prints them)."""
+
+    import pandas as pd
+
+
+    first = True
+
+    for chunk in pd.read_csv(input_file, chunksize=batch_size):
+
+        chunk.columns = chunk.columns.str.lower().str.replace("_", " ")
+
+        scores = pd.DataFrame({"collision id": chunk["collision id"].to_numpy(),
+                               "injury probability": scorer.score(chunk)})
+
+        if output_file is None:
+            print(scores.to_csv(index=False, header=first), end="")
+        else:
+            scores.to_csv(output_file, mode="w" if first else "a", index=False, header=first)
+
+        first = False
+
+
+
+if __name__ == "__main__":
+
+    import sys
+    import argparse
+
+    my_parser = argparse.ArgumentParser(description="Score NYC crashes with the persisted model")
+
+    my_parser.add_argument("--transformer", type=str, required=True,
+                           help="Saved CrashFeatureTransformer")
+    my_parser.add_argument("--model", type=str, required=True,
+                           help="Pickled classifier with predict_proba()")
+    my_parser.add_argument("input", type=str, nargs="?",
+                           help="csv file of crashes to score")
+    my_parser.add_argument("--output", type=str,
+                           help="Output csv file (default: standard output)")
+    my_parser.add_argument("--batch-size", type=int, default=10000,
+                           help="Crashes scored at a time from the input file")
+    my_parser.add_argument("--serve", action="store_true",
+                           help="Serve scoring requests over HTTP")
+    my_parser.add_argument("--host", type=str, default="localhost")
+    my_parser.add_argument("--port", type=int, default=8000)
+    my_parser.add_argument("--max-wait", type=float, default=0.005,
+                           help="Seconds to wait for more requests to batch together")
+
+    args = my_parser.parse_args()
+
+    my_scorer = CrashScorer(args.transformer, args.model)
+
+    if args.serve:
+        serve(my_scorer, host=args.host, port=args.port, max_wait=args.max_wait)
+    elif args.input is not None:
+        score_file(my_scorer, args.input, args.output, batch_size=args.batch_size)
+        print(f"scoring latency ms: {my_scorer.percentiles()}", file=sys.stderr)
+    else:
+        my_parser.error("give an input file or --serve")
@@ -0,0 +1,61 @@
+"""Check clean_crashes_chunked() against the serial cleaning,
+basic_cleaning(fix_vehicle_names(df)).
+
+Run from the top of the repo:
+
+    python -m pytest tests
+
+"""
+
+import pandas as pd
+import pytest
+
+from crash_utils.synthetic_crashes import synthetic_crashes
+from crash_utils.clean_crashes_chunked import clean_crashes_chunked, _read_chunks
+from crash_utils.basic_cleaning import basic_cleaning
+from crash_utils.fix_vehicle_names import fix_vehicle_names
+
+
+
+@pytest.fixture
+def crash_csv(tmp_path):
+
+    raw = synthetic_crashes(3000, seed=1)
+
+    # crashes without a date are kept (with a NaT datetime) by the
+    # serial cleaning
+    raw.loc[[3, 10, 20], "crash date"] = None
+
+    path = tmp_path / "crashes.csv"
+    raw.to_csv(path, index=False)
+
+    return str(path)
+
+
+
+def serial_cleaning(path):
+
+    df = next(_read_chunks(path, chunksize=10**6))
+
+    return basic_cleaning(fix_vehicle_names(df))
+
+
+
+@pytest.mark.parametrize("output_name", ["cleaned.csv", "cleaned"])
+def test_same_rows_in_same_order_as_serial(crash_csv, tmp_path, output_name):
+
+    output_path = str(tmp_path / output_name)
+
+    n_written = clean_crashes_chunked(crash_csv, output_path, chunksize=700)
+
+    if output_name.endswith(".csv"):
+        chunked = pd.read_csv(output_path)
+    else:
+        chunked = pd.read_parquet(output_path)
+
+    serial = serial_cleaning(crash_csv)
+
+    assert serial["datetime"].isna().any()
+    assert n_written == len(serial)
+    assert chunked["collision id"].tolist() == serial["collision id"].tolist()
+    assert chunked["datetime"].isna().tolist() == serial["datetime"].isna().tolist()
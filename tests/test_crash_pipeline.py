@@ -0,0 +1,39 @@
+"""Check the default CrashPipeline stages against the notebook order,
+zip_code_and_borough_from_coords(), fix_vehicle_names() and
+basic_cleaning() one after the other.
+
+Run from the top of the repo (the zip code table is read from data/):
+
+    python -m pytest tests
+
+"""
+
+import pandas as pd
+
+from crash_utils.synthetic_crashes import synthetic_crashes
+from crash_utils.crash_pipeline import CrashPipeline
+from crash_utils.zip_code_and_borough_from_coords import zip_code_and_borough_from_coords, NYC_BOUNDS
+from crash_utils.fix_vehicle_names import fix_vehicle_names
+from crash_utils.basic_cleaning import basic_cleaning
+
+
+
+def test_same_result_as_serial_cleaning():
+
+    raw = synthetic_crashes(5000, seed=2)
+
+    # whole minutes, so that many crashes share a datetime and the order
+    # of ties matters
+    raw["crash time"] = raw["crash time"].str.replace(r":\d\d$", ":00", regex=True)
+
+    pipe = CrashPipeline()
+    piped = pipe.run(raw.copy())
+
+    serial = basic_cleaning(fix_vehicle_names(zip_code_and_borough_from_coords(raw.copy(),
+                                                                               bounds=NYC_BOUNDS)))
+
+    assert serial["datetime"].duplicated().any()
+    pd.testing.assert_frame_equal(piped, serial)
+
+    # memory tracking is off unless asked for
+    assert "peak MB" not in pipe.report().columns
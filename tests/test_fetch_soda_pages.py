@@ -0,0 +1,171 @@
+"""Check fetch_soda_pages() against a local stand-in for the SODA API.
+
+Run from the top of the repo:
+
+    python -m pytest tests
+
+The stand-in serves records {"collision_id": "0"}, {"collision_id":
+"1"}, ... with $offset / $limit paging and $select=count(*), and can
+be told to delay pages (so they complete out of order) and to answer
+the first requests for some offsets with an error status and a
+Retry-After header.
+
+"""
+
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+import requests
+
+from crash_utils.fetch_soda_pages import fetch_soda_pages
+
+
+
+class StandInServer:
+
+    def __init__(self, n_records, delay=None, failures=None):
+
+        # delay: seconds to wait before answering a page, by offset
+        # failures: list of (status, Retry-After or None) to answer the
+        # first requests for a page with, by offset
+        self.n_records = n_records
+        self.delay = delay or {}
+        self.failures = {offset: list(answers) for offset, answers in (failures or {}).items()}
+
+        self.requests = []      # (offset, time, status)
+        self.completed = []     # offsets, in the order they were answered
+        self.lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/resource/test.json"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+    def handle(self, request):
+
+        params = {k: v[0] for k, v in parse_qs(urlparse(request.path).query).items()}
+
+        if params.get("$select") == "count(*)":
+            return self.reply(request, 200, [{"count": str(self.n_records)}])
+
+        offset = int(params["$offset"])
+        limit = int(params["$limit"])
+
+        with self.lock:
+            answers = self.failures.get(offset)
+            failure = answers.pop(0) if answers else None
+
+        if failure is not None:
+            status, retry_after = failure
+            with self.lock:
+                self.requests.append((offset, time.monotonic(), status))
+            headers = {} if retry_after is None else {"Retry-After": str(retry_after)}
+            return self.reply(request, status, {"error": "try again"}, headers)
+
+        time.sleep(self.delay.get(offset, 0))
+
+        records = [{"collision_id": str(k)}
+                   for k in range(offset, min(offset + limit, self.n_records))]
+
+        with self.lock:
+            self.requests.append((offset, time.monotonic(), 200))
+            self.completed.append(offset)
+
+        self.reply(request, 200, records)
+
+
+    def reply(self, request, status, body, headers=None):
+
+        data = json.dumps(body).encode()
+
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(data)
+
+
+
+def collision_ids(pages):
+
+    return [int(record["collision_id"]) for page in pages for record in page]
+
+
+
+def test_pages_in_offset_order_when_completed_out_of_order():
+
+    # the first pages are the slowest, so the later ones finish first
+    delay = {0: 0.4, 10: 0.3, 20: 0.2, 30: 0.1}
+
+    with StandInServer(n_records=55, delay=delay) as server:
+        pages = list(fetch_soda_pages(server.url, page_size=10, max_workers=4, backoff=0.01))
+
+    assert [len(page) for page in pages] == [10, 10, 10, 10, 10, 5]
+    assert collision_ids(pages) == list(range(55))
+    assert server.completed[:4] != sorted(server.completed[:4])
+
+
+
+def test_start_offset():
+
+    with StandInServer(n_records=35) as server:
+        pages = list(fetch_soda_pages(server.url, page_size=10, start_offset=20, max_workers=2))
+
+    assert collision_ids(pages) == list(range(20, 35))
+
+
+
+def test_retry_after_is_honoured():
+
+    failures = {10: [(429, 0.5)], 20: [(503, None), (503, None)]}
+
+    with StandInServer(n_records=30, failures=failures) as server:
+        pages = list(fetch_soda_pages(server.url, page_size=10, max_workers=3, backoff=0.01))
+
+    assert collision_ids(pages) == list(range(30))
+
+    # the throttled page was asked for again only after Retry-After
+    times = [t for offset, t, _ in server.requests if offset == 10]
+    assert len(times) == 2
+    assert times[1] - times[0] >= 0.45
+
+    # the server errors were retried with backoff
+    statuses = [status for offset, _, status in server.requests if offset == 20]
+    assert statuses == [503, 503, 200]
+
+
+
+def test_gives_up_after_max_retries():
+
+    failures = {0: [(429, 0)] * 10}
+
+    with StandInServer(n_records=10, failures=failures) as server:
+        with pytest.raises(requests.HTTPError):
+            list(fetch_soda_pages(server.url, page_size=10, max_workers=1, max_retries=2))
+
+    assert len([offset for offset, _, _ in server.requests if offset == 0]) == 3
@@ -0,0 +1,64 @@
+"""Check parallel_clean_crashes() and parallel_crash_features() against
+the serial functions.
+
+Run from the top of the repo (the zip code table is read from data/):
+
+    python -m pytest tests
+
+"""
+
+import pandas as pd
+import pytest
+
+from crash_utils.synthetic_crashes import synthetic_crashes
+from crash_utils.fix_vehicle_names import fix_vehicle_names
+from crash_utils.basic_cleaning import basic_cleaning
+from crash_utils.make_crash_features import make_crash_features
+from crash_utils.zip_code_and_borough_from_coords import zip_code_and_borough_from_coords
+from crash_utils.parallel_cleaning import parallel_clean_crashes, parallel_crash_features
+
+
+
+@pytest.fixture(scope="module")
+def raw():
+
+    df = zip_code_and_borough_from_coords(synthetic_crashes(4000, seed=3))
+
+    # whole minutes, so that many crashes share a datetime and the order
+    # of ties matters
+    df["crash time"] = df["crash time"].str.replace(r":\d\d$", ":00", regex=True)
+
+    # duplicate rows (in different blocks) and a name rare enough to
+    # become "other" only when counted over the whole table
+    df = pd.concat([df, df.iloc[:50]], ignore_index=True)
+    df.loc[::997, "vehicle type code 1"] = "E-Bike-rare"
+
+    return df
+
+
+
+@pytest.mark.parametrize("n_workers, n_blocks", [(1, 3), (2, 5)])
+def test_parallel_clean_crashes_same_as_serial(raw, n_workers, n_blocks):
+
+    before = raw.copy()
+
+    serial = basic_cleaning(fix_vehicle_names(raw.copy()))
+    parallel = parallel_clean_crashes(raw, n_workers=n_workers, n_blocks=n_blocks)
+
+    assert serial["datetime"].duplicated().any()
+    pd.testing.assert_frame_equal(parallel, serial)
+
+    # the input is left as it was
+    pd.testing.assert_frame_equal(raw, before)
+
+
+
+@pytest.mark.parametrize("categorical", [False, True])
+def test_parallel_crash_features_same_as_serial(raw, categorical):
+
+    cleaned = basic_cleaning(fix_vehicle_names(raw.copy()))
+
+    serial = make_crash_features(cleaned.copy(), categorical=categorical)
+    parallel = parallel_crash_features(cleaned, n_workers=2, n_blocks=3, categorical=categorical)
+
+    pd.testing.assert_frame_equal(parallel, serial)